@@ -0,0 +1,78 @@
+"""Synthetic markdown corpus for benchmarks.
+
+    python bench/corpus.py --docs 1000 --out /tmp/corpus
+
+Documents are deterministic for a given seed and look like real uploads: YAML
+frontmatter with an id, headings, paragraphs, bullet lists and code blocks, with
+a long-tailed size distribution so token-aware routing and chunking get exercised.
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from utils.md_processor import MDProcessor
+
+CATEGORIES = ["Engineering", "Research", "Operations", "Finance", "Legal", "Meetings"]
+
+WORDS = (
+    "system data model pipeline latency throughput query index vector cache worker queue "
+    "server request response token prompt summary metadata document review search embedding "
+    "database schema migration backup deploy release incident report budget contract policy "
+    "meeting decision action owner deadline risk customer feature roadmap design proposal "
+    "analysis result experiment baseline metric dashboard alert config cluster node memory"
+).split()
+
+def _sentence(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(6, 18))]
+    return " ".join(words).capitalize() + "."
+
+def _paragraph(rng):
+    return " ".join(_sentence(rng) for _ in range(rng.randint(2, 6)))
+
+def generate_document(rng, target_words):
+    """One markdown body of roughly `target_words` words."""
+    parts = [f"# {' '.join(rng.choice(WORDS) for _ in range(4)).title()}"]
+    words = 0
+    while words < target_words:
+        r = rng.random()
+        if r < 0.15:
+            block = f"## {' '.join(rng.choice(WORDS) for _ in range(3)).title()}"
+        elif r < 0.3:
+            block = "\n".join(f"- {_sentence(rng)}" for _ in range(rng.randint(2, 6)))
+        elif r < 0.35:
+            block = "```python\n" + "\n".join(f"{rng.choice(WORDS)} = {rng.randint(0, 999)}" for _ in range(rng.randint(2, 8))) + "\n```"
+        else:
+            block = _paragraph(rng)
+        parts.append(block)
+        words += len(block.split())
+    return "\n\n".join(parts)
+
+def generate_corpus(n, seed=42, median_words=400, max_words=20000):
+    """Returns n dicts with id, filename, category, title and content (frontmatter included).
+    Sizes are log-normal around `median_words`, so a few documents exceed most context windows."""
+    rng = random.Random(seed)
+    docs = []
+    for i in range(n):
+        target = min(max_words, max(30, int(rng.lognormvariate(0, 1.0) * median_words)))
+        doc_id = MDProcessor.generate_uuid_v7()
+        category = rng.choice(CATEGORIES)
+        body = generate_document(rng, target)
+        content = f"---\nid: {doc_id}\ncategory: {category}\n---\n\n{body}\n"
+        docs.append({"id": doc_id, "filename": f"doc_{i:06d}.md", "category": category,
+                     "title": body.splitlines()[0].lstrip("# "), "content": content})
+    return docs
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic markdown corpus.")
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--median-words", type=int, default=400)
+    parser.add_argument("--out", required=True)
+    args = parser.parse_args()
+    os.makedirs(args.out, exist_ok=True)
+    for doc in generate_corpus(args.docs, args.seed, args.median_words):
+        with open(os.path.join(args.out, doc["filename"]), "w", encoding="utf-8") as f:
+            f.write(doc["content"])
+    print(f"Wrote {args.docs} documents to {args.out}")
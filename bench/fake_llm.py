@@ -0,0 +1,145 @@
+"""Stub OpenAI-compatible inference server for benchmarks.
+
+    python bench/fake_llm.py --port 8099 --latency 0.2 --tokens-per-sec 50 --error-rate 0.01
+
+Serves GET /v1/models and POST /v1/chat/completions. Each completion sleeps for
+`latency` plus completion_tokens / `tokens_per_sec`; requests beyond
+`max_concurrency` get a 429 and a fraction `error_rate` get a 503, so the client's
+adaptive limiter, circuit breaker and retry paths behave as they would against a
+loaded vLLM or llama.cpp server.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakeLLMServer:
+    def __init__(self, port=8099, models=("fake-small", "fake-large"), context_length=8192,
+                 latency=0.2, tokens_per_sec=50.0, completion_tokens=120, error_rate=0.0,
+                 max_concurrency=64, seed=None):
+        self.port = port
+        self.models = list(models)
+        self.context_length = context_length
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.max_concurrency = max_concurrency
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.stats = {"requests": 0, "ok": 0, "throttled": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        self.server = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def _completion(self, body):
+        prompt = "".join(m.get("content", "") for m in body.get("messages", []))
+        prompt_tokens = len(prompt) // 4 + 1
+        n = min(self.completion_tokens, body.get("max_tokens") or self.completion_tokens)
+        time.sleep(self.latency + n / self.tokens_per_sec)
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            content = json.dumps({"date": "2024-01-01", "keywords": ["benchmark", "synthetic"],
+                                  "title": f"Doc {self.rng.randint(0, 99999)}"})
+        else:
+            content = " ".join(["lorem"] * n)
+        with self._lock:
+            self.stats["prompt_tokens"] += prompt_tokens
+            self.stats["completion_tokens"] += n
+        return {
+            "id": f"chatcmpl-{self.rng.getrandbits(32):x}",
+            "object": "chat.completion",
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": n, "total_tokens": prompt_tokens + n},
+        }
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, code, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip("/") != "/v1/models":
+                    return self._send(404, {"error": "not found"})
+                self._send(200, {"object": "list", "data": [
+                    {"id": m, "object": "model", "max_model_len": server.context_length} for m in server.models]})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if self.path.rstrip("/") != "/v1/chat/completions":
+                    return self._send(404, {"error": "not found"})
+                with server._lock:
+                    server.stats["requests"] += 1
+                    throttled = server.in_flight >= server.max_concurrency
+                    if not throttled:
+                        server.in_flight += 1
+                if throttled:
+                    with server._lock:
+                        server.stats["throttled"] += 1
+                    return self._send(429, {"error": "too many requests"})
+                try:
+                    if server.rng.random() < server.error_rate:
+                        with server._lock:
+                            server.stats["errors"] += 1
+                        return self._send(503, {"error": "injected failure"})
+                    if body.get("model") not in server.models:
+                        return self._send(404, {"error": f"model {body.get('model')} not found"})
+                    payload = server._completion(body)
+                    with server._lock:
+                        server.stats["ok"] += 1
+                    self._send(200, payload)
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", self.port), self._make_handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stub OpenAI-compatible LLM server.")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--models", default="fake-small,fake-large")
+    parser.add_argument("--context-length", type=int, default=8192)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0)
+    parser.add_argument("--completion-tokens", type=int, default=120)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--max-concurrency", type=int, default=64)
+    args = parser.parse_args()
+    srv = FakeLLMServer(args.port, args.models.split(","), args.context_length, args.latency, args.tokens_per_sec,
+                        args.completion_tokens, args.error_rate, args.max_concurrency).start()
+    print(f"Fake LLM server on {srv.base_url}")
+    try:
+        while True:
+            time.sleep(60)
+            print(json.dumps(srv.stats))
+    except KeyboardInterrupt:
+        srv.stop()
@@ -0,0 +1,275 @@
+"""End-to-end benchmark: ingest, worker throughput and search latency against a local
+Postgres + pgvector, with the LLM replaced by bench/fake_llm.py.
+
+    DB_NAME=bench_db python bench/run_bench.py --docs 500 --workers 2 --engine async
+    python bench/run_bench.py --compare bench/results/a.json bench/results/b.json
+
+Every run writes bench/results/<timestamp>-<commit>.json with the parameters, the
+measurements and the fake server's counters. The target database is wiped first,
+so its name must contain "bench" (or pass --force).
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+SRC_DIR = os.path.join(ROOT_DIR, "src")
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from db_manager import DBManager
+from corpus import generate_corpus, WORDS
+from fake_llm import FakeLLMServer
+
+EMBED_DIM = 384
+SEARCH_RESULT_LIMIT = 100 # ui/tab_search.py default page size
+BENCH_TABLES = ["processing_tasks", "task_events", "stage_outputs", "documents", "workers", "worker_metrics", "slow_queries"]
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def latency_summary(seconds):
+    ms = [s * 1000 for s in seconds]
+    return {"count": len(ms), "mean_ms": round(statistics.mean(ms), 2) if ms else None,
+            "p50_ms": round(percentile(ms, 0.5), 2) if ms else None,
+            "p99_ms": round(percentile(ms, 0.99), 2) if ms else None}
+
+def random_embedding(rng):
+    v = [rng.gauss(0, 1) for _ in range(EMBED_DIM)]
+    norm = sum(x * x for x in v) ** 0.5
+    return [x / norm for x in v]
+
+def rss_mb(pid):
+    """Current and peak resident set size of a process, from /proc (Linux only)."""
+    out = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key, value = line.split(":")
+                    out[key] = round(int(value.split()[0]) / 1024, 1)
+    except OSError:
+        pass
+    return out
+
+def git_commit():
+    try:
+        sha = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT_DIR, text=True).strip())
+        return sha, dirty
+    except Exception:
+        return "unknown", False
+
+def reset_db(db):
+    with db.get_conn("reset_db") as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"TRUNCATE {', '.join(BENCH_TABLES)} CASCADE")
+        conn.commit()
+
+def task_config(models):
+    return {
+        "model_l": models[0],
+        "model_r": models[-1],
+        "model_long": None,
+        "prompt_summary": "Summarize the following document concisely.",
+        "prompt_meta": "Extract the document date, key technical keywords, and a short descriptive title.",
+    }
+
+def bench_ingest(db, docs, args, rng):
+    """Upload-tab path: upsert + enqueue per document (embeddings are random unless --real-embed)."""
+    start = time.monotonic()
+    per_doc = []
+    for doc in docs:
+        t0 = time.monotonic()
+        embedding = None if args.real_embed else random_embedding(rng)
+        db.upsert_document(doc["id"], doc["category"], "L0", {"category": doc["category"]}, doc["content"], embedding, title=doc["filename"])
+        db.enqueue_task(doc["id"], config={"filename": doc["filename"], "title": doc["title"]})
+        per_doc.append(time.monotonic() - t0)
+    elapsed = time.monotonic() - start
+    return {"docs": len(docs), "seconds": round(elapsed, 2), "docs_per_sec": round(len(docs) / elapsed, 1),
+            "per_doc": latency_summary(per_doc)}
+
+def bench_worker(db, docs, args, llm):
+    """Queues every document and times the supervised workers until the queue drains."""
+    config = task_config(llm.models)
+    db.queue_tasks([doc["id"] for doc in docs], config=config)
+
+    env = dict(os.environ, LLM_BASE_URLS=llm.base_url, METRICS_PORT=str(args.metrics_port))
+    proc = subprocess.Popen([sys.executable, os.path.join(SRC_DIR, "supervisor.py"),
+                             "--workers", str(args.workers), "--engine", args.engine],
+                            cwd=SRC_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    start = time.monotonic()
+    first_done = None
+    peak_rss = {}
+    counts = {}
+    try:
+        while time.monotonic() - start < args.timeout:
+            time.sleep(1)
+            counts = {r["status"]: r["depth"] for r in db.get_queue_stats()}
+            if first_done is None and counts.get("done"):
+                first_done = time.monotonic() - start
+            for w in db.get_workers():
+                if w["alive"]:
+                    peak = rss_mb(w["pid"]).get("VmHWM")
+                    if peak:
+                        peak_rss[w["worker_id"]] = max(peak, peak_rss.get(w["worker_id"], 0))
+            pending = sum(v for k, v in counts.items() if k not in ("done", "dead", "failed"))
+            if pending == 0:
+                break
+        elapsed = time.monotonic() - start
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    done = counts.get("done", 0)
+    return {"workers": args.workers, "engine": args.engine, "seconds": round(elapsed, 2),
+            "done": done, "dead": counts.get("dead", 0), "unfinished": len(docs) - done - counts.get("dead", 0),
+            "docs_per_min": round(done / elapsed * 60, 1) if elapsed else None,
+            "first_done_seconds": round(first_done, 2) if first_done is not None else None,
+            "worker_peak_rss_mb": peak_rss}
+
+def bench_search(db, args, rng):
+    vector, keyword, keyword_cached, passage, recall = [], [], [], [], []
+    searched = set()
+    for _ in range(args.searches):
+        emb = random_embedding(rng)
+        t0 = time.monotonic()
+        hits = db.vector_search(emb, limit=10, mode=args.vector_mode)
+        vector.append(time.monotonic() - t0)
+        if args.vector_mode != "exact":
+            # recall@10 of the quantized shortlist + re-rank against an exact scan
+            exact = {r["id"] for r in db.vector_search(emb, limit=10, mode="exact")}
+            if exact:
+                recall.append(len(exact & {r["id"] for r in hits}) / len(exact))
+
+        if args.passage_search:
+            t0 = time.monotonic()
+            db.passage_search(emb, limit=10)
+            passage.append(time.monotonic() - t0)
+
+        # Same call as the search tab; a repeated word is served from the search cache
+        word = rng.choice(WORDS)
+        t0 = time.monotonic()
+        db.search_page(query_text=word, category=None, level=None, doc_id=None, without_task=False,
+                       limit=SEARCH_RESULT_LIMIT + 1)
+        (keyword_cached if word in searched else keyword).append(time.monotonic() - t0)
+        searched.add(word)
+    out = {"vector_mode": args.vector_mode, "vector": latency_summary(vector), "keyword": latency_summary(keyword)}
+    if keyword_cached:
+        out["keyword_cached"] = latency_summary(keyword_cached)
+    if passage:
+        out["passage"] = latency_summary(passage)
+    if recall:
+        out["vector_recall_at_10"] = round(statistics.mean(recall), 4)
+    return out
+
+def compare(path_a, path_b):
+    """Prints every numeric result of two runs side by side with the relative change."""
+    with open(path_a) as f:
+        a = json.load(f)
+    with open(path_b) as f:
+        b = json.load(f)
+
+    def flatten(d, prefix=""):
+        for k, v in d.items():
+            if isinstance(v, dict):
+                yield from flatten(v, f"{prefix}{k}.")
+            elif isinstance(v, (int, float)) and not isinstance(v, bool):
+                yield f"{prefix}{k}", v
+
+    fa, fb = dict(flatten(a["results"])), dict(flatten(b["results"]))
+    print(f"{'metric':45} {a['commit']:>12} {b['commit']:>12} {'change':>9}")
+    for key in sorted(set(fa) | set(fb)):
+        va, vb = fa.get(key), fb.get(key)
+        change = f"{(vb - va) / va:+.1%}" if va and vb is not None else ""
+        print(f"{key:45} {va if va is not None else '-':>12} {vb if vb is not None else '-':>12} {change:>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest, workers and search with a fake LLM.")
+    parser.add_argument("--docs", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--median-words", type=int, default=400)
+    parser.add_argument("--real-embed", action="store_true", help="leave embeddings NULL so workers compute them")
+    parser.add_argument("--scenarios", default="ingest,worker,search")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--engine", choices=["sync", "async"], default="sync")
+    parser.add_argument("--timeout", type=float, default=1800, help="max seconds to wait for the queue to drain")
+    parser.add_argument("--searches", type=int, default=200)
+    parser.add_argument("--vector-mode", choices=["exact", "halfvec", "binary"], default="exact")
+    parser.add_argument("--passage-search", action="store_true",
+                        help="also time passage_search (passages come from the worker scenario with --real-embed)")
+    parser.add_argument("--llm-port", type=int, default=8099)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--llm-tokens-per-sec", type=float, default=50.0)
+    parser.add_argument("--llm-completion-tokens", type=int, default=120)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-max-concurrency", type=int, default=64)
+    parser.add_argument("--llm-context-length", type=int, default=8192)
+    parser.add_argument("--metrics-port", type=int, default=9208)
+    parser.add_argument("--out", default=os.path.join(BENCH_DIR, "results"))
+    parser.add_argument("--force", action="store_true", help="allow a database whose name lacks 'bench'")
+    parser.add_argument("--compare", nargs=2, metavar=("A", "B"), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    dbname = os.environ.get("DB_NAME", "test_db")
+    if "bench" not in dbname and not args.force:
+        sys.exit(f"Refusing to wipe database '{dbname}'. Set DB_NAME to a bench database or pass --force.")
+
+    scenarios = args.scenarios.split(",")
+    rng = random.Random(args.seed)
+    llm = FakeLLMServer(args.llm_port, context_length=args.llm_context_length, latency=args.llm_latency,
+                        tokens_per_sec=args.llm_tokens_per_sec, completion_tokens=args.llm_completion_tokens,
+                        error_rate=args.llm_error_rate, max_concurrency=args.llm_max_concurrency, seed=args.seed).start()
+    db = DBManager()
+    reset_db(db)
+
+    docs = generate_corpus(args.docs, args.seed, args.median_words)
+    results = {"corpus": {"docs": len(docs), "total_chars": sum(len(d["content"]) for d in docs)}}
+    try:
+        # Ingest always runs: the other scenarios need the documents
+        results["ingest"] = bench_ingest(db, docs, args, rng)
+        print(f"ingest: {results['ingest']['docs_per_sec']} docs/s")
+        if "worker" in scenarios:
+            results["worker"] = bench_worker(db, docs, args, llm)
+            print(f"worker: {results['worker']['docs_per_min']} docs/min")
+        if "search" in scenarios:
+            results["search"] = bench_search(db, args, rng)
+            print(f"search: vector p50 {results['search']['vector']['p50_ms']} ms, p99 {results['search']['vector']['p99_ms']} ms")
+    finally:
+        llm.stop()
+    results["bench_peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    sha, dirty = git_commit()
+    report = {
+        "commit": sha + ("-dirty" if dirty else ""),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "params": vars(args),
+        "results": results,
+        "fake_llm": llm.stats,
+    }
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{report['commit']}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Results written to {path}")
+
+if __name__ == "__main__":
+    main()
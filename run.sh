@@ -4,8 +4,8 @@
 # Navigate to project directory
 cd /home/ross/pythonproject/doc-manager/src
 
-# Start background worker
-python3 worker.py &
+# Start background workers (supervised, restarted on crash)
+python3 supervisor.py &
 WORKER_PID=$!
 
 # Start Streamlit
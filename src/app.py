@@ -2,13 +2,14 @@ import streamlit as st
 import subprocess
 from db_manager import DBManager
 from llm_client import LLMClient
-from sentence_transformers import SentenceTransformer
+from embedder import make_embedder
 
 # Import Tabs
 from ui.tab_upload import render_upload_tab
 from ui.tab_batch import render_batch_tab
 from ui.tab_review import render_review_tab
 from ui.tab_search import render_search_tab
+from ui.tab_metrics import render_metrics_tab
 
 # Page Config
 st.set_page_config(page_title="Documentation Manager", layout="wide")
@@ -18,15 +19,23 @@ if "db" not in st.session_state:
     st.session_state.db = DBManager()
 if "llm" not in st.session_state:
     st.session_state.llm = LLMClient()
-if "embedder" not in st.session_state:
-    st.session_state.embedder = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
+# Loaded on first encode (EMBED_BACKEND=torch|onnx), so browsing never pays for it.
+# Follows the database's active embedding model (checked on every rerun, so a re-embedding
+# switch-over reaches open sessions) so new vectors match the stored ones.
+active_model = st.session_state.db.get_active_embedding_model()
+if "embedder" not in st.session_state or st.session_state.embedder.model_name != active_model:
+    st.session_state.embedder = make_embedder(active_model)
 if "categories" not in st.session_state:
     st.session_state.categories = ["General", "Personal", "CTC", "Proposal"]
 
 # Sidebar - Settings & Prompt History
 st.sidebar.title("Settings")
-llm_url = st.sidebar.text_input("LLM Base URL", value="http://192.168.1.238:8080/v1")
-st.session_state.llm.base_url = llm_url
+llm_url = st.sidebar.text_input("LLM Base URL(s)", value=st.session_state.llm.base_url,
+                                help="Comma-separated list of OpenAI-compatible endpoints. Calls go to the least loaded healthy one serving the model.")
+if llm_url != st.session_state.llm.base_url:
+    st.session_state.llm.base_url = llm_url
+healthy = sum(1 for ep in st.session_state.llm.get_endpoint_stats() if ep['healthy'])
+st.sidebar.caption(f"{healthy}/{len(st.session_state.llm.endpoints)} endpoints healthy")
 
 st.sidebar.divider()
 st.sidebar.subheader("Recent Prompts")
@@ -36,7 +45,7 @@ for h in history:
         st.session_state.custom_prompt = h
 
 # Tabs
-tab_upload, tab_process, tab_review, tab_search = st.tabs(["1. Upload", "2. Batch Processing", "3. Review & Save", "4. Search & View"])
+tab_upload, tab_process, tab_review, tab_search, tab_metrics = st.tabs(["1. Upload", "2. Batch Processing", "3. Review & Save", "4. Search & View", "5. Metrics"])
 
 # --- Tab 1: Upload & Check ---
 with tab_upload:
@@ -53,3 +62,7 @@ with tab_review:
 # --- Tab 4: Search & View ---
 with tab_search:
     render_search_tab()
+
+# --- Tab 5: Metrics ---
+with tab_metrics:
+    render_metrics_tab()
@@ -0,0 +1,188 @@
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool
+from pgvector.psycopg import register_vector_async
+import metrics
+from db_manager import (
+    CLAIM_TOP_PRIORITY_SQL, CLAIM_TASK_SQL, AGE_TASKS_SQL, FAIL_TASK_SQL,
+    PROMOTE_RETRIES_SQL, SAVE_STAGE_OUTPUT_SQL, HEARTBEAT_SQL, RECOVER_ORPHANED_SQL, WORKER_HEARTBEAT_TIMEOUT,
+    SAVE_WORKER_METRICS_SQL, QUEUE_STATS_SQL, GET_ACTIVE_EMBEDDING_MODEL_SQL, ACTIVE_EMBEDDING_MODEL_SQL,
+    CHUNKS_CURRENT_SQL, DELETE_CHUNKS_SQL, INSERT_CHUNK_SQL, chunk_rows, PRIORITY_AGING_CAP, MAX_TASK_ATTEMPTS, RETRY_BASE_SECONDS, RETRY_MAX_SECONDS,
+    SAVE_TASK_RESULTS_SQL, INSERT_TASK_EVENT_SQL, UNEMBEDDED_DOCS_SQL, FILL_EMBEDDING_SQL, EMBED_SWEEP_GRACE_SECONDS,
+)
+from cpu_stages import EMBED_MODEL
+
+logger = logging.getLogger(__name__)
+
+class AsyncDBManager:
+    """Queue/worker subset of DBManager on psycopg3's async pool, for the asyncio worker.
+    Schema creation and migrations stay in DBManager; the queue SQL is shared with it."""
+    def __init__(self, dbname=os.environ.get("DB_NAME", "test_db"), user=os.environ.get("DB_USER", "root"),
+                 password=os.environ.get("DB_PASSWORD", "lavita!978"), host=os.environ.get("DB_HOST", "localhost"),
+                 port=os.environ.get("DB_PORT", "5432"), max_size=20):
+        conninfo = f"dbname={dbname} user={user} password={password} host={host} port={port}"
+        self.pool = AsyncConnectionPool(conninfo, min_size=1, max_size=max_size, open=False,
+                                        kwargs={"row_factory": dict_row}, configure=register_vector_async)
+
+    async def open(self):
+        await self.pool.open()
+
+    async def close(self):
+        await self.pool.close()
+
+    @asynccontextmanager
+    async def connection(self, method):
+        # Same per-method labels as DBManager.get_conn
+        wait_start = time.monotonic()
+        async with self.pool.connection() as conn:
+            start = time.monotonic()
+            metrics.observe("db_pool_wait_seconds", start - wait_start, method=method)
+            try:
+                yield conn
+            finally:
+                metrics.observe("db_seconds", time.monotonic() - start, method=method)
+
+    async def recover_orphaned_tasks(self):
+        """Same as DBManager.recover_orphaned_tasks: requeue tasks of workers that stopped heartbeating."""
+        async with self.connection("recover_orphaned_tasks") as conn:
+            cur = await conn.execute(RECOVER_ORPHANED_SQL, (WORKER_HEARTBEAT_TIMEOUT,))
+            return [r['doc_id'] for r in await cur.fetchall()]
+
+    async def heartbeat(self, worker_id, hostname, pid, engine, status="running", in_flight=0, tasks_done=0):
+        try:
+            async with self.connection("heartbeat") as conn:
+                await conn.execute(HEARTBEAT_SQL, (worker_id, hostname, pid, engine, status, in_flight, tasks_done))
+        except Exception as e:
+            logger.error(f"Error writing heartbeat: {e}")
+
+    async def save_worker_metrics(self, worker_id, snapshot):
+        try:
+            async with self.connection("save_worker_metrics") as conn:
+                await conn.execute(SAVE_WORKER_METRICS_SQL, (worker_id, Jsonb(snapshot)))
+        except Exception as e:
+            logger.error(f"Error saving worker metrics: {e}")
+
+    async def get_queue_stats(self):
+        async with self.connection("get_queue_stats") as conn:
+            cur = await conn.execute(QUEUE_STATS_SQL)
+            return await cur.fetchall()
+
+    async def claim_next_task(self, after_category=None, worker_id=None):
+        try:
+            async with self.connection("claim_next_task") as conn:
+                async with conn.transaction():
+                    cur = await conn.execute(CLAIM_TOP_PRIORITY_SQL)
+                    top = await cur.fetchone()
+                    if not top:
+                        return None
+                    passes = [("AND category > %s", [after_category]), ("", [])] if after_category else [("", [])]
+                    for cat_clause, cat_params in passes:
+                        cur = await conn.execute(CLAIM_TASK_SQL.format(cat_clause=cat_clause), [worker_id, top['band']] + cat_params)
+                        task = await cur.fetchone()
+                        if task:
+                            return task
+                    return None
+        except Exception as e:
+            logger.error(f"Error claiming task: {e}")
+            return None
+
+    async def get_document(self, doc_id):
+        async with self.connection("get_document") as conn:
+            cur = await conn.execute("SELECT * FROM documents WHERE id = %s", (doc_id,))
+            return await cur.fetchone()
+
+    async def set_embedding(self, doc_id, embedding, embedding_model=None):
+        async with self.connection("set_embedding") as conn:
+            await conn.execute(f"UPDATE documents SET embedding = %s, embedding_model = COALESCE(%s, {ACTIVE_EMBEDDING_MODEL_SQL}) WHERE id = %s",
+                               (embedding, embedding_model, doc_id))
+
+    async def get_active_embedding_model(self):
+        async with self.connection("get_active_embedding_model") as conn:
+            cur = await conn.execute(GET_ACTIVE_EMBEDDING_MODEL_SQL)
+            row = await cur.fetchone()
+            return (row and row['model']) or EMBED_MODEL
+
+    async def get_unembedded_documents(self, limit=32):
+        async with self.connection("get_unembedded_documents") as conn:
+            cur = await conn.execute(UNEMBEDDED_DOCS_SQL, (EMBED_SWEEP_GRACE_SECONDS, limit))
+            return await cur.fetchall()
+
+    async def fill_embeddings(self, model, rows):
+        """Same as DBManager.fill_embeddings."""
+        async with self.connection("fill_embeddings") as conn:
+            async with conn.cursor() as cur:
+                await cur.executemany(FILL_EMBEDDING_SQL, [(vec, model, doc_id, md5) for doc_id, md5, vec in rows])
+
+    async def chunks_current(self, doc_id, model):
+        async with self.connection("chunks_current") as conn:
+            cur = await conn.execute(CHUNKS_CURRENT_SQL, (doc_id, model))
+            return (await cur.fetchone())['current']
+
+    async def save_document_chunks(self, model, docs):
+        """Same as DBManager.save_document_chunks."""
+        if not docs:
+            return
+        async with self.connection("save_document_chunks") as conn:
+            async with conn.transaction():
+                await conn.execute(DELETE_CHUNKS_SQL, ([str(d[0]) for d in docs],))
+                async with conn.cursor() as cur:
+                    await cur.executemany(INSERT_CHUNK_SQL, chunk_rows(model, docs))
+
+    async def get_stage_outputs(self, doc_id):
+        async with self.connection("get_stage_outputs") as conn:
+            cur = await conn.execute("SELECT stage, fingerprint, output FROM stage_outputs WHERE doc_id = %s", (doc_id,))
+            return {r['stage']: r for r in await cur.fetchall()}
+
+    async def save_stage_output(self, doc_id, stage, fingerprint, output):
+        async with self.connection("save_stage_output") as conn:
+            await conn.execute(SAVE_STAGE_OUTPUT_SQL, (doc_id, stage, fingerprint, Jsonb(output)))
+
+    async def update_task(self, doc_id, status=None, results=None, stage=None):
+        sql = "UPDATE processing_tasks SET updated_at = CURRENT_TIMESTAMP"
+        params = []
+        if status:
+            sql += ", status = %s"
+            params.append(status)
+        if stage:
+            sql += ", stage = %s"
+            params.append(stage)
+        sql += " WHERE doc_id = %s"
+        params.append(doc_id)
+        async with self.connection("update_task") as conn:
+            async with conn.transaction():
+                await conn.execute(sql, params)
+                if results:
+                    await conn.execute(SAVE_TASK_RESULTS_SQL, (Jsonb(results), doc_id))
+
+    async def insert_task_events(self, rows):
+        """Same as DBManager.insert_task_events."""
+        if not rows:
+            return True
+        try:
+            async with self.connection("insert_task_events") as conn:
+                async with conn.cursor() as cur:
+                    await cur.executemany(INSERT_TASK_EVENT_SQL, rows)
+            return True
+        except Exception as e:
+            logger.error(f"Error inserting task events: {e}")
+            return False
+
+    async def fail_task(self, doc_id, error, transient=True):
+        async with self.connection("fail_task") as conn:
+            cur = await conn.execute(FAIL_TASK_SQL, (str(error)[:2000], transient, MAX_TASK_ATTEMPTS, RETRY_MAX_SECONDS, RETRY_BASE_SECONDS, doc_id))
+            row = await cur.fetchone()
+            return row['status'] if row else None
+
+    async def promote_due_retries(self):
+        async with self.connection("promote_due_retries") as conn:
+            cur = await conn.execute(PROMOTE_RETRIES_SQL)
+            return cur.rowcount
+
+    async def age_queued_tasks(self, older_than_seconds=300):
+        async with self.connection("age_queued_tasks") as conn:
+            cur = await conn.execute(AGE_TASKS_SQL, (PRIORITY_AGING_CAP, older_than_seconds))
+            return cur.rowcount
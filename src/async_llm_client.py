@@ -0,0 +1,134 @@
+import asyncio
+import json
+import logging
+import time
+import httpx
+from llm_client import LLMClient, AdaptiveLimiter, LLMError
+
+logger = logging.getLogger(__name__)
+
+class AsyncAdaptiveLimiter(AdaptiveLimiter):
+    """AdaptiveLimiter whose acquire() awaits instead of blocking the event loop.
+    Slot accounting and the AIMD bookkeeping in release()/stats() are inherited unchanged."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._changed = asyncio.Event()
+
+    async def aacquire(self):
+        start = time.monotonic()
+        while True:
+            with self._cond:
+                if self._has_slot():
+                    return self._admit(start)
+                self._changed.clear()
+            await self._changed.wait()
+
+    def release(self, latency, tokens=None, overloaded=False):
+        super().release(latency, tokens, overloaded)
+        self._changed.set()
+
+class AsyncLLMClient(LLMClient):
+    """LLMClient on httpx.AsyncClient: same endpoint pool, routing, limits and payloads,
+    but every call is a coroutine so one process can keep hundreds of requests in flight.
+    Model discovery runs in refresh_loop() instead of inline on the request path."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.http = httpx.AsyncClient(limits=httpx.Limits(max_connections=None, max_keepalive_connections=256))
+
+    async def aclose(self):
+        await self.http.aclose()
+
+    def _refresh_models(self, ep, force=False):
+        # Never block the event loop with a sync /models call; see arefresh_models()
+        pass
+
+    def _get_limiter(self, url, model):
+        key = (url, model)
+        with self._lock:
+            if key not in self.limiters:
+                self.limiters[key] = AsyncAdaptiveLimiter()
+            return self.limiters[key]
+
+    async def arefresh_models(self):
+        """Active health check + model discovery for every endpoint."""
+        async def _one(ep):
+            try:
+                response = await self.http.get(f"{ep.url}/models", timeout=5)
+                response.raise_for_status()
+                data = response.json()['data']
+                ep.models = {m['id'] for m in data}
+                ep.model_info = {m['id']: self._parse_model_limits(m) for m in data}
+                ep.record_success()
+            except Exception as e:
+                logger.warning(f"Model discovery failed for {ep.url}: {e}")
+                ep.record_failure()
+            ep.models_fetched_at = time.time()
+        await asyncio.gather(*(_one(ep) for ep in list(self.endpoints.values())))
+
+    async def refresh_loop(self, stop_event):
+        while not stop_event.is_set():
+            await self.arefresh_models()
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=self.MODELS_TTL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _apost_chat(self, model, payload, timeout):
+        ep = self._pick_endpoint(model)
+        limiter = self._get_limiter(ep.url, model)
+        try:
+            await limiter.aacquire()
+            start = time.monotonic()
+            try:
+                response = await self.http.post(f"{ep.url}/chat/completions", json=payload, timeout=timeout)
+            except (httpx.TimeoutException, httpx.ConnectError) as e:
+                self._settle_call(ep, limiter, model, "timeout" if isinstance(e, httpx.TimeoutException) else "unreachable")
+                raise
+            except BaseException:
+                # Cancellation included: the slot must be given back
+                self._settle_call(ep, limiter, model, "error")
+                raise
+            if self._is_overload(response.status_code):
+                self._settle_call(ep, limiter, model, str(response.status_code))
+                response.raise_for_status()
+            try:
+                response.raise_for_status()
+                data = response.json()
+            except Exception:
+                self._settle_call(ep, limiter, model, "error")
+                raise
+            self._settle_call(ep, limiter, model, "ok", time.monotonic() - start, data)
+            return data
+        finally:
+            self._release_endpoint(ep)
+
+    @staticmethod
+    def _as_llm_error(model, e):
+        if isinstance(e, httpx.HTTPStatusError):
+            code = e.response.status_code
+            return LLMError(f"{model}: {e}", transient=code in (408, 429) or code >= 500)
+        return LLMError(f"{model}: {e}", transient=True)
+
+    async def agenerate_content(self, content, model, prompt_template):
+        """Async generate_content; always raises LLMError on failure."""
+        payload = self._summary_payload(content, model, prompt_template)
+        if payload is None:
+            parts, part_prompt, reduce_prompt = self._chunk_prompts(content, model, prompt_template)
+            partials = await asyncio.gather(*(self.agenerate_content(part, model, part_prompt(i)) for i, part in enumerate(parts)))
+            return await self.agenerate_content("\n\n".join(partials), model, reduce_prompt)
+        try:
+            data = await self._apost_chat(model, payload, timeout=180)
+            return data['choices'][0]['message']['content']
+        except Exception as e:
+            logger.error(f"Error calling LLM ({model}): {e}")
+            raise self._as_llm_error(model, e) from e
+
+    async def aextract_metadata(self, content, model, prompt_template):
+        """Async extract_metadata; always raises LLMError on failure."""
+        payload = self._metadata_payload(content, model, prompt_template)
+        try:
+            data = await self._apost_chat(model, payload, timeout=60)
+            return json.loads(data['choices'][0]['message']['content'])
+        except Exception as e:
+            logger.error(f"Metadata extract error: {e}")
+            raise self._as_llm_error(model, e) from e
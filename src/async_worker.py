@@ -0,0 +1,318 @@
+import asyncio
+import logging
+import os
+import signal
+import socket
+import time
+from async_db import AsyncDBManager
+from async_llm_client import AsyncLLMClient
+from llm_client import LLMError, track_usage
+from utils.md_processor import MDProcessor
+from cpu_stages import make_cpu_pool, embed_texts
+from task_events import TaskEventBuffer
+import metrics
+from worker import (STAGES, STAGE_ORDER, EMBED_MODEL, AGING_INTERVAL, RETRY_CHECK_INTERVAL, STATS_INTERVAL,
+                    HEARTBEAT_INTERVAL, EMBED_SWEEP_INTERVAL, EMBED_SWEEP_BATCH, METRICS_PORT, stage_fingerprint, publish_gauges,
+                    embed_inputs, embed_input_hash, embed_output, passage_vectors)
+
+logger = logging.getLogger("AsyncWorker")
+
+# Coroutines running LLM stages. The adaptive limiters decide how many calls actually
+# reach each endpoint, so this is just the ceiling on in-flight tasks in this process.
+LLM_CONCURRENCY = int(os.environ.get("ASYNC_LLM_CONCURRENCY", "256"))
+# Bounded hand-off queues between pipeline stages (claim -> llm -> embed)
+QUEUE_SIZE = int(os.environ.get("ASYNC_QUEUE_SIZE", "64"))
+
+class AsyncWorker:
+    """Asyncio alternative to BackgroundWorker: same queue, stages, checkpoints and retry policy.
+
+    claimer --(llm_queue)--> LLM stage consumers --(embed_queue)--> embed consumer
+
+    The four LLM stages of a task run concurrently. First SIGTERM stops claiming and lets
+    in-flight tasks drain; a second one cancels everything (tasks stay 'processing' and are
+    resumed from their checkpoints on the next start)."""
+    def __init__(self):
+        self.db = AsyncDBManager()
+        self.llm = AsyncLLMClient()
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.cpu_pool = make_cpu_pool(EMBED_MODEL)
+        self.embed_model = EMBED_MODEL # the database's active model, read in run() and on heartbeats
+        self.tasks_done = 0
+        self.stop_event = asyncio.Event()
+        self.llm_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.embed_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.events = TaskEventBuffer(self.worker_id)
+
+    async def heartbeat(self, status="running"):
+        in_flight = self.llm_queue.qsize() + self.embed_queue.qsize() + sum(lim.in_flight for lim in list(self.llm.limiters.values()))
+        await self.db.heartbeat(self.worker_id, socket.gethostname(), os.getpid(), "async", status, in_flight, self.tasks_done)
+
+    async def publish_metrics(self):
+        publish_gauges(await self.db.get_queue_stats(), self.llm.get_limiter_stats())
+        metrics.set_gauge("pipeline_queue_size", self.llm_queue.qsize(), queue="llm")
+        metrics.set_gauge("pipeline_queue_size", self.embed_queue.qsize(), queue="embed")
+        await self.db.save_worker_metrics(self.worker_id, metrics.snapshot())
+
+    async def embed_missing(self):
+        """Same as BackgroundWorker.embed_missing."""
+        docs = await self.db.get_unembedded_documents(EMBED_SWEEP_BATCH)
+        if not docs:
+            return
+        model = self.embed_model
+        loop = asyncio.get_running_loop()
+        vectors = await loop.run_in_executor(self.cpu_pool, embed_texts, [d['content'] for d in docs], model)
+        await self.db.fill_embeddings(model, [(d['id'], d['content_md5'], vec) for d, vec in zip(docs, vectors)])
+        logger.info(f"Embedded {len(docs)} document(s) saved without a vector.")
+
+    async def record_event(self, doc_id, event, **fields):
+        if self.events.record(doc_id, event, **fields):
+            await self.flush_events()
+
+    async def flush_events(self):
+        rows = self.events.drain()
+        if rows and not await self.db.insert_task_events(rows):
+            logger.warning(f"Dropped {len(rows)} task events")
+
+    async def _recover(self):
+        recovered = await self.db.recover_orphaned_tasks()
+        if recovered:
+            logger.info(f"Recovered {len(recovered)} stuck tasks.")
+
+    async def _claimer(self):
+        last_category = None
+        while not self.stop_event.is_set():
+            task = await self.db.claim_next_task(after_category=last_category, worker_id=self.worker_id)
+            if not task:
+                try:
+                    await asyncio.wait_for(self.stop_event.wait(), timeout=2)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            last_category = task.get('category')
+            task['claimed_at'] = time.monotonic()
+            await self.record_event(task['doc_id'], "claimed", stage=task.get('stage'))
+            await self.llm_queue.put(task) # Blocks when the LLM stage is saturated
+
+    async def _run_llm_stage(self, task, doc, key, model_key, prompt_key, kind, content_hash, cached):
+        config = task['config']
+        model = self.llm.route_model(config.get(model_key), doc['content'], config.get('model_long'))
+        prompt = config.get(prompt_key)
+        fp = stage_fingerprint(content_hash, model, prompt, kind)
+        results = task['results']
+        checkpoints = results.setdefault('checkpoints', {})
+
+        if checkpoints.get(key) == fp and key in results:
+            return
+        if key in cached and cached[key]['fingerprint'] == fp:
+            results[key] = cached[key]['output']
+            checkpoints[key] = fp
+            return
+
+        logger.info(f"Processing {task['doc_id']} - {key} ({model})")
+        stage_start = time.monotonic()
+        with track_usage() as usage:
+            if kind == "meta":
+                output = await self.llm.aextract_metadata(doc['content'], model, prompt)
+            else:
+                output = await self.llm.agenerate_content(doc['content'], model, prompt)
+        duration = time.monotonic() - stage_start
+        metrics.observe("stage_seconds", duration, stage=key)
+        await self.record_event(task['doc_id'], "stage", stage=key, model=model, duration=duration, usage=usage)
+        if model != config.get(model_key):
+            results.setdefault('stage_models', {})[key] = model
+        results[key] = output
+        checkpoints[key] = fp
+        await self.db.save_stage_output(task['doc_id'], key, fp, output)
+
+    async def _process_llm(self, task):
+        doc_id = task['doc_id']
+        doc = await self.db.get_document(doc_id)
+        if not doc:
+            await self._fail(task, "Document not found", transient=False)
+            return
+        task['results'] = task['results'] or {}
+        content_hash = MDProcessor.content_hash(doc['content'])
+        cached = await self.db.get_stage_outputs(doc_id)
+
+        llm_stages = [s for s in STAGES if s[3] != "embed"]
+        outcomes = await asyncio.gather(
+            *(self._run_llm_stage(task, doc, *stage, content_hash, cached) for stage in llm_stages),
+            return_exceptions=True)
+
+        # Checkpoint whatever finished, pointing `stage` at the first incomplete one
+        checkpoints = task['results'].get('checkpoints', {})
+        next_stage = next((k for k in STAGE_ORDER if k not in checkpoints), 'embed')
+        await self.db.update_task(doc_id, stage=next_stage, results=task['results'])
+
+        errors = [o for o in outcomes if isinstance(o, BaseException)]
+        for err in errors:
+            if isinstance(err, asyncio.CancelledError):
+                raise err
+        if errors:
+            err = errors[0]
+            await self._fail(task, err, transient=getattr(err, 'transient', True))
+            return
+        await self.embed_queue.put((task, doc))
+
+    async def _fail(self, task, err, transient=True, action="processing"):
+        """Records a failed attempt. Never raises (a DB error here must not take the TaskGroup
+        down); the task is then recovered as orphaned instead."""
+        doc_id = task['doc_id']
+        try:
+            status = await self.db.fail_task(doc_id, err, transient=transient)
+            metrics.inc("tasks_total", outcome=status)
+            await self.record_event(doc_id, status or "failed", duration=time.monotonic() - task['claimed_at'], detail=err)
+            logger.error(f"Error {action} {doc_id} -> {status}: {err}")
+        except Exception as e:
+            logger.error(f"Error {action} {doc_id}: {err}; could not record the failure: {e}")
+
+    async def _llm_consumer(self):
+        while True:
+            task = await self.llm_queue.get()
+            try:
+                await self._process_llm(task)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await self._fail(task, e)
+            finally:
+                self.llm_queue.task_done()
+
+    async def _embed_consumer(self):
+        while True:
+            task, doc = await self.embed_queue.get()
+            try:
+                results = task['results']
+                model = self.embed_model
+                fp = stage_fingerprint(embed_input_hash(MDProcessor.content_hash(doc['content']), results), model, None, "embed")
+                if results.get('checkpoints', {}).get('embed') != fp or 'embed' not in results:
+                    # CPU-bound: runs in the process pool, off the event loop and the GIL
+                    stage_start = time.monotonic()
+                    passages = []
+                    if doc['level'] == 'L0' and not await self.db.chunks_current(doc['id'], model):
+                        passages = MDProcessor.split_passages(doc['content'])
+                    texts = embed_inputs(doc, results, model, passages)
+                    loop = asyncio.get_running_loop()
+                    vectors = await loop.run_in_executor(self.cpu_pool, embed_texts, list(texts.values()), model) if texts else []
+                    if 'doc' in texts:
+                        await self.db.set_embedding(doc['id'], dict(zip(texts, vectors))['doc'], embedding_model=model)
+                    if passages:
+                        await self.db.save_document_chunks(model, [(doc['id'], doc['content'], passages,
+                                                                    passage_vectors(texts, vectors, passages))])
+                    results['embed'] = embed_output(texts, vectors, model)
+                    results.setdefault('checkpoints', {})['embed'] = fp
+                    await self.db.save_stage_output(task['doc_id'], 'embed', fp, results['embed'])
+                    duration = time.monotonic() - stage_start
+                    metrics.observe("stage_seconds", duration, stage="embed")
+                    await self.record_event(task['doc_id'], "stage", stage="embed", model=model, duration=duration)
+                await self.db.update_task(task['doc_id'], status='done', stage='complete', results=task['results'])
+                self.tasks_done += 1
+                metrics.inc("tasks_total", outcome="done")
+                await self.record_event(task['doc_id'], "done", duration=time.monotonic() - task['claimed_at'])
+                logger.info(f"Completed {task['doc_id']}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await self._fail(task, e, action="embedding")
+            finally:
+                self.embed_queue.task_done()
+
+    async def _stopping_heartbeat(self):
+        """Heartbeats while in-flight tasks drain, so siblings don't requeue them as orphaned."""
+        while True:
+            await self.heartbeat("stopping")
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    async def _housekeeping(self):
+        last_aging = 0
+        last_heartbeat = 0
+        last_sweep = 0
+        last_stats = time.time()
+        while not self.stop_event.is_set():
+            # Each step catches its own errors: one failed query must not take the TaskGroup down
+            if time.time() - last_heartbeat > HEARTBEAT_INTERVAL:
+                await self.heartbeat()
+                try:
+                    await self.publish_metrics()
+                    await self.flush_events()
+                    await self._recover()
+                    self.embed_model = await self.db.get_active_embedding_model()
+                except Exception as e:
+                    logger.error(f"Housekeeping error: {e}")
+                last_heartbeat = time.time()
+            if time.time() - last_aging > AGING_INTERVAL:
+                try:
+                    await self.db.age_queued_tasks(AGING_INTERVAL)
+                except Exception as e:
+                    logger.error(f"Error aging tasks: {e}")
+                last_aging = time.time()
+            try:
+                promoted = await self.db.promote_due_retries()
+                if promoted:
+                    logger.info(f"Re-queued {promoted} tasks for retry.")
+            except Exception as e:
+                logger.error(f"Error promoting retries: {e}")
+            if time.time() - last_sweep > EMBED_SWEEP_INTERVAL:
+                try:
+                    await self.embed_missing()
+                except Exception as e:
+                    logger.error(f"Error embedding documents without a vector: {e}")
+                last_sweep = time.time()
+            if time.time() - last_stats > STATS_INTERVAL:
+                for st in self.llm.get_limiter_stats():
+                    logger.info(f"LLM limiter {st}")
+                logger.info(f"Queues: llm={self.llm_queue.qsize()} embed={self.embed_queue.qsize()}")
+                last_stats = time.time()
+            try:
+                await asyncio.wait_for(self.stop_event.wait(), timeout=min(RETRY_CHECK_INTERVAL, HEARTBEAT_INTERVAL))
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self):
+        metrics.start_http_server(METRICS_PORT)
+        await self.db.open()
+        await self.heartbeat()
+        await self._recover()
+        self.embed_model = await self.db.get_active_embedding_model()
+
+        loop = asyncio.get_running_loop()
+        main_task = asyncio.current_task()
+        def _on_signal():
+            if self.stop_event.is_set():
+                main_task.cancel()
+                return
+            logger.warning("Shutdown requested. Draining in-flight tasks...")
+            self.stop_event.set()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, _on_signal)
+
+        logger.info(f"Async worker started ({LLM_CONCURRENCY} LLM slots, queue size {QUEUE_SIZE})")
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(self.llm.refresh_loop(self.stop_event))
+                tg.create_task(self._housekeeping())
+                claimer = tg.create_task(self._claimer())
+                consumers = [tg.create_task(self._llm_consumer()) for _ in range(LLM_CONCURRENCY)]
+                consumers.append(tg.create_task(self._embed_consumer()))
+
+                # Graceful stop: no new claims, then drain both queues, then stop consumers
+                await self.stop_event.wait()
+                beat = tg.create_task(self._stopping_heartbeat())
+                await claimer
+                await self.llm_queue.join()
+                await self.embed_queue.join()
+                beat.cancel()
+                for c in consumers:
+                    c.cancel()
+        except asyncio.CancelledError:
+            logger.warning("Worker cancelled; unfinished tasks will be recovered on next start.")
+        finally:
+            self.cpu_pool.shutdown()
+            await self.flush_events()
+            await self.heartbeat("stopped")
+            await self.llm.aclose()
+            await self.db.close()
+        logger.info("Async worker stopped.")
+
+if __name__ == "__main__":
+    asyncio.run(AsyncWorker().run())
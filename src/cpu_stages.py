@@ -0,0 +1,37 @@
+# CPU-bound pipeline steps, run in a ProcessPoolExecutor so they neither hold the GIL
+# of the worker's task loops nor block the asyncio event loop.
+# Each pool process loads its own embedder once, on first use.
+import os
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+# Default sentence embedding model. The one in use is the database's active embedding
+# model (DBManager.get_active_embedding_model), which starts out as this one.
+EMBED_MODEL = 'paraphrase-multilingual-MiniLM-L12-v2'
+# Embedder processes per worker. Each holds its own copy of the model, so half the host's
+# cores are shared among the WORKER_PROCESSES workers the supervisor runs (CPU_WORKERS overrides).
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", "1"))
+CPU_WORKERS = int(os.environ.get("CPU_WORKERS", str(max(1, (os.cpu_count() or 2) // 2 // WORKER_PROCESSES))))
+
+_embedders = {}
+_embed_model = None
+
+def init_cpu_worker(embed_model):
+    global _embed_model
+    _embed_model = embed_model
+
+def _get_embedder(model=None):
+    model = model or _embed_model
+    if model not in _embedders:
+        from embedder import make_embedder
+        _embedders[model] = make_embedder(model)
+    return _embedders[model]
+
+def embed_texts(texts, model=None):
+    """Returns one list-of-floats embedding per text (with `model`, default the pool's model)."""
+    return [v.tolist() for v in _get_embedder(model).encode(texts)]
+
+def make_cpu_pool(embed_model):
+    # spawn, not fork: the parent already runs threads / an event loop
+    return ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=init_cpu_worker, initargs=(embed_model,))
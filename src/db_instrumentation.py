@@ -0,0 +1,92 @@
+import logging
+import os
+import re
+import time
+import psycopg2.extensions
+from psycopg2.extras import Json
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Statements slower than this are logged and recorded in `slow_queries`
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "500"))
+# Also capture the plan of slow statements (EXPLAIN ANALYZE re-runs the statement)
+SLOW_QUERY_EXPLAIN = os.environ.get("SLOW_QUERY_EXPLAIN", "0") == "1"
+MAX_QUERY_TEXT = 4000
+
+class TimedCursorMixin:
+    """Times execute() per DBManager method and remembers slow statements on the connection."""
+    def execute(self, query, vars=None):
+        conn = self.connection
+        if getattr(conn, "capturing", False):
+            return super().execute(query, vars)
+        start = time.monotonic()
+        try:
+            return super().execute(query, vars)
+        finally:
+            dt = time.monotonic() - start
+            method = getattr(conn, "method", None) or "unknown"
+            metrics.observe("db_query_seconds", dt, method=method)
+            if dt * 1000 >= SLOW_QUERY_MS:
+                # self.query is the statement as sent, with parameters bound (needed for EXPLAIN)
+                conn.slow_queries.append((method, query if isinstance(query, str) else str(query), self.query, dt))
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """psycopg2 connection whose cursors (whatever cursor_factory the caller asks for) are timed.
+    DBManager.get_conn sets `method` on checkout and flushes `slow_queries` on return."""
+    _cursor_classes = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.method = None
+        self.capturing = False
+        self.slow_queries = []
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor
+        timed = self._cursor_classes.get(factory)
+        if timed is None:
+            timed = self._cursor_classes[factory] = type(f"Timed{factory.__name__}", (TimedCursorMixin, factory), {})
+        kwargs["cursor_factory"] = timed
+        return super().cursor(*args, **kwargs)
+
+_WRITE_KEYWORDS = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b")
+
+def _explain(cur, statement):
+    sql = statement.decode("utf-8", "replace") if isinstance(statement, bytes) else statement
+    head = sql.lstrip().upper()
+    # Only re-run read-only statements; writes (data-modifying CTEs included) get an estimated plan
+    read_only = (head.startswith("SELECT") or (head.startswith("WITH") and not _WRITE_KEYWORDS.search(head))) \
+        and "FOR UPDATE" not in head
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if read_only else "FORMAT JSON"
+    cur.execute(f"EXPLAIN ({options}) {sql}")
+    return cur.fetchone()[0]
+
+def flush_slow_queries(conn):
+    """Logs the slow statements recorded on `conn` and stores them (optionally with plans).
+    Runs after the DBManager method is done with the connection, in its own transaction."""
+    pending, conn.slow_queries = conn.slow_queries, []
+    if not pending or conn.closed:
+        return
+    conn.capturing = True
+    try:
+        conn.rollback()
+        with conn.cursor() as cur:
+            for method, query, statement, dt in pending:
+                logger.warning(f"Slow query in {method}: {dt * 1000:.0f} ms: {' '.join(query.split())[:200]}")
+                plan = None
+                if SLOW_QUERY_EXPLAIN and statement:
+                    try:
+                        plan = _explain(cur, statement)
+                    except Exception as e:
+                        logger.warning(f"EXPLAIN failed for slow query in {method}: {e}")
+                    conn.rollback()
+                cur.execute(
+                    "INSERT INTO slow_queries (method, query, duration_ms, plan) VALUES (%s, %s, %s, %s)",
+                    (method, query[:MAX_QUERY_TEXT], round(dt * 1000, 1), Json(plan) if plan is not None else None))
+                conn.commit()
+    except Exception as e:
+        logger.error(f"Error recording slow queries: {e}")
+        conn.rollback()
+    finally:
+        conn.capturing = False
@@ -1,16 +1,241 @@
 import psycopg2
-from psycopg2.extras import RealDictCursor, Json
+from psycopg2.extras import RealDictCursor, Json, execute_values
 import psycopg2.pool
 import pgvector.psycopg2
 import logging
+import os
+import re
 import uuid
 import json
+import time
 from contextlib import contextmanager
+from datetime import date, timedelta
+from itertools import islice
+import metrics
+from cpu_stages import EMBED_MODEL
+from db_instrumentation import InstrumentedConnection, flush_slow_queries
+from utils.md_processor import MDProcessor
+from search_cache import get_search_cache, CHANGE_CHANNEL
+from task_events import TASK_EVENTS_MONTHS_AHEAD
 
 logger = logging.getLogger(__name__)
 
+# Queue priorities (higher is claimed first). Claiming goes by band (priority / 10, one band
+# per level), so aged tasks still share a band round-robin. Aging never lifts a task past
+# PRIORITY_AGING_CAP, the top of the "Normal" band: waiting "Low" bulk work catches up with
+# "Normal" but never overtakes "High" or "Urgent".
+TASK_PRIORITIES = {"Low": 0, "Normal": 10, "High": 20, "Urgent": 30}
+PRIORITY_AGING_CAP = TASK_PRIORITIES["High"] - 1
+
+# Retry policy: transient failures go to 'retry' with exponential backoff; after
+# MAX_TASK_ATTEMPTS (or on a permanent error) the task moves to the 'dead' letter state.
+MAX_TASK_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 3600
+
+# Rows per round trip for server-side (named) cursors; bounds memory of streamed reads
+STREAM_ITERSIZE = int(os.environ.get("DB_STREAM_ITERSIZE", "500"))
+# documents columns for listings and streams (the 384-d embedding is left out unless needed)
+DOCUMENT_COLUMNS = "id, title, category, level, metadata, content, summary_uuids, source_uuids, created_at"
+
+# Vector search: "exact" scans full-precision vectors; "halfvec" / "binary" shortlist
+# VECTOR_RERANK_FACTOR x limit candidates on a compact HNSW expression index
+# (16-bit floats, or 1 bit per dimension with Hamming distance) and re-rank them on the
+# full vectors. The compact indexes are created on startup when their mode is selected.
+EMBEDDING_DIM = 384
+VECTOR_SEARCH_MODE = os.environ.get("VECTOR_SEARCH_MODE", "exact")
+VECTOR_RERANK_FACTOR = int(os.environ.get("VECTOR_RERANK_FACTOR", "4"))
+COMPACT_VECTOR_EXPR = {
+    "halfvec": f"(embedding::halfvec({EMBEDDING_DIM}))",
+    "binary": f"(binary_quantize(embedding)::bit({EMBEDDING_DIM}))",
+}
+COMPACT_VECTOR_INDEX = {
+    "halfvec": f"CREATE INDEX IF NOT EXISTS idx_docs_embedding_half ON documents USING hnsw ({COMPACT_VECTOR_EXPR['halfvec']} halfvec_cosine_ops);",
+    "binary": f"CREATE INDEX IF NOT EXISTS idx_docs_embedding_bin ON documents USING hnsw ({COMPACT_VECTOR_EXPR['binary']} bit_hamming_ops);",
+}
+COMPACT_QUERY_EXPR = {
+    "halfvec": f"%s::vector::halfvec({EMBEDDING_DIM})",
+    "binary": f"binary_quantize(%s::vector)::bit({EMBEDDING_DIM})",
+}
+COMPACT_DISTANCE_OP = {"halfvec": "<=>", "binary": "<~>"}
+
+# Passage search over document_chunks: the PASSAGE_SHORTLIST_FACTOR x limit nearest passages
+# are grouped by document and scored by their best passage ("max") or by the sum of the
+# document's best PASSAGES_PER_DOC passages ("sum": favours documents matching in several places)
+PASSAGE_POOLING = os.environ.get("PASSAGE_POOLING", "max")
+PASSAGE_SHORTLIST_FACTOR = int(os.environ.get("PASSAGE_SHORTLIST_FACTOR", "10"))
+PASSAGES_PER_DOC = 3
+
+# Model whose vectors live in documents.embedding; switched by activate_embedding_model
+ACTIVE_EMBEDDING_MODEL_SQL = "(SELECT value FROM app_settings WHERE key = 'embedding_model')"
+GET_ACTIVE_EMBEDDING_MODEL_SQL = f"SELECT {ACTIVE_EMBEDDING_MODEL_SQL} AS model;"
+
+# Queue statements shared by DBManager and the asyncio worker (async_db.AsyncDBManager)
+CLAIM_TOP_PRIORITY_SQL = """
+    SELECT priority / 10 AS band FROM processing_tasks
+    WHERE status = 'queued'
+    ORDER BY priority / 10 DESC LIMIT 1;
+"""
+
+CLAIM_TASK_SQL = """
+    UPDATE processing_tasks SET status = 'processing', claimed_by = %s, updated_at = CURRENT_TIMESTAMP
+    WHERE doc_id = (
+        SELECT doc_id FROM processing_tasks
+        WHERE status = 'queued' AND priority / 10 = %s {cat_clause}
+        ORDER BY category, est_tokens, created_at
+        LIMIT 1 FOR UPDATE SKIP LOCKED
+    )
+    RETURNING *, COALESCE((SELECT r.results FROM task_results r WHERE r.doc_id = processing_tasks.doc_id), '{{}}'::jsonb) AS results;
+"""
+
+# Results payloads live in task_results, so status and stage updates rewrite only the narrow queue row
+SAVE_TASK_RESULTS_SQL = """
+    INSERT INTO task_results (doc_id, results)
+    SELECT doc_id, %s::jsonb FROM processing_tasks WHERE doc_id = %s
+    ON CONFLICT (doc_id) DO UPDATE SET
+        results = EXCLUDED.results,
+        updated_at = CURRENT_TIMESTAMP;
+"""
+
+# Append-only task history (see task_events.py); rows are built by task_events.TaskEventBuffer
+TASK_EVENT_COLUMNS = "at, doc_id, worker_id, event, stage, model, duration_ms, prompt_tokens, completion_tokens, detail"
+INSERT_TASK_EVENT_SQL = f"INSERT INTO task_events ({TASK_EVENT_COLUMNS}) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s);"
+TASK_EVENT_PARTITION_RE = re.compile(r"task_events_y(\d{4})m(\d{2})")
+
+# Deleting tasks leaves a 'deleted' event (with the last status) behind in the history
+DELETE_TASKS_SQL = """
+    WITH deleted AS (
+        DELETE FROM processing_tasks WHERE TRUE {filters}
+        RETURNING doc_id, status
+    )
+    INSERT INTO task_events (at, doc_id, event, detail)
+    SELECT CURRENT_TIMESTAMP, doc_id, 'deleted', status FROM deleted;
+"""
+
+def _add_months(day, months):
+    """First day of the month `months` after the month of `day`."""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+AGE_TASKS_SQL = """
+    UPDATE processing_tasks
+    SET priority = priority + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE status = 'queued'
+      AND priority < %s
+      AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s);
+"""
+
+FAIL_TASK_SQL = """
+    UPDATE processing_tasks
+    SET attempts = COALESCE(attempts, 0) + 1,
+        last_error = %s,
+        status = CASE WHEN %s AND COALESCE(attempts, 0) + 1 < %s THEN 'retry' ELSE 'dead' END,
+        next_attempt_at = CURRENT_TIMESTAMP
+            + make_interval(secs => LEAST(%s, %s * power(2, COALESCE(attempts, 0)))),
+        updated_at = CURRENT_TIMESTAMP
+    WHERE doc_id = %s
+    RETURNING status;
+"""
+
+PROMOTE_RETRIES_SQL = """
+    UPDATE processing_tasks
+    SET status = 'queued', updated_at = CURRENT_TIMESTAMP
+    WHERE status = 'retry' AND next_attempt_at <= CURRENT_TIMESTAMP;
+"""
+
+# Seconds without a heartbeat after which a worker counts as dead
+WORKER_HEARTBEAT_TIMEOUT = 30
+
+HEARTBEAT_SQL = """
+    INSERT INTO workers (worker_id, hostname, pid, engine, status, in_flight, tasks_done)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (worker_id) DO UPDATE SET
+        status = EXCLUDED.status,
+        in_flight = EXCLUDED.in_flight,
+        tasks_done = EXCLUDED.tasks_done,
+        last_heartbeat = CURRENT_TIMESTAMP;
+"""
+
+# Requeue 'processing' tasks whose claiming worker is gone (or unknown), never a live sibling's
+RECOVER_ORPHANED_SQL = """
+    UPDATE processing_tasks SET status = 'queued', claimed_by = NULL, updated_at = CURRENT_TIMESTAMP
+    WHERE status IN ('processing', 'processing_l', 'processing_r')
+      AND (claimed_by IS NULL OR claimed_by NOT IN (
+          SELECT worker_id FROM workers
+          WHERE status <> 'stopped'
+            AND last_heartbeat > CURRENT_TIMESTAMP - make_interval(secs => %s)
+      ))
+    RETURNING doc_id;
+"""
+
+SAVE_WORKER_METRICS_SQL = """
+    INSERT INTO worker_metrics (worker_id, snapshot)
+    VALUES (%s, %s)
+    ON CONFLICT (worker_id) DO UPDATE SET
+        snapshot = EXCLUDED.snapshot,
+        updated_at = CURRENT_TIMESTAMP;
+"""
+
+# Depth and age of the oldest entry per queue status
+QUEUE_STATS_SQL = """
+    SELECT status, count(*) AS depth,
+           EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - min(updated_at))) AS oldest_age_seconds
+    FROM processing_tasks
+    GROUP BY status;
+"""
+
+# Passage vectors are current when cut from the document's present content with `model`
+CHUNKS_CURRENT_SQL = """
+    SELECT EXISTS (
+        SELECT 1 FROM document_chunks c JOIN documents d ON d.id = c.doc_id
+        WHERE c.doc_id = %s AND c.chunk_index = 0 AND c.embedding_model = %s AND c.content_md5 = md5(d.content)
+    ) AS current;
+"""
+
+DELETE_CHUNKS_SQL = "DELETE FROM document_chunks WHERE doc_id = ANY(%s::uuid[]);"
+
+INSERT_CHUNK_SQL = """
+    INSERT INTO document_chunks (doc_id, chunk_index, heading, content, content_md5, embedding, embedding_model)
+    VALUES (%s, %s, %s, %s, %s, %s::vector, %s);
+"""
+
+def chunk_rows(model, docs):
+    """document_chunks rows for (doc_id, content, passages, vectors) tuples."""
+    return [(str(doc_id), i, p['heading'], p['content'], MDProcessor.content_md5(content), vec, model)
+            for doc_id, content, passages, vectors in docs
+            for i, (p, vec) in enumerate(zip(passages, vectors))]
+
+# Documents left without a vector and no task to give them one (e.g. a review-tab save whose
+# background encode was lost to a restart); swept by the workers. The grace period leaves
+# fresh saves to their own encode.
+UNEMBEDDED_DOCS_SQL = """
+    SELECT d.id, d.content, md5(d.content) AS content_md5 FROM documents d
+    WHERE d.embedding IS NULL AND d.content IS NOT NULL AND d.content <> ''
+      AND d.created_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+      AND NOT EXISTS (SELECT 1 FROM processing_tasks t WHERE t.doc_id = d.id)
+    ORDER BY d.created_at LIMIT %s;
+"""
+
+# Only fills a vector that is still missing, for the content it was encoded from
+FILL_EMBEDDING_SQL = """
+    UPDATE documents SET embedding = %s::vector, embedding_model = %s
+    WHERE id = %s AND embedding IS NULL AND md5(content) = %s;
+"""
+EMBED_SWEEP_GRACE_SECONDS = 300
+
+SAVE_STAGE_OUTPUT_SQL = """
+    INSERT INTO stage_outputs (doc_id, stage, fingerprint, output)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (doc_id, stage) DO UPDATE SET
+        fingerprint = EXCLUDED.fingerprint,
+        output = EXCLUDED.output,
+        updated_at = CURRENT_TIMESTAMP;
+"""
+
 class DBManager:
-    def __init__(self, dbname="test_db", user="root", password="lavita!978", host="localhost", port="5432"):
+    def __init__(self, dbname=os.environ.get("DB_NAME", "test_db"), user=os.environ.get("DB_USER", "root"),
+                 password=os.environ.get("DB_PASSWORD", "lavita!978"), host=os.environ.get("DB_HOST", "localhost"),
+                 port=os.environ.get("DB_PORT", "5432")):
         self.conn_params = {
             "dbname": dbname,
             "user": user,
@@ -18,24 +243,33 @@ class DBManager:
             "host": host,
             "port": port
         }
-        # Initialize Connection Pool
-        self.pool = psycopg2.pool.SimpleConnectionPool(
+        # Initialize Connection Pool (threaded: the worker runs several task loops)
+        self.pool = psycopg2.pool.ThreadedConnectionPool(
             minconn=1, 
             maxconn=20, 
+            connection_factory=InstrumentedConnection,
             **self.conn_params
         )
         self._init_db()
 
     @contextmanager
-    def get_conn(self):
+    def get_conn(self, method):
+        # `method` labels the pool-wait and query-time metrics (the calling DBManager method)
+        wait_start = time.monotonic()
         conn = self.pool.getconn()
+        start = time.monotonic()
+        metrics.observe("db_pool_wait_seconds", start - wait_start, method=method)
+        outer_method, conn.method = conn.method, method
         try:
             yield conn
         finally:
+            conn.method = outer_method
+            metrics.observe("db_seconds", time.monotonic() - start, method=method)
+            flush_slow_queries(conn)
             self.pool.putconn(conn)
 
     def _init_db(self):
-        with self.get_conn() as conn:
+        with self.get_conn("_init_db") as conn:
             try:
                 with conn.cursor() as cur:
                     # Enable pgvector
@@ -92,38 +326,368 @@ class DBManager:
                             doc_id UUID PRIMARY KEY,
                             status TEXT DEFAULT 'created', -- created, queued, processing, done, failed
                             config JSONB DEFAULT '{}'::jsonb, -- prompts, models
-                            results JSONB DEFAULT '{}'::jsonb, -- partial or full results
                             created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
                             updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
                         );
                     """)
 
+                    # Migration: Add stage (resume pointer: meta_l, sum_l, meta_r, sum_r, embed, complete)
+                    try:
+                        cur.execute("ALTER TABLE processing_tasks ADD COLUMN IF NOT EXISTS stage TEXT;")
+                    except Exception as e:
+                        logger.warning(f"Migration error (stage): {e}")
+
+                    # Migration: Add priority and category (scheduling: priority + per-category fair share)
+                    try:
+                        cur.execute("ALTER TABLE processing_tasks ADD COLUMN IF NOT EXISTS priority INTEGER DEFAULT 10;")
+                        cur.execute("ALTER TABLE processing_tasks ADD COLUMN IF NOT EXISTS category TEXT;")
+                        cur.execute("""
+                            UPDATE processing_tasks t
+                            SET category = d.category
+                            FROM documents d
+                            WHERE t.doc_id = d.id AND t.category IS NULL;
+                        """)
+                    except Exception as e:
+                        logger.warning(f"Migration error (priority): {e}")
+
+                    # Migration: Add est_tokens (estimated prompt size, used for shortest-job-first claiming)
+                    try:
+                        cur.execute("ALTER TABLE processing_tasks ADD COLUMN IF NOT EXISTS est_tokens INTEGER;")
+                        cur.execute("""
+                            UPDATE processing_tasks t
+                            SET est_tokens = length(d.content) / 4
+                            FROM documents d
+                            WHERE t.doc_id = d.id AND t.est_tokens IS NULL;
+                        """)
+                    except Exception as e:
+                        logger.warning(f"Migration error (est_tokens): {e}")
+
+                    # Migration: Add retry bookkeeping (attempts, last_error, next_attempt_at)
+                    try:
+                        cur.execute("ALTER TABLE processing_tasks ADD COLUMN IF NOT EXISTS attempts INTEGER DEFAULT 0;")
+                        cur.execute("ALTER TABLE processing_tasks ADD COLUMN IF NOT EXISTS last_error TEXT;")
+                        cur.execute("ALTER TABLE processing_tasks ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP WITH TIME ZONE;")
+                    except Exception as e:
+                        logger.warning(f"Migration error (retries): {e}")
+
+                    # Migration: Add claimed_by (worker that owns a 'processing' task)
+                    try:
+                        cur.execute("ALTER TABLE processing_tasks ADD COLUMN IF NOT EXISTS claimed_by TEXT;")
+                    except Exception as e:
+                        logger.warning(f"Migration error (claimed_by): {e}")
+
+                    # Partial or full results per task, apart from the hot queue rows
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS task_results (
+                            doc_id UUID PRIMARY KEY REFERENCES processing_tasks(doc_id) ON DELETE CASCADE,
+                            results JSONB DEFAULT '{}'::jsonb, -- stage outputs, checkpoints, stage_models
+                            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                        );
+                    """)
+
+                    # Migration: move processing_tasks.results into task_results
+                    try:
+                        cur.execute("""
+                            SELECT 1 FROM information_schema.columns
+                            WHERE table_schema = current_schema() AND table_name = 'processing_tasks' AND column_name = 'results';
+                        """)
+                        if cur.fetchone():
+                            cur.execute("""
+                                INSERT INTO task_results (doc_id, results)
+                                SELECT doc_id, results FROM processing_tasks
+                                WHERE results IS NOT NULL AND results <> '{}'::jsonb
+                                ON CONFLICT (doc_id) DO NOTHING;
+                            """)
+                            cur.execute("ALTER TABLE processing_tasks DROP COLUMN results;")
+                    except Exception as e:
+                        logger.warning(f"Migration error (task_results): {e}")
+
+                    # Task history, partitioned by month (partitions: ensure_task_event_partitions).
+                    # No foreign key: events outlive their task and document.
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS task_events (
+                            at TIMESTAMP WITH TIME ZONE NOT NULL,
+                            doc_id UUID NOT NULL,
+                            worker_id TEXT,
+                            event TEXT NOT NULL, -- claimed, stage, done, retry, dead (failed: status unknown), deleted
+                            stage TEXT, -- stage run (stage) or resumed at (claimed)
+                            model TEXT,
+                            duration_ms REAL, -- stage run time (stage) or claim to completion (done)
+                            prompt_tokens INTEGER,
+                            completion_tokens INTEGER,
+                            detail TEXT -- error of a failed attempt, last status of a deleted task
+                        ) PARTITION BY RANGE (at);
+                    """)
+                    cur.execute("CREATE TABLE IF NOT EXISTS task_events_default PARTITION OF task_events DEFAULT;")
+                    cur.execute("CREATE INDEX IF NOT EXISTS idx_task_events_doc ON task_events(doc_id, at);")
+                    cur.execute("CREATE INDEX IF NOT EXISTS idx_task_events_at ON task_events(at);")
+
+                    # Worker heartbeats (read by the UI instead of `ps`)
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS workers (
+                            worker_id TEXT PRIMARY KEY, -- hostname:pid
+                            hostname TEXT,
+                            pid INTEGER,
+                            engine TEXT, -- sync, async
+                            status TEXT, -- running, stopping, stopped
+                            in_flight INTEGER DEFAULT 0,
+                            tasks_done INTEGER DEFAULT 0,
+                            started_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                            last_heartbeat TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                        );
+                    """)
+
+                    # Latest metrics snapshot per worker (read by the Metrics tab)
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS worker_metrics (
+                            worker_id TEXT PRIMARY KEY,
+                            snapshot JSONB, -- counters, gauges and histograms, see metrics.Registry.snapshot
+                            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                        );
+                    """)
+
+                    # Statements over SLOW_QUERY_MS, with their plan when SLOW_QUERY_EXPLAIN=1
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS slow_queries (
+                            id BIGSERIAL PRIMARY KEY,
+                            method TEXT, -- DBManager method that issued the statement
+                            query TEXT,
+                            duration_ms REAL,
+                            plan JSONB, -- EXPLAIN (FORMAT JSON) output
+                            captured_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                        );
+                    """)
+
+                    # Key/value settings (e.g. the active embedding model)
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS app_settings (
+                            key TEXT PRIMARY KEY,
+                            value TEXT,
+                            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                        );
+                    """)
+                    cur.execute("INSERT INTO app_settings (key, value) VALUES ('embedding_model', %s) ON CONFLICT (key) DO NOTHING;", (EMBED_MODEL,))
+
+                    # Migration: tag every vector with the model that produced it
+                    cur.execute("ALTER TABLE documents ADD COLUMN IF NOT EXISTS embedding_model TEXT;")
+                    cur.execute(f"UPDATE documents SET embedding_model = {ACTIVE_EMBEDDING_MODEL_SQL} WHERE embedding IS NOT NULL AND embedding_model IS NULL;")
+
+                    # Vectors of other embedding models, side by side (backfilled by reembed_job.py)
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS document_embeddings (
+                            doc_id UUID REFERENCES documents(id) ON DELETE CASCADE,
+                            model TEXT NOT NULL,
+                            embedding vector, -- any dimension; copied into documents.embedding on activation
+                            content_md5 TEXT, -- md5 of the content encoded, to catch later edits
+                            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                            PRIMARY KEY (doc_id, model)
+                        );
+                    """)
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS reembed_jobs (
+                            id SERIAL PRIMARY KEY,
+                            model TEXT NOT NULL,
+                            status TEXT DEFAULT 'pending', -- pending, running, paused, cancelled, done, failed
+                            total INTEGER DEFAULT 0,
+                            done INTEGER DEFAULT 0,
+                            last_doc_id UUID, -- keyset checkpoint: everything up to here is encoded
+                            error TEXT,
+                            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                        );
+                    """)
+
+                    # Heading-aware passages of L0 documents with one vector each (passage_search)
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS document_chunks (
+                            doc_id UUID REFERENCES documents(id) ON DELETE CASCADE,
+                            chunk_index INTEGER NOT NULL,
+                            heading TEXT, -- heading path above the passage
+                            content TEXT,
+                            content_md5 TEXT, -- md5 of the document content the passages were cut from
+                            embedding vector(384),
+                            embedding_model TEXT,
+                            PRIMARY KEY (doc_id, chunk_index)
+                        );
+                    """)
+
+                    # Editing a document drops its passages; the next worker run (or passage_backfill.py)
+                    # cuts new ones, so an edit that yields no passages leaves none behind either
+                    cur.execute("""
+                        CREATE OR REPLACE FUNCTION drop_stale_chunks() RETURNS trigger AS $$
+                        BEGIN
+                            DELETE FROM document_chunks WHERE doc_id = NEW.id;
+                            RETURN NULL;
+                        END;
+                        $$ LANGUAGE plpgsql;
+                    """)
+                    cur.execute("DROP TRIGGER IF EXISTS documents_content_changed ON documents;")
+                    cur.execute("""
+                        CREATE TRIGGER documents_content_changed
+                        AFTER UPDATE OF content ON documents
+                        FOR EACH ROW WHEN (OLD.content IS DISTINCT FROM NEW.content)
+                        EXECUTE FUNCTION drop_stale_chunks();
+                    """)
+
+                    # Precomputed k nearest neighbours per document within its level (neighbors.py)
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS document_neighbors (
+                            doc_id UUID REFERENCES documents(id) ON DELETE CASCADE,
+                            neighbor_id UUID REFERENCES documents(id) ON DELETE CASCADE,
+                            rank SMALLINT NOT NULL,
+                            similarity REAL NOT NULL,
+                            PRIMARY KEY (doc_id, neighbor_id)
+                        );
+                    """)
+                    cur.execute("CREATE INDEX IF NOT EXISTS idx_neighbors_neighbor ON document_neighbors(neighbor_id);")
+                    # Vector each neighbour list was computed from; a changed vector marks the list stale
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS neighbor_sources (
+                            doc_id UUID PRIMARY KEY REFERENCES documents(id) ON DELETE CASCADE,
+                            embedding_md5 TEXT,
+                            embedding_model TEXT,
+                            computed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                        );
+                    """)
+
+                    # Per-stage LLM outputs keyed by an input fingerprint (skip unchanged stages on re-run)
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS stage_outputs (
+                            doc_id UUID REFERENCES documents(id) ON DELETE CASCADE,
+                            stage TEXT NOT NULL, -- meta_l, sum_l, meta_r, sum_r, embed
+                            fingerprint TEXT NOT NULL, -- sha256 of content hash, model, prompt
+                            output JSONB,
+                            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                            PRIMARY KEY (doc_id, stage)
+                        );
+                    """)
+
+                    # Committed changes to search results NOTIFY the search cache (search_cache.py).
+                    # Statement-level, and only for columns searches return (not embeddings).
+                    cur.execute(f"""
+                        CREATE OR REPLACE FUNCTION notify_documents_changed() RETURNS trigger AS $$
+                        BEGIN
+                            PERFORM pg_notify('{CHANGE_CHANNEL}', TG_TABLE_NAME);
+                            RETURN NULL;
+                        END;
+                        $$ LANGUAGE plpgsql;
+                    """)
+                    cur.execute("DROP TRIGGER IF EXISTS documents_changed ON documents;")
+                    cur.execute("""
+                        CREATE TRIGGER documents_changed
+                        AFTER INSERT OR DELETE OR TRUNCATE
+                           OR UPDATE OF title, category, level, metadata, content, summary_uuids, source_uuids
+                        ON documents FOR EACH STATEMENT EXECUTE FUNCTION notify_documents_changed();
+                    """)
+                    # "without an active task" filter
+                    cur.execute("DROP TRIGGER IF EXISTS tasks_changed ON processing_tasks;")
+                    cur.execute("""
+                        CREATE TRIGGER tasks_changed
+                        AFTER INSERT OR DELETE OR TRUNCATE ON processing_tasks
+                        FOR EACH STATEMENT EXECUTE FUNCTION notify_documents_changed();
+                    """)
+
                     # Indexes
                     cur.execute("CREATE INDEX IF NOT EXISTS idx_docs_category ON documents(category);")
                     cur.execute("CREATE INDEX IF NOT EXISTS idx_docs_level ON documents(level);")
                     cur.execute("CREATE INDEX IF NOT EXISTS idx_docs_metadata ON documents USING gin(metadata);")
+                    cur.execute("CREATE INDEX IF NOT EXISTS idx_docs_unembedded ON documents(created_at) WHERE embedding IS NULL;")
                     cur.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON processing_tasks(status);")
+                    # Review queue pages: status filter in created_at order
+                    cur.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status_created ON processing_tasks(status, created_at);")
+                    cur.execute("CREATE INDEX IF NOT EXISTS idx_tasks_retry ON processing_tasks(next_attempt_at) WHERE status = 'retry';")
+                    # Claim order: top priority band first, then round-robin over categories, cheapest then oldest first
+                    cur.execute("DROP INDEX IF EXISTS idx_tasks_claim;")
+                    cur.execute("DROP INDEX IF EXISTS idx_tasks_claim_cost;")
+                    cur.execute("CREATE INDEX IF NOT EXISTS idx_tasks_claim_band ON processing_tasks(status, (priority / 10) DESC, category, est_tokens, created_at);")
+                    # ANN index for passage search (needs pgvector >= 0.5)
+                    cur.execute("SAVEPOINT chunk_index;")
+                    try:
+                        cur.execute("CREATE INDEX IF NOT EXISTS idx_chunks_embedding ON document_chunks USING hnsw (embedding vector_cosine_ops);")
+                    except Exception as e:
+                        logger.warning(f"Could not create passage vector index, passage searches will scan: {e}")
+                        cur.execute("ROLLBACK TO SAVEPOINT chunk_index;")
+                    # Compact ANN index for the configured vector search mode (needs pgvector >= 0.7)
+                    if VECTOR_SEARCH_MODE in COMPACT_VECTOR_INDEX:
+                        cur.execute("SAVEPOINT vector_index;")
+                        try:
+                            cur.execute(COMPACT_VECTOR_INDEX[VECTOR_SEARCH_MODE])
+                        except Exception as e:
+                            logger.warning(f"Could not create {VECTOR_SEARCH_MODE} vector index, searches will scan: {e}")
+                            cur.execute("ROLLBACK TO SAVEPOINT vector_index;")
                     
                     conn.commit()
             except Exception as e:
                 logger.error(f"Error initializing DB: {e}")
                 conn.rollback()
+        self.ensure_task_event_partitions(TASK_EVENTS_MONTHS_AHEAD)
+
+    def ensure_task_event_partitions(self, months_ahead=TASK_EVENTS_MONTHS_AHEAD):
+        """Creates the task_events partitions of this month and the next `months_ahead`."""
+        month = date.today().replace(day=1)
+        with self.get_conn("ensure_task_event_partitions") as conn:
+            try:
+                with conn.cursor() as cur:
+                    for i in range(months_ahead + 1):
+                        start = _add_months(month, i)
+                        cur.execute("SAVEPOINT task_events_partition;")
+                        try:
+                            cur.execute(f"""
+                                CREATE TABLE IF NOT EXISTS task_events_y{start.year:04d}m{start.month:02d}
+                                PARTITION OF task_events FOR VALUES FROM (%s) TO (%s);
+                            """, (start.isoformat(), _add_months(start, 1).isoformat()))
+                        except Exception as e:
+                            # e.g. the default partition already holds rows of that month
+                            logger.warning(f"Could not create task_events partition for {start:%Y-%m}: {e}")
+                            cur.execute("ROLLBACK TO SAVEPOINT task_events_partition;")
+                conn.commit()
+            except Exception as e:
+                logger.error(f"Error creating task_events partitions: {e}")
+                conn.rollback()
 
-    def upsert_document(self, doc_id, category, level, meta, content, embedding=None, title=None):
-        with self.get_conn() as conn:
+    def drop_task_event_partitions(self, retention_days):
+        """Drops the task_events partitions whose whole month is older than `retention_days`
+        (and purges such rows from the default partition). Returns the dropped partition names."""
+        cutoff = date.today() - timedelta(days=retention_days)
+        dropped = []
+        with self.get_conn("drop_task_event_partitions") as conn:
             try:
                 with conn.cursor() as cur:
                     cur.execute("""
-                        INSERT INTO documents (id, title, category, level, metadata, content, embedding)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s)
+                        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                        WHERE i.inhparent = 'task_events'::regclass;
+                    """)
+                    for (name,) in cur.fetchall():
+                        m = TASK_EVENT_PARTITION_RE.fullmatch(name)
+                        if m and _add_months(date(int(m[1]), int(m[2]), 1), 1) <= cutoff:
+                            cur.execute(f"DROP TABLE {name};")
+                            dropped.append(name)
+                    cur.execute("DELETE FROM task_events_default WHERE at < %s;", (cutoff.isoformat(),))
+                conn.commit()
+                return dropped
+            except Exception as e:
+                logger.error(f"Error dropping task_events partitions: {e}")
+                conn.rollback()
+                return []
+
+    def upsert_document(self, doc_id, category, level, meta, content, embedding=None, title=None, embedding_model=None):
+        """`embedding_model` tags the vector; it defaults to the active model."""
+        with self.get_conn("upsert_document") as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(f"""
+                        INSERT INTO documents (id, title, category, level, metadata, content, embedding, embedding_model)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s,
+                                CASE WHEN %s THEN COALESCE(%s, {ACTIVE_EMBEDDING_MODEL_SQL}) END)
                         ON CONFLICT (id) DO UPDATE SET
                             title = EXCLUDED.title,
                             category = EXCLUDED.category,
                             level = EXCLUDED.level,
                             metadata = EXCLUDED.metadata,
                             content = EXCLUDED.content,
-                            embedding = COALESCE(EXCLUDED.embedding, documents.embedding);
-                    """, (doc_id, title, category, level, Json(meta), content, embedding))
+                            embedding = COALESCE(EXCLUDED.embedding, documents.embedding),
+                            embedding_model = COALESCE(EXCLUDED.embedding_model, documents.embedding_model);
+                    """, (doc_id, title, category, level, Json(meta), content, embedding, embedding is not None, embedding_model))
                 conn.commit()
                 return True
             except Exception as e:
@@ -131,8 +695,227 @@ class DBManager:
                 conn.rollback()
                 return False
 
+    def set_embedding(self, doc_id, embedding, embedding_model=None):
+        with self.get_conn("set_embedding") as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(f"UPDATE documents SET embedding = %s, embedding_model = COALESCE(%s, {ACTIVE_EMBEDDING_MODEL_SQL}) WHERE id = %s",
+                                (embedding, embedding_model, doc_id))
+                conn.commit()
+                return True
+            except Exception as e:
+                logger.error(f"Error setting embedding: {e}")
+                conn.rollback()
+                return False
+
+    def get_unembedded_documents(self, limit=32):
+        with self.get_conn("get_unembedded_documents") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(UNEMBEDDED_DOCS_SQL, (EMBED_SWEEP_GRACE_SECONDS, limit))
+                return cur.fetchall()
+
+    def fill_embeddings(self, model, rows):
+        """Sets (doc_id, content_md5, vector) rows on documents still without a vector."""
+        with self.get_conn("fill_embeddings") as conn:
+            try:
+                with conn.cursor() as cur:
+                    for doc_id, content_md5, vec in rows:
+                        cur.execute(FILL_EMBEDDING_SQL, (vec, model, doc_id, content_md5))
+                conn.commit()
+                return True
+            except Exception as e:
+                logger.error(f"Error filling embeddings: {e}")
+                conn.rollback()
+                return False
+
+    def get_active_embedding_model(self):
+        with self.get_conn("get_active_embedding_model") as conn:
+            with conn.cursor() as cur:
+                cur.execute(GET_ACTIVE_EMBEDDING_MODEL_SQL)
+                row = cur.fetchone()
+                return (row and row[0]) or EMBED_MODEL
+
+    def get_embedding_model_counts(self):
+        """Documents per embedding model: serving vectors in `documents`, staged ones in `document_embeddings`."""
+        with self.get_conn("get_embedding_model_counts") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT embedding_model AS model, 'active' AS storage, count(*) AS docs
+                    FROM documents WHERE embedding IS NOT NULL GROUP BY embedding_model
+                    UNION ALL
+                    SELECT model, 'staged', count(*) FROM document_embeddings GROUP BY model
+                    ORDER BY model, storage
+                """)
+                return cur.fetchall()
+
+    def create_reembed_job(self, model):
+        """Queues a backfill of `model` vectors for every document; returns the job id."""
+        with self.get_conn("create_reembed_job") as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO reembed_jobs (model, total)
+                    SELECT %s, count(*) FROM documents WHERE content IS NOT NULL
+                    RETURNING id
+                """, (model,))
+                job_id = cur.fetchone()[0]
+            conn.commit()
+            return job_id
+
+    def get_reembed_jobs(self, limit=20):
+        with self.get_conn("get_reembed_jobs") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("SELECT * FROM reembed_jobs ORDER BY id DESC LIMIT %s", (limit,))
+                return cur.fetchall()
+
+    def get_reembed_job(self, job_id):
+        with self.get_conn("get_reembed_job") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("SELECT * FROM reembed_jobs WHERE id = %s", (job_id,))
+                return cur.fetchone()
+
+    def set_reembed_job_status(self, job_id, status, error=None):
+        with self.get_conn("set_reembed_job_status") as conn:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE reembed_jobs SET status = %s, error = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+                            (status, error, job_id))
+            conn.commit()
+
+    def next_reembed_batch(self, after_id=None, limit=64):
+        """Next documents in id order after the checkpoint."""
+        with self.get_conn("next_reembed_batch") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT id, content FROM documents
+                    WHERE content IS NOT NULL AND (%s::uuid IS NULL OR id > %s::uuid)
+                    ORDER BY id LIMIT %s
+                """, (after_id, after_id, limit))
+                return cur.fetchall()
+
+    def stale_reembed_batch(self, model, limit=64):
+        """Documents without a `model` vector for their current content (added or edited during the backfill)."""
+        with self.get_conn("stale_reembed_batch") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT d.id, d.content FROM documents d
+                    LEFT JOIN document_embeddings e ON e.doc_id = d.id AND e.model = %s
+                    WHERE d.content IS NOT NULL AND (e.doc_id IS NULL OR e.content_md5 <> md5(d.content))
+                    LIMIT %s
+                """, (model, limit))
+                return cur.fetchall()
+
+    def save_reembed_batch(self, job_id, model, rows, last_doc_id=None):
+        """Stores (doc_id, content_md5, vector) rows and advances the job checkpoint in one transaction."""
+        with self.get_conn("save_reembed_batch") as conn:
+            try:
+                with conn.cursor() as cur:
+                    execute_values(cur, """
+                        INSERT INTO document_embeddings (doc_id, model, content_md5, embedding)
+                        VALUES %s
+                        ON CONFLICT (doc_id, model) DO UPDATE SET
+                            content_md5 = EXCLUDED.content_md5,
+                            embedding = EXCLUDED.embedding,
+                            created_at = CURRENT_TIMESTAMP
+                    """, [(str(d), model, md5, vec) for d, md5, vec in rows], template="(%s::uuid, %s, %s, %s::vector)")
+                    cur.execute("""
+                        UPDATE reembed_jobs
+                        SET done = done + %s, last_doc_id = COALESCE(%s::uuid, last_doc_id), updated_at = CURRENT_TIMESTAMP
+                        WHERE id = %s
+                    """, (len(rows), last_doc_id, job_id))
+                conn.commit()
+                return True
+            except Exception as e:
+                logger.error(f"Error saving re-embedding batch: {e}")
+                conn.rollback()
+                return False
+
+    def activate_embedding_model(self, model):
+        """Atomically makes `model` the serving embedding: copies its staged vectors into
+        documents.embedding and flips the active model, in one transaction. Writers are held
+        off meanwhile. Returns the number of documents still missing a current vector (0 = switched)."""
+        with self.get_conn("activate_embedding_model") as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("LOCK TABLE documents IN SHARE ROW EXCLUSIVE MODE;")
+                    cur.execute("""
+                        SELECT count(*) FROM documents d
+                        LEFT JOIN document_embeddings e ON e.doc_id = d.id AND e.model = %s
+                        WHERE d.content IS NOT NULL AND (e.doc_id IS NULL OR e.content_md5 <> md5(d.content))
+                    """, (model,))
+                    missing = cur.fetchone()[0]
+                    if missing:
+                        conn.rollback()
+                        return missing
+                    cur.execute("""
+                        SELECT DISTINCT vector_dims(embedding) FROM document_embeddings WHERE model = %s
+                    """, (model,))
+                    dims = {r[0] for r in cur.fetchall()}
+                    if dims - {EMBEDDING_DIM}:
+                        raise ValueError(f"{model} produces {sorted(dims)}-d vectors; documents.embedding is vector({EMBEDDING_DIM})")
+                    # Keep the outgoing vectors staged so switching back needs no re-encode
+                    cur.execute("""
+                        INSERT INTO document_embeddings (doc_id, model, content_md5, embedding)
+                        SELECT id, embedding_model, md5(content), embedding FROM documents
+                        WHERE embedding IS NOT NULL AND embedding_model IS NOT NULL AND embedding_model <> %s
+                        ON CONFLICT (doc_id, model) DO UPDATE SET
+                            content_md5 = EXCLUDED.content_md5, embedding = EXCLUDED.embedding
+                    """, (model,))
+                    cur.execute("""
+                        UPDATE documents d SET embedding = e.embedding, embedding_model = e.model
+                        FROM document_embeddings e
+                        WHERE e.doc_id = d.id AND e.model = %s
+                    """, (model,))
+                    cur.execute("""
+                        UPDATE app_settings SET value = %s, updated_at = CURRENT_TIMESTAMP WHERE key = 'embedding_model'
+                    """, (model,))
+                conn.commit()
+                return 0
+            except Exception as e:
+                logger.error(f"Error activating embedding model {model}: {e}")
+                conn.rollback()
+                raise
+
+    def chunks_current(self, doc_id, model):
+        with self.get_conn("chunks_current") as conn:
+            with conn.cursor() as cur:
+                cur.execute(CHUNKS_CURRENT_SQL, (doc_id, model))
+                return cur.fetchone()[0]
+
+    def save_document_chunks(self, model, docs):
+        """Replaces the passages of each (doc_id, content, passages, vectors) in one transaction."""
+        if not docs:
+            return True
+        with self.get_conn("save_document_chunks") as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(DELETE_CHUNKS_SQL, ([str(d[0]) for d in docs],))
+                    execute_values(cur, """
+                        INSERT INTO document_chunks (doc_id, chunk_index, heading, content, content_md5, embedding, embedding_model)
+                        VALUES %s
+                    """, chunk_rows(model, docs), template="(%s::uuid, %s, %s, %s, %s, %s::vector, %s)")
+                conn.commit()
+                return True
+            except Exception as e:
+                logger.error(f"Error saving document chunks: {e}")
+                conn.rollback()
+                return False
+
+    def stale_chunk_batch(self, model, after_id=None, limit=32):
+        """L0 documents after `after_id` (id order) whose passages are missing, stale or from another model."""
+        with self.get_conn("stale_chunk_batch") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT d.id, d.content FROM documents d
+                    WHERE d.level = 'L0' AND d.content IS NOT NULL AND (%s::uuid IS NULL OR d.id > %s::uuid)
+                      AND NOT EXISTS (
+                          SELECT 1 FROM document_chunks c
+                          WHERE c.doc_id = d.id AND c.chunk_index = 0 AND c.embedding_model = %s AND c.content_md5 = md5(d.content)
+                      )
+                    ORDER BY d.id LIMIT %s
+                """, (after_id, after_id, model, limit))
+                return cur.fetchall()
+
     def link_documents(self, source_id, summary_id):
-        with self.get_conn() as conn:
+        with self.get_conn("link_documents") as conn:
             try:
                 with conn.cursor() as cur:
                     # Add summary_id to source's summary_uuids
@@ -173,7 +956,7 @@ class DBManager:
                 return False
 
     def remove_summary_link(self, source_id, summary_id):
-        with self.get_conn() as conn:
+        with self.get_conn("remove_summary_link") as conn:
             try:
                 with conn.cursor() as cur:
                     cur.execute("""
@@ -193,7 +976,7 @@ class DBManager:
                 return False
 
     def clear_summary_links(self, source_id):
-        with self.get_conn() as conn:
+        with self.get_conn("clear_summary_links") as conn:
             try:
                 with conn.cursor() as cur:
                     cur.execute("UPDATE documents SET summary_uuids = '[]'::jsonb WHERE id = %s", (source_id,))
@@ -204,11 +987,169 @@ class DBManager:
                 conn.rollback()
                 return False
 
+    def get_level_categories(self, level):
+        with self.get_conn("get_level_categories") as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT DISTINCT category FROM documents WHERE level = %s ORDER BY category", (level,))
+                return [r[0] for r in cur.fetchall()]
+
+    def get_rollup_sources(self, category, level):
+        """Documents of one category and level with a vector of the active model (rollup input)."""
+        with self.get_conn("get_rollup_sources") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(f"""
+                    SELECT id, title, metadata, content, embedding FROM documents
+                    WHERE category IS NOT DISTINCT FROM %s AND level = %s
+                      AND embedding IS NOT NULL AND embedding_model = {ACTIVE_EMBEDDING_MODEL_SQL}
+                    ORDER BY id
+                """, (category, level))
+                return cur.fetchall()
+
+    def get_rollups(self, category, level):
+        with self.get_conn("get_rollups") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT id, title, metadata, source_uuids FROM documents
+                    WHERE category IS NOT DISTINCT FROM %s AND level = %s
+                """, (category, level))
+                return cur.fetchall()
+
+    def set_rollup_sources(self, rollup_id, source_ids, delete=False):
+        """Makes `source_ids` exactly the sources of a rollup document (links on both sides),
+        in one transaction. With delete=True the rollup is unlinked and deleted."""
+        rollup_id = str(rollup_id)
+        source_ids = [] if delete else [str(s) for s in source_ids]
+        with self.get_conn("set_rollup_sources") as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        UPDATE documents
+                        SET summary_uuids = (
+                            SELECT COALESCE(jsonb_agg(value), '[]'::jsonb)
+                            FROM jsonb_array_elements(summary_uuids) AS value
+                            WHERE value #>> '{}' != %s
+                        )
+                        WHERE summary_uuids @> jsonb_build_array(%s::text) AND NOT (id = ANY(%s::uuid[]));
+                    """, (rollup_id, rollup_id, source_ids))
+                    cur.execute("""
+                        UPDATE documents
+                        SET summary_uuids = COALESCE(summary_uuids, '[]'::jsonb) || jsonb_build_array(%s::text)
+                        WHERE id = ANY(%s::uuid[]) AND NOT (COALESCE(summary_uuids, '[]'::jsonb) @> jsonb_build_array(%s::text));
+                    """, (rollup_id, source_ids, rollup_id))
+                    if delete:
+                        cur.execute("DELETE FROM documents WHERE id = %s", (rollup_id,))
+                    else:
+                        cur.execute("UPDATE documents SET source_uuids = %s WHERE id = %s", (Json(source_ids), rollup_id))
+                conn.commit()
+                return True
+            except Exception as e:
+                logger.error(f"Error linking rollup {rollup_id}: {e}")
+                conn.rollback()
+                return False
+
+    def iter_neighbor_vectors(self, level, chunksize=None):
+        """Batches of (id, embedding, embedding_md5, stale) for the active-model vectors of a level;
+        `stale` when the stored neighbour list was computed from another vector or model (or none)."""
+        sql = f"""
+            SELECT d.id, d.embedding, md5(d.embedding::text) AS embedding_md5,
+                   (s.doc_id IS NULL OR s.embedding_md5 <> md5(d.embedding::text)
+                    OR s.embedding_model IS DISTINCT FROM d.embedding_model) AS stale
+            FROM documents d LEFT JOIN neighbor_sources s ON s.doc_id = d.id
+            WHERE d.level = %s AND d.embedding IS NOT NULL AND d.embedding_model = {ACTIVE_EMBEDDING_MODEL_SQL}
+            ORDER BY d.id
+        """
+        return self.stream_chunks(sql, (level,), chunksize, method="iter_neighbor_vectors")
+
+    def get_neighbor_list_stats(self, level):
+        """{doc_id: (lowest similarity, list length)} of the stored neighbour lists of a level."""
+        with self.get_conn("get_neighbor_list_stats") as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT n.doc_id, min(n.similarity), count(*) FROM document_neighbors n
+                    JOIN documents d ON d.id = n.doc_id WHERE d.level = %s GROUP BY n.doc_id
+                """, (level,))
+                return {str(r[0]): (r[1], r[2]) for r in cur.fetchall()}
+
+    def get_docs_listing_neighbors(self, neighbor_ids):
+        """Documents whose neighbour list contains any of `neighbor_ids`."""
+        with self.get_conn("get_docs_listing_neighbors") as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT DISTINCT doc_id FROM document_neighbors WHERE neighbor_id = ANY(%s::uuid[])",
+                            ([str(i) for i in neighbor_ids],))
+                return {str(r[0]) for r in cur.fetchall()}
+
+    def save_neighbors(self, model, items):
+        """Replaces the neighbour lists of (doc_id, embedding_md5, [(neighbor_id, similarity), ...]) items."""
+        if not items:
+            return True
+        with self.get_conn("save_neighbors") as conn:
+            try:
+                with conn.cursor() as cur:
+                    ids = [str(doc_id) for doc_id, _, _ in items]
+                    cur.execute("DELETE FROM document_neighbors WHERE doc_id = ANY(%s::uuid[])", (ids,))
+                    execute_values(cur, "INSERT INTO document_neighbors (doc_id, neighbor_id, rank, similarity) VALUES %s",
+                                   [(str(doc_id), str(n), rank, float(sim))
+                                    for doc_id, _, neighbors in items for rank, (n, sim) in enumerate(neighbors, 1)],
+                                   template="(%s::uuid, %s::uuid, %s, %s)", page_size=1000)
+                    execute_values(cur, """
+                        INSERT INTO neighbor_sources (doc_id, embedding_md5, embedding_model) VALUES %s
+                        ON CONFLICT (doc_id) DO UPDATE SET
+                            embedding_md5 = EXCLUDED.embedding_md5,
+                            embedding_model = EXCLUDED.embedding_model,
+                            computed_at = CURRENT_TIMESTAMP
+                    """, [(str(doc_id), md5, model) for doc_id, md5, _ in items], template="(%s::uuid, %s, %s)")
+                conn.commit()
+                return True
+            except Exception as e:
+                logger.error(f"Error saving neighbours: {e}")
+                conn.rollback()
+                return False
+
+    def get_related_many(self, doc_ids, limit=5):
+        """Related documents for a whole page of results in one query: {doc_id: [rows by rank]}."""
+        if not doc_ids:
+            return {}
+        with self.get_conn("get_related_many") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT n.doc_id, n.rank, n.similarity, d.id, d.title, d.category, d.level
+                    FROM document_neighbors n JOIN documents d ON d.id = n.neighbor_id
+                    WHERE n.doc_id = ANY(%s::uuid[]) AND n.rank <= %s
+                    ORDER BY n.doc_id, n.rank
+                """, ([str(i) for i in doc_ids], limit))
+                related = {}
+                for r in cur.fetchall():
+                    related.setdefault(str(r.pop('doc_id')), []).append(r)
+                return related
+
+    def get_document_labels(self, doc_ids):
+        """id, title, category and level of many documents in one query: {doc_id: row}."""
+        if not doc_ids:
+            return {}
+        with self.get_conn("get_document_labels") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("SELECT id, title, category, level FROM documents WHERE id = ANY(%s::uuid[])",
+                            ([str(i) for i in doc_ids],))
+                return {str(r['id']): r for r in cur.fetchall()}
+
+    def get_similar_pairs(self, min_similarity, level=None, limit=5000):
+        """Neighbour pairs at or above `min_similarity` (each pair once), most similar first."""
+        with self.get_conn("get_similar_pairs") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT LEAST(n.doc_id, n.neighbor_id) AS a, GREATEST(n.doc_id, n.neighbor_id) AS b,
+                           max(n.similarity) AS similarity
+                    FROM document_neighbors n JOIN documents d ON d.id = n.doc_id
+                    WHERE n.similarity >= %s AND (%s::text IS NULL OR d.level = %s)
+                    GROUP BY 1, 2 ORDER BY similarity DESC LIMIT %s
+                """, (min_similarity, level, level, limit))
+                return cur.fetchall()
+
     def add_summary_link(self, parent_id, summary_id):
         return self.link_documents(parent_id, summary_id)
 
     def delete_document(self, doc_id):
-        with self.get_conn() as conn:
+        with self.get_conn("delete_document") as conn:
             try:
                 with conn.cursor() as cur:
                     cur.execute("DELETE FROM documents WHERE id = %s", (doc_id,))
@@ -220,13 +1161,105 @@ class DBManager:
                 return False
 
     def get_document(self, doc_id):
-        with self.get_conn() as conn:
+        with self.get_conn("get_document") as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute("SELECT * FROM documents WHERE id = %s", (doc_id,))
                 return cur.fetchone()
 
+    @contextmanager
+    def _named_cursor(self, itersize=None, cursor_factory=RealDictCursor, method=None):
+        """Server-side cursor: rows come over in batches of `itersize` as they are iterated."""
+        with self.get_conn(method) as conn:
+            cur = conn.cursor(name=f"stream_{uuid.uuid4().hex}", cursor_factory=cursor_factory)
+            cur.itersize = itersize or STREAM_ITERSIZE
+            try:
+                yield cur
+            finally:
+                cur.close()
+                conn.rollback() # read-only; ends the cursor's transaction
+
+    def stream(self, sql, params=None, itersize=None, method="stream"):
+        """Yields rows of `sql` one at a time without materializing the whole result.
+        The connection is held until the generator is exhausted or closed."""
+        with self._named_cursor(itersize, method=method) as cur:
+            cur.execute(sql, params)
+            for row in cur:
+                yield row
+
+    def stream_chunks(self, sql, params=None, chunksize=None, method="stream_chunks"):
+        """Yields lists of up to `chunksize` rows."""
+        chunksize = chunksize or STREAM_ITERSIZE
+        with self._named_cursor(chunksize, method=method) as cur:
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(chunksize)
+                if not rows:
+                    break
+                yield rows
+
+    @staticmethod
+    def _search_sql(query_text=None, category=None, level=None, doc_id=None, metadata_filters=None,
+                    columns="*", without_task=False, doc_ids=None):
+        sql = f"SELECT {columns} FROM documents WHERE 1=1"
+        params = []
+        if doc_id:
+            sql += " AND id = %s"
+            params.append(doc_id)
+        if doc_ids:
+            sql += " AND id = ANY(%s::uuid[])"
+            params.append([str(d) for d in doc_ids])
+        if category:
+            sql += " AND category = %s"
+            params.append(category)
+        if level:
+            sql += " AND level = %s"
+            params.append(level)
+        if query_text:
+            sql += " AND content ILIKE %s"
+            params.append(f"%{query_text}%")
+        if metadata_filters:
+            for k, v in metadata_filters.items():
+                sql += " AND metadata->>%s = %s"
+                params.extend([k, str(v)])
+        if without_task:
+            sql += " AND NOT EXISTS (SELECT 1 FROM processing_tasks t WHERE t.doc_id = documents.id)"
+        sql += " ORDER BY created_at DESC"
+        return sql, params
+
+    def iter_search_documents(self, query_text=None, category=None, level=None, doc_id=None, metadata_filters=None,
+                              without_task=False, include_embedding=False, itersize=None):
+        """Streaming search_documents; leaves out the embedding column unless asked for it."""
+        sql, params = self._search_sql(query_text, category, level, doc_id, metadata_filters,
+                                       DOCUMENT_COLUMNS + (", embedding" if include_embedding else ""), without_task)
+        return self.stream(sql, params, itersize, method="iter_search_documents")
+
+    def search_page(self, query_text=None, category=None, level=None, doc_id=None, without_task=False, limit=100):
+        """The first `limit` rows of iter_search_documents, served from the shared search cache
+        when the same search ran before and nothing changed since."""
+        def load():
+            rows = self.iter_search_documents(query_text=query_text, category=category, level=level,
+                                              doc_id=doc_id, without_task=without_task)
+            try:
+                return list(islice(rows, limit))
+            finally:
+                rows.close()
+
+        cache = get_search_cache(self.conn_params)
+        if cache is None:
+            return load()
+        # ILIKE and uuid comparison ignore case, so the key does too
+        key = ((query_text or "").lower(), category, level, (doc_id or "").lower(), bool(without_task), limit)
+        return cache.get_or_load(key, load)
+
+    def iter_export_batches(self, query_text=None, category=None, level=None, doc_id=None, doc_ids=None,
+                            without_task=False, include_embedding=False, chunksize=None):
+        """Search-tab filters (or explicit `doc_ids`) streamed as lists of rows, for exports."""
+        columns = DOCUMENT_COLUMNS + (", embedding, embedding_model" if include_embedding else "")
+        sql, params = self._search_sql(query_text, category, level, doc_id, None, columns, without_task, doc_ids)
+        return self.stream_chunks(sql, params, chunksize, method="iter_export_batches")
+
     def search_documents(self, query_text=None, category=None, level=None, doc_id=None, metadata_filters=None):
-        with self.get_conn() as conn:
+        with self.get_conn("search_documents") as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 sql = "SELECT * FROM documents WHERE 1=1"
                 params = []
@@ -252,50 +1285,207 @@ class DBManager:
                 cur.execute(sql, params)
                 return cur.fetchall()
 
-    def vector_search(self, embedding, limit=5, category=None, level=None):
-        with self.get_conn() as conn:
+    def vector_search(self, embedding, limit=5, category=None, level=None, mode=None):
+        """Nearest documents by cosine similarity (without the embedding column).
+        `mode` overrides VECTOR_SEARCH_MODE: "exact", or "halfvec" / "binary" for a shortlist
+        on the compact index re-ranked on the full vectors."""
+        mode = mode or VECTOR_SEARCH_MODE
+        # Only vectors of the serving model are comparable with the query
+        where_clauses = ["embedding IS NOT NULL", f"embedding_model = {ACTIVE_EMBEDDING_MODEL_SQL}"]
+        filter_params = []
+        if category:
+            where_clauses.append("category = %s")
+            filter_params.append(category)
+        if level:
+            where_clauses.append("level = %s")
+            filter_params.append(level)
+        where = " WHERE " + " AND ".join(where_clauses)
+
+        with self.get_conn("vector_search") as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                sql = "SELECT *, 1 - (embedding <=> %s) AS cosine_similarity FROM documents"
-                params = [embedding]
-                
-                where_clauses = []
-                if category:
-                    where_clauses.append("category = %s")
-                    params.append(category)
-                if level:
-                    where_clauses.append("level = %s")
-                    params.append(level)
-                
-                if where_clauses:
-                    sql += " WHERE " + " AND ".join(where_clauses)
-                
-                sql += " ORDER BY embedding <=> %s LIMIT %s"
-                params.extend([embedding, limit])
-                
-                cur.execute(sql, params)
-                return cur.fetchall()
+                if mode not in COMPACT_VECTOR_EXPR:
+                    sql = f"""
+                        SELECT {DOCUMENT_COLUMNS}, 1 - (embedding <=> %s::vector) AS cosine_similarity
+                        FROM documents{where}
+                        ORDER BY embedding <=> %s::vector LIMIT %s
+                    """
+                    cur.execute(sql, [embedding] + filter_params + [embedding, limit])
+                    return cur.fetchall()
+
+                shortlist = limit * VECTOR_RERANK_FACTOR
+                # HNSW returns at most ef_search rows per scan
+                cur.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(max(40, shortlist)),))
+                sql = f"""
+                    WITH shortlist AS (
+                        SELECT id FROM documents{where}
+                        ORDER BY {COMPACT_VECTOR_EXPR[mode]} {COMPACT_DISTANCE_OP[mode]} {COMPACT_QUERY_EXPR[mode]}
+                        LIMIT %s
+                    )
+                    SELECT {', '.join('d.' + c.strip() for c in DOCUMENT_COLUMNS.split(','))},
+                           1 - (d.embedding <=> %s::vector) AS cosine_similarity
+                    FROM documents d JOIN shortlist s ON s.id = d.id
+                    ORDER BY d.embedding <=> %s::vector LIMIT %s
+                """
+                cur.execute(sql, filter_params + [embedding, shortlist, embedding, embedding, limit])
+                rows = cur.fetchall()
+                conn.rollback() # ends the transaction holding the ef_search setting
+                return rows
+
+    def passage_search(self, embedding, limit=5, category=None, pooling=None):
+        """Documents ranked by their nearest passages (document_chunks), without the embedding
+        column. `pooling` overrides PASSAGE_POOLING. Each row carries its best passage
+        (`passage`, `passage_heading`), the number of passages that matched (`passage_hits`),
+        the best passage's `cosine_similarity` and the pooled `score`."""
+        pooling = pooling or PASSAGE_POOLING
+        score = "sum(similarity)" if pooling == "sum" else "max(similarity)"
+        # Only passages cut from the document's present content
+        where_clauses = [f"c.embedding_model = {ACTIVE_EMBEDDING_MODEL_SQL}", "c.content_md5 = md5(d.content)"]
+        filter_params = []
+        if category:
+            where_clauses.append("d.category = %s")
+            filter_params.append(category)
+        shortlist = limit * PASSAGE_SHORTLIST_FACTOR
+
+        with self.get_conn("passage_search") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(max(40, shortlist)),))
+                sql = f"""
+                    WITH hits AS (
+                        SELECT c.doc_id, c.heading, c.content, 1 - (c.embedding <=> %s::vector) AS similarity
+                        FROM document_chunks c JOIN documents d ON d.id = c.doc_id
+                        WHERE {" AND ".join(where_clauses)}
+                        ORDER BY c.embedding <=> %s::vector LIMIT %s
+                    ), ranked AS (
+                        SELECT *, row_number() OVER (PARTITION BY doc_id ORDER BY similarity DESC) AS rank FROM hits
+                    ), pooled AS (
+                        SELECT doc_id, {score} AS score, max(similarity) AS cosine_similarity, count(*) AS passage_hits,
+                               (array_agg(heading ORDER BY rank))[1] AS passage_heading,
+                               (array_agg(content ORDER BY rank))[1] AS passage
+                        FROM ranked WHERE rank <= %s GROUP BY doc_id
+                    )
+                    SELECT {', '.join('d.' + c.strip() for c in DOCUMENT_COLUMNS.split(','))},
+                           p.score, p.cosine_similarity, p.passage_hits, p.passage_heading, p.passage
+                    FROM pooled p JOIN documents d ON d.id = p.doc_id
+                    ORDER BY p.score DESC LIMIT %s
+                """
+                cur.execute(sql, [embedding] + filter_params + [embedding, shortlist, PASSAGES_PER_DOC, limit])
+                rows = cur.fetchall()
+                conn.rollback() # ends the transaction holding the ef_search setting
+                return rows
+
+    def enqueue_task(self, doc_id, config=None, priority=TASK_PRIORITIES["Normal"]):
+        return self.enqueue_many([(doc_id, config, priority)]) == 1
 
-    def enqueue_task(self, doc_id, config=None):
-        with self.get_conn() as conn:
+    def enqueue_many(self, rows, priority=TASK_PRIORITIES["Normal"]):
+        """Creates (or resets to 'created') one task per row in a single transaction.
+        Rows are (doc_id, config) or (doc_id, config, priority). Returns the number of tasks written."""
+        by_id = {}
+        for row in rows:
+            doc_id, config = row[0], row[1]
+            by_id[str(doc_id)] = (str(doc_id), Json(config or {}), row[2] if len(row) > 2 else priority)
+        if not by_id:
+            return 0
+        with self.get_conn("enqueue_many") as conn:
             try:
                 with conn.cursor() as cur:
-                    cur.execute("""
-                        INSERT INTO processing_tasks (doc_id, status, config)
-                        VALUES (%s, 'created', %s)
+                    execute_values(cur, """
+                        INSERT INTO processing_tasks (doc_id, status, config, priority, category, est_tokens)
+                        SELECT v.doc_id, 'created', v.config, v.priority, d.category, length(d.content) / 4
+                        FROM (VALUES %s) AS v(doc_id, config, priority)
+                        LEFT JOIN documents d ON d.id = v.doc_id
                         ON CONFLICT (doc_id) DO UPDATE SET
                             status = 'created',
+                            stage = NULL,
                             config = EXCLUDED.config,
+                            priority = EXCLUDED.priority,
+                            category = COALESCE(EXCLUDED.category, processing_tasks.category),
+                            est_tokens = COALESCE(EXCLUDED.est_tokens, processing_tasks.est_tokens),
+                            attempts = 0,
+                            last_error = NULL,
+                            next_attempt_at = NULL,
                             updated_at = CURRENT_TIMESTAMP;
-                    """, (doc_id, Json(config or {})))
+                    """, list(by_id.values()), template="(%s::uuid, %s::jsonb, %s::int)", page_size=1000)
                 conn.commit()
-                return True
+                return len(by_id)
             except Exception as e:
-                logger.error(f"Error enqueueing task: {e}")
+                logger.error(f"Error enqueueing tasks: {e}")
                 conn.rollback()
-                return False
+                return 0
 
-    def update_task(self, doc_id, status=None, results=None, config=None):
-        with self.get_conn() as conn:
+    def queue_tasks(self, doc_ids, config=None, priority=None):
+        """Moves tasks to 'queued' in one statement. `config` is merged into each task's config;
+        `priority` only ever raises a task's priority. Returns the number of tasks queued."""
+        with self.get_conn("queue_tasks") as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        UPDATE processing_tasks
+                        SET status = 'queued',
+                            config = COALESCE(config, '{}'::jsonb) || %s,
+                            priority = GREATEST(priority, COALESCE(%s, priority)),
+                            updated_at = CURRENT_TIMESTAMP
+                        WHERE doc_id = ANY(%s::uuid[])
+                    """, (Json(config or {}), priority, [str(d) for d in doc_ids]))
+                    count = cur.rowcount
+                conn.commit()
+                return count
+            except Exception as e:
+                logger.error(f"Error queueing tasks: {e}")
+                conn.rollback()
+                return 0
+
+    def delete_tasks(self, doc_ids=None, statuses=None):
+        """Deletes the given tasks and/or every task in `statuses`, in one statement
+        (their results go with them, their task_events history stays)."""
+        if doc_ids is None and statuses is None:
+            raise ValueError("delete_tasks needs doc_ids or statuses")
+        filters = ""
+        params = []
+        if doc_ids is not None:
+            filters += " AND doc_id = ANY(%s::uuid[])"
+            params.append([str(d) for d in doc_ids])
+        if statuses is not None:
+            filters += " AND status = ANY(%s)"
+            params.append(list(statuses))
+        with self.get_conn("delete_tasks") as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(DELETE_TASKS_SQL.format(filters=filters), params)
+                    count = cur.rowcount
+                conn.commit()
+                return count
+            except Exception as e:
+                logger.error(f"Error deleting tasks: {e}")
+                conn.rollback()
+                return 0
+
+    def requeue(self, statuses, doc_ids=None):
+        """Puts every task in `statuses` (optionally only `doc_ids`) back in the queue
+        with a fresh attempt count, in one statement. Returns the number requeued."""
+        with self.get_conn("requeue") as conn:
+            try:
+                with conn.cursor() as cur:
+                    sql = """
+                        UPDATE processing_tasks
+                        SET status = 'queued', attempts = 0, last_error = NULL, next_attempt_at = NULL,
+                            updated_at = CURRENT_TIMESTAMP
+                        WHERE status = ANY(%s)
+                    """
+                    params = [list(statuses)]
+                    if doc_ids is not None:
+                        sql += " AND doc_id = ANY(%s::uuid[])"
+                        params.append([str(d) for d in doc_ids])
+                    cur.execute(sql, params)
+                    count = cur.rowcount
+                conn.commit()
+                return count
+            except Exception as e:
+                logger.error(f"Error requeueing tasks: {e}")
+                conn.rollback()
+                return 0
+
+    def update_task(self, doc_id, status=None, results=None, config=None, stage=None, priority=None):
+        with self.get_conn("update_task") as conn:
             try:
                 with conn.cursor() as cur:
                     sql = "UPDATE processing_tasks SET updated_at = CURRENT_TIMESTAMP"
@@ -304,17 +1494,22 @@ class DBManager:
                     if status:
                         sql += ", status = %s"
                         params.append(status)
-                    if results:
-                        sql += ", results = %s"
-                        params.append(Json(results))
                     if config:
                         sql += ", config = %s"
                         params.append(Json(config))
+                    if stage:
+                        sql += ", stage = %s"
+                        params.append(stage)
+                    if priority is not None:
+                        sql += ", priority = %s"
+                        params.append(priority)
                     
                     sql += " WHERE doc_id = %s"
                     params.append(doc_id)
                     
                     cur.execute(sql, params)
+                    if results:
+                        cur.execute(SAVE_TASK_RESULTS_SQL, (Json(results), doc_id))
                 conn.commit()
                 return True
             except Exception as e:
@@ -323,19 +1518,326 @@ class DBManager:
                 return False
 
     def get_tasks_by_status(self, status):
-        with self.get_conn() as conn:
+        with self.get_conn("get_tasks_by_status") as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute("SELECT * FROM processing_tasks WHERE status = %s ORDER BY created_at ASC", (status,))
                 return cur.fetchall()
 
+    def iter_tasks_by_status(self, statuses, itersize=None):
+        """Streams tasks in any of `statuses` (oldest first) without their results payload."""
+        return self.stream("""
+            SELECT doc_id, status, stage, config, priority, category, attempts, last_error, created_at, updated_at
+            FROM processing_tasks WHERE status = ANY(%s) ORDER BY created_at ASC
+        """, (list(statuses),), itersize, method="iter_tasks_by_status")
+
+    def count_tasks_by_status(self, status):
+        with self.get_conn("count_tasks_by_status") as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT count(*) FROM processing_tasks WHERE status = %s", (status,))
+                return cur.fetchone()[0]
+
+    def get_review_queue(self, limit=50, offset=0):
+        """One page of 'done' tasks, oldest first, without their results payload."""
+        with self.get_conn("get_review_queue") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT doc_id, config->>'filename' AS filename, config->>'title' AS title, created_at, updated_at
+                    FROM processing_tasks
+                    WHERE status = 'done'
+                    ORDER BY created_at ASC
+                    LIMIT %s OFFSET %s
+                """, (limit, offset))
+                return cur.fetchall()
+
+    def get_review_item(self, doc_id):
+        """Task results and parent document for one task in a single query.
+        Returns {"task": ..., "document": ... or None}, or None if the task is gone."""
+        with self.get_conn("get_review_item") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT t.doc_id, t.status, t.config, COALESCE(r.results, '{}'::jsonb) AS results, t.updated_at,
+                           d.id, d.title, d.category, d.level, d.metadata, d.content, d.summary_uuids
+                    FROM processing_tasks t
+                    LEFT JOIN task_results r ON r.doc_id = t.doc_id
+                    LEFT JOIN documents d ON d.id = t.doc_id
+                    WHERE t.doc_id = %s
+                """, (doc_id,))
+                row = cur.fetchone()
+                if not row:
+                    return None
+                task = {k: row[k] for k in ("doc_id", "status", "config", "results", "updated_at")}
+                document = {k: row[k] for k in ("id", "title", "category", "level", "metadata", "content", "summary_uuids")} if row['id'] else None
+                return {"task": task, "document": document}
+
+    def claim_next_task(self, after_category=None, worker_id=None):
+        """Atomically moves the next queued task to 'processing' and returns it.
+        Picks the highest priority band present, then the next category after `after_category`
+        (round-robin fair share), then the cheapest (est_tokens) and oldest task, so short
+        documents are not stuck behind huge ones. Each step is a single seek on idx_tasks_claim_band."""
+        with self.get_conn("claim_next_task") as conn:
+            try:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute(CLAIM_TOP_PRIORITY_SQL)
+                    top = cur.fetchone()
+                    if not top:
+                        conn.rollback()
+                        return None
+
+                    # Next category after the last served one, wrapping around to the first
+                    passes = [("AND category > %s", [after_category]), ("", [])] if after_category else [("", [])]
+                    task = None
+                    for cat_clause, cat_params in passes:
+                        cur.execute(CLAIM_TASK_SQL.format(cat_clause=cat_clause), [worker_id, top['band']] + cat_params)
+                        task = cur.fetchone()
+                        if task:
+                            break
+                conn.commit()
+                return task
+            except Exception as e:
+                logger.error(f"Error claiming task: {e}")
+                conn.rollback()
+                return None
+
+    def age_queued_tasks(self, older_than_seconds=300):
+        """Aging policy: bump the priority of tasks that waited longer than `older_than_seconds`
+        by one step (up to PRIORITY_AGING_CAP), so low-priority bulk work is never starved forever."""
+        with self.get_conn("age_queued_tasks") as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(AGE_TASKS_SQL, (PRIORITY_AGING_CAP, older_than_seconds))
+                    count = cur.rowcount
+                conn.commit()
+                return count
+            except Exception as e:
+                logger.error(f"Error aging tasks: {e}")
+                conn.rollback()
+                return 0
+
+    def fail_task(self, doc_id, error, transient=True):
+        """Records a failed attempt without touching results. Transient failures are retried with
+        exponential backoff (RETRY_BASE_SECONDS * 2^attempts); the last attempt or a permanent
+        error moves the task to 'dead'. Returns the new status."""
+        with self.get_conn("fail_task") as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(FAIL_TASK_SQL, (str(error)[:2000], transient, MAX_TASK_ATTEMPTS, RETRY_MAX_SECONDS, RETRY_BASE_SECONDS, doc_id))
+                    row = cur.fetchone()
+                conn.commit()
+                return row[0] if row else None
+            except Exception as e:
+                logger.error(f"Error failing task: {e}")
+                conn.rollback()
+                return None
+
+    def promote_due_retries(self):
+        """Moves 'retry' tasks whose backoff has elapsed back to 'queued'."""
+        with self.get_conn("promote_due_retries") as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(PROMOTE_RETRIES_SQL)
+                    count = cur.rowcount
+                conn.commit()
+                return count
+            except Exception as e:
+                logger.error(f"Error promoting retries: {e}")
+                conn.rollback()
+                return 0
+
+    def requeue_dead_tasks(self, doc_ids=None):
+        """Puts dead-lettered (and legacy 'failed') tasks back in the queue with a fresh attempt count."""
+        return self.requeue(['dead', 'failed'], doc_ids)
+
+    def heartbeat(self, worker_id, hostname, pid, engine, status="running", in_flight=0, tasks_done=0):
+        with self.get_conn("heartbeat") as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(HEARTBEAT_SQL, (worker_id, hostname, pid, engine, status, in_flight, tasks_done))
+                conn.commit()
+                return True
+            except Exception as e:
+                logger.error(f"Error writing heartbeat: {e}")
+                conn.rollback()
+                return False
+
+    def recover_orphaned_tasks(self):
+        """Requeues 'processing' tasks whose worker stopped heartbeating (a live worker's tasks are left alone).
+        Checkpoints are kept, so they resume at their first incomplete stage."""
+        with self.get_conn("recover_orphaned_tasks") as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(RECOVER_ORPHANED_SQL, (WORKER_HEARTBEAT_TIMEOUT,))
+                    ids = [r[0] for r in cur.fetchall()]
+                conn.commit()
+                return ids
+            except Exception as e:
+                logger.error(f"Error recovering tasks: {e}")
+                conn.rollback()
+                return []
+
+    def get_workers(self, include_stale=False):
+        """Worker heartbeats, newest first, each with an `alive` flag."""
+        with self.get_conn("get_workers") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                sql = """
+                    SELECT *, (status <> 'stopped' AND last_heartbeat > CURRENT_TIMESTAMP - make_interval(secs => %s)) AS alive
+                    FROM workers
+                """
+                if not include_stale:
+                    sql += " WHERE last_heartbeat > CURRENT_TIMESTAMP - interval '1 day'"
+                sql += " ORDER BY last_heartbeat DESC"
+                cur.execute(sql, (WORKER_HEARTBEAT_TIMEOUT,))
+                return cur.fetchall()
+
+    def save_worker_metrics(self, worker_id, snapshot):
+        with self.get_conn("save_worker_metrics") as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(SAVE_WORKER_METRICS_SQL, (worker_id, Json(snapshot)))
+                conn.commit()
+                return True
+            except Exception as e:
+                logger.error(f"Error saving worker metrics: {e}")
+                conn.rollback()
+                return False
+
+    def get_worker_metrics(self, max_age_seconds=3600):
+        """Metrics snapshots of workers that reported within `max_age_seconds`."""
+        with self.get_conn("get_worker_metrics") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT worker_id, snapshot, updated_at FROM worker_metrics
+                    WHERE updated_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+                """, (max_age_seconds,))
+                return cur.fetchall()
+
+    def get_queue_stats(self):
+        with self.get_conn("get_queue_stats") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(QUEUE_STATS_SQL)
+                return cur.fetchall()
+
     def get_task(self, doc_id):
-        with self.get_conn() as conn:
+        with self.get_conn("get_task") as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("SELECT * FROM processing_tasks WHERE doc_id = %s", (doc_id,))
+                cur.execute("""
+                    SELECT t.*, COALESCE(r.results, '{}'::jsonb) AS results
+                    FROM processing_tasks t LEFT JOIN task_results r ON r.doc_id = t.doc_id
+                    WHERE t.doc_id = %s
+                """, (doc_id,))
                 return cur.fetchone()
 
     def delete_task(self, doc_id):
-        with self.get_conn() as conn:
+        with self.get_conn("delete_task") as conn:
             with conn.cursor() as cur:
-                cur.execute("DELETE FROM processing_tasks WHERE doc_id = %s", (doc_id,))
+                cur.execute(DELETE_TASKS_SQL.format(filters=" AND doc_id = %s"), (doc_id,))
             conn.commit()
+
+    def insert_task_events(self, rows):
+        """Appends task_events rows (task_events.TaskEventBuffer.drain) in one round trip."""
+        if not rows:
+            return True
+        with self.get_conn("insert_task_events") as conn:
+            try:
+                with conn.cursor() as cur:
+                    execute_values(cur, f"INSERT INTO task_events ({TASK_EVENT_COLUMNS}) VALUES %s", rows, page_size=1000)
+                conn.commit()
+                return True
+            except Exception as e:
+                logger.error(f"Error inserting task events: {e}")
+                conn.rollback()
+                return False
+
+    def get_task_events(self, doc_id):
+        """A document's task history, oldest first (kept after the task is deleted)."""
+        with self.get_conn("get_task_events") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(f"SELECT {TASK_EVENT_COLUMNS} FROM task_events WHERE doc_id = %s ORDER BY at", (doc_id,))
+                return cur.fetchall()
+
+    def get_task_throughput(self, days=30):
+        """Per day: completed, retried and dead tasks, stage time and tokens."""
+        with self.get_conn("get_task_throughput") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT date_trunc('day', at) AS day,
+                           count(*) FILTER (WHERE event = 'done') AS done,
+                           count(*) FILTER (WHERE event = 'retry') AS retried,
+                           count(*) FILTER (WHERE event = 'dead') AS dead,
+                           round((sum(duration_ms) FILTER (WHERE event = 'stage') / 1000)::numeric, 1) AS stage_seconds,
+                           sum(prompt_tokens) AS prompt_tokens,
+                           sum(completion_tokens) AS completion_tokens
+                    FROM task_events
+                    WHERE at > CURRENT_TIMESTAMP - make_interval(days => %s)
+                    GROUP BY 1 ORDER BY 1;
+                """, (days,))
+                return cur.fetchall()
+
+    def get_stage_timings(self, days=7):
+        """Duration percentiles and tokens per stage and model over the last `days`."""
+        with self.get_conn("get_stage_timings") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT stage, model, count(*) AS runs,
+                           percentile_cont(0.5) WITHIN GROUP (ORDER BY duration_ms) AS p50_ms,
+                           percentile_cont(0.95) WITHIN GROUP (ORDER BY duration_ms) AS p95_ms,
+                           avg(prompt_tokens) AS avg_prompt_tokens,
+                           avg(completion_tokens) AS avg_completion_tokens
+                    FROM task_events
+                    WHERE event = 'stage' AND at > CURRENT_TIMESTAMP - make_interval(days => %s)
+                    GROUP BY stage, model ORDER BY stage, model;
+                """, (days,))
+                return cur.fetchall()
+
+    def get_stage_outputs(self, doc_id):
+        """Returns {stage: {"fingerprint": ..., "output": ...}} for a document."""
+        with self.get_conn("get_stage_outputs") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("SELECT stage, fingerprint, output FROM stage_outputs WHERE doc_id = %s", (doc_id,))
+                return {r['stage']: r for r in cur.fetchall()}
+
+    def save_stage_output(self, doc_id, stage, fingerprint, output):
+        with self.get_conn("save_stage_output") as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(SAVE_STAGE_OUTPUT_SQL, (doc_id, stage, fingerprint, Json(output)))
+                conn.commit()
+                return True
+            except Exception as e:
+                logger.error(f"Error saving stage output: {e}")
+                conn.rollback()
+                return False
+
+    def clear_stage_outputs(self, doc_id):
+        with self.get_conn("clear_stage_outputs") as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM stage_outputs WHERE doc_id = %s", (doc_id,))
+                    # Drop the task's checkpoints as well so it restarts from the first stage
+                    cur.execute("UPDATE processing_tasks SET stage = NULL WHERE doc_id = %s;", (doc_id,))
+                    cur.execute("""
+                        UPDATE task_results
+                        SET results = results - 'checkpoints', updated_at = CURRENT_TIMESTAMP
+                        WHERE doc_id = %s;
+                    """, (doc_id,))
+                conn.commit()
+                return True
+            except Exception as e:
+                logger.error(f"Error clearing stage outputs: {e}")
+                conn.rollback()
+                return False
+
+    def get_slow_queries(self, limit=50):
+        with self.get_conn("get_slow_queries") as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("SELECT * FROM slow_queries ORDER BY captured_at DESC LIMIT %s", (limit,))
+                return cur.fetchall()
+
+    def clear_slow_queries(self):
+        with self.get_conn("clear_slow_queries") as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM slow_queries")
+                conn.commit()
+            except Exception as e:
+                logger.error(f"Error clearing slow queries: {e}")
+                conn.rollback()
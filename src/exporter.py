@@ -0,0 +1,135 @@
+"""Bulk export of the knowledge base, streamed so memory stays flat however large the corpus.
+
+    python exporter.py --format zip --out backup.zip
+    python exporter.py --format parquet --out corpus.parquet --level L0 --category Engineering
+    python exporter.py --format zip --out picked.zip --ids <uuid>,<uuid>
+
+zip:     one markdown file per document (<category>/<level>/<id>.md) with regenerated
+         frontmatter: id, title, category, level, date, keywords and the parent/summary links.
+parquet: one row per document including metadata, links and the embedding.
+Rows come from a server-side cursor in batches of DB_STREAM_ITERSIZE and each batch is
+written (one zip entry per document, one Parquet row group per batch) before the next is read.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import zipfile
+
+import frontmatter
+
+from db_manager import DBManager
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("zip", "parquet")
+EXPORT_DIR = os.environ.get("EXPORT_DIR", "exports")
+
+def _path_part(value, fallback):
+    return re.sub(r'[^\w\-. ]+', '_', str(value or fallback)).strip() or fallback
+
+def document_markdown(doc):
+    """The document body behind freshly generated frontmatter (any stored frontmatter is replaced)."""
+    try:
+        body = frontmatter.loads(doc['content'] or "").content
+    except Exception:
+        body = doc['content'] or ""
+    meta = doc.get('metadata') or {}
+    fields = {
+        "id": str(doc['id']),
+        "title": doc.get('title') or meta.get('title'),
+        "category": doc.get('category'),
+        "level": doc.get('level'),
+        "date": meta.get('date'),
+        "keywords": meta.get('keywords'),
+        "sources": [str(u) for u in doc.get('source_uuids') or []], # parents of a summary
+        "summaries": [str(u) for u in doc.get('summary_uuids') or []],
+        "created_at": doc['created_at'].isoformat() if doc.get('created_at') else None,
+    }
+    return frontmatter.dumps(frontmatter.Post(body, **{k: v for k, v in fields.items() if v not in (None, [])})) + "\n"
+
+def export_zip(batches, path):
+    count = 0
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for rows in batches:
+            for doc in rows:
+                name = f"{_path_part(doc['category'], 'uncategorized')}/{_path_part(doc['level'], 'L0')}/{doc['id']}.md"
+                zf.writestr(name, document_markdown(doc))
+                count += 1
+    return count
+
+def _parquet_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("id", pa.string()),
+        ("title", pa.string()),
+        ("category", pa.string()),
+        ("level", pa.string()),
+        ("metadata", pa.string()), # JSON
+        ("content", pa.string()),
+        ("summary_uuids", pa.list_(pa.string())),
+        ("source_uuids", pa.list_(pa.string())),
+        ("created_at", pa.timestamp("us", tz="UTC")),
+        ("embedding_model", pa.string()),
+        ("embedding", pa.list_(pa.float32())),
+    ])
+
+def export_parquet(batches, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = _parquet_schema()
+    count = 0
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for rows in batches:
+            columns = {
+                "id": [str(r['id']) for r in rows],
+                "title": [r['title'] for r in rows],
+                "category": [r['category'] for r in rows],
+                "level": [r['level'] for r in rows],
+                "metadata": [json.dumps(r['metadata'], ensure_ascii=False) if r['metadata'] is not None else None for r in rows],
+                "content": [r['content'] for r in rows],
+                "summary_uuids": [[str(u) for u in r['summary_uuids']] if r['summary_uuids'] is not None else None for r in rows],
+                "source_uuids": [[str(u) for u in r['source_uuids']] if r['source_uuids'] is not None else None for r in rows],
+                "created_at": [r['created_at'] for r in rows],
+                "embedding_model": [r.get('embedding_model') for r in rows],
+                "embedding": [r['embedding'].tolist() if r.get('embedding') is not None else None for r in rows],
+            }
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            count += len(rows)
+    return count
+
+def export_documents(db, fmt, path, include_embedding=True, **filters):
+    """Writes the documents matching `filters` (DBManager.iter_export_batches arguments) to `path`
+    as "zip" or "parquet". Returns the number of documents written."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}, expected one of {FORMATS}")
+    batches = db.iter_export_batches(include_embedding=include_embedding and fmt == "parquet", **filters)
+    tmp = path + ".part"
+    try:
+        count = export_zip(batches, tmp) if fmt == "zip" else export_parquet(batches, tmp)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    finally:
+        batches.close()
+    os.replace(tmp, path) # a half-written export never takes the final name
+    logger.info(f"Exported {count} documents to {path}")
+    return count
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Export documents to a markdown zip or a Parquet file.")
+    parser.add_argument("--format", choices=FORMATS, default="zip")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--category")
+    parser.add_argument("--level", choices=["L0", "L1", "L2", "L3"])
+    parser.add_argument("--query", help="content substring, as in the search tab")
+    parser.add_argument("--ids", help="comma-separated document ids")
+    parser.add_argument("--no-embeddings", action="store_true", help="leave the embedding column out of Parquet")
+    args = parser.parse_args()
+
+    export_documents(DBManager(), args.format, args.out, include_embedding=not args.no_embeddings,
+                     query_text=args.query, category=args.category, level=args.level,
+                     doc_ids=args.ids.split(",") if args.ids else None)
@@ -2,15 +2,377 @@ import requests
 import json
 import logging
 import os
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+import metrics
 
 logger = logging.getLogger(__name__)
 
+# Used when /models does not report limits. Override per model with the LLM_MODEL_INFO env var,
+# e.g. LLM_MODEL_INFO='{"Qwen3-80b-Instruct": {"context_window": 32768}}'
+DEFAULT_MODEL_INFO = {"context_window": 8192, "chars_per_token": 3.5, "max_output_tokens": 1024}
+MODEL_INFO_OVERRIDES = json.loads(os.environ.get("LLM_MODEL_INFO", "{}"))
+PROMPT_OVERHEAD_TOKENS = 64   # chat template and role markers
+MIN_OUTPUT_TOKENS = 256       # below this a call is not worth sending
+
+# Token totals of the calls made inside track_usage() (per thread / asyncio task)
+_usage = contextvars.ContextVar("llm_usage", default=None)
+
+@contextmanager
+def track_usage():
+    """Yields {"prompt_tokens", "completion_tokens"} summed over the LLM calls made inside the
+    block, chunked and map-reduce calls included."""
+    usage = {"prompt_tokens": 0, "completion_tokens": 0}
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+
+class LLMError(Exception):
+    """An LLM call failed. `transient` failures (timeouts, 429, 5xx, unreachable, bad JSON) are worth retrying."""
+    def __init__(self, message, transient=True):
+        super().__init__(message)
+        self.transient = transient
+
+    @staticmethod
+    def from_exception(model, e):
+        transient = True
+        if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+            code = e.response.status_code
+            transient = code in (408, 429) or code >= 500
+        return LLMError(f"{model}: {e}", transient=transient)
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit for one (endpoint, model).
+    Grows by ~1 per window of successful calls while latency stays near its baseline,
+    shrinks gently when latency rises and halves on 429s, 5xx and timeouts.
+    The baseline is the minimum over the last `baseline_window` seconds: it follows model or
+    hardware changes, but sustained overload can't drag it up and silence the backoff."""
+    def __init__(self, initial=2, min_limit=1, max_limit=64, backoff=0.5, tolerance=1.5, baseline_window=600):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self.baseline = None     # best observed seconds per completion token within the window
+        self.baseline_window = baseline_window
+        self._samples = deque()  # (time, sample) with increasing samples: a sliding-window minimum
+        self.latency_ewma = None
+        self.queue_delay_ewma = 0.0
+        self.successes = 0
+        self.drops = 0
+        self._cond = threading.Condition()
+
+    def _has_slot(self):
+        return self.in_flight < int(self.limit)
+
+    def _admit(self, start):
+        """Takes a slot (the caller holds the lock); returns the seconds waited since `start`."""
+        self.in_flight += 1
+        waited = time.monotonic() - start
+        self.queue_delay_ewma = 0.8 * self.queue_delay_ewma + 0.2 * waited
+        return waited
+
+    def acquire(self):
+        start = time.monotonic()
+        with self._cond:
+            while not self._has_slot():
+                self._cond.wait()
+            return self._admit(start)
+
+    def release(self, latency, tokens=None, overloaded=False):
+        with self._cond:
+            self.in_flight -= 1
+            if overloaded:
+                self.drops += 1
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+            elif latency is not None:
+                self.successes += 1
+                # Normalise by output length so long summaries don't look like overload
+                sample = latency / max(1, tokens or 1)
+                self.latency_ewma = sample if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * sample
+                now = time.monotonic()
+                while self._samples and self._samples[-1][1] >= sample:
+                    self._samples.pop()
+                self._samples.append((now, sample))
+                while self._samples[0][0] < now - self.baseline_window:
+                    self._samples.popleft()
+                self.baseline = self._samples[0][1]
+                if self.latency_ewma <= self.baseline * self.tolerance:
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                else:
+                    self.limit = max(self.min_limit, self.limit * 0.9)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "queue_delay_ms": round(self.queue_delay_ewma * 1000, 1),
+                "latency_per_token_ms": round((self.latency_ewma or 0) * 1000, 2),
+                "baseline_per_token_ms": round((self.baseline or 0) * 1000, 2),
+                "successes": self.successes,
+                "drops": self.drops,
+            }
+
+class Endpoint:
+    """One inference server in the pool, with its served models and circuit-breaker state."""
+    FAILURE_THRESHOLD = 3   # consecutive failures before ejection
+    BASE_COOLDOWN = 30      # seconds, doubled per repeated ejection
+    MAX_COOLDOWN = 300
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.models = None          # None = not discovered yet (treated as "serves anything")
+        self.model_info = {}        # model id -> limits reported by /models
+        self.models_fetched_at = 0
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0
+
+    def is_healthy(self):
+        return time.time() >= self.ejected_until
+
+    def serves(self, model):
+        return self.models is None or model in self.models
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.FAILURE_THRESHOLD:
+            cooldown = min(self.MAX_COOLDOWN, self.BASE_COOLDOWN * (2 ** self.ejections))
+            self.ejected_until = time.time() + cooldown
+            self.ejections += 1
+            # Half-open after the cooldown: the next failure ejects again immediately
+            self.consecutive_failures = self.FAILURE_THRESHOLD - 1
+            logger.warning(f"Ejecting LLM endpoint {self.url} for {cooldown}s")
+
 class LLMClient:
-    def __init__(self, base_url="http://192.168.1.238:8080/v1"):
+    MODELS_TTL = 60  # seconds between /models refreshes per endpoint
+
+    def __init__(self, base_url=os.environ.get("LLM_BASE_URLS", "http://192.168.1.238:8080/v1")):
+        self.endpoints = {}
+        self._lock = threading.Lock()
         self.base_url = base_url
         self.history_file = "prompt_history.json"
+        self.limiters = {}
         self._load_history()
 
+    @property
+    def base_url(self):
+        return ",".join(self.endpoints)
+
+    @base_url.setter
+    def base_url(self, value):
+        """Accepts one URL, a comma-separated string or a list. Known endpoints keep their state."""
+        urls = value.split(",") if isinstance(value, str) else list(value)
+        urls = [u.strip().rstrip("/") for u in urls if u and u.strip()]
+        with self._lock:
+            self.endpoints = {u: self.endpoints.get(u) or Endpoint(u) for u in urls}
+
+    def _refresh_models(self, ep, force=False):
+        if not force and ep.models is not None and time.time() - ep.models_fetched_at < self.MODELS_TTL:
+            return
+        try:
+            response = requests.get(f"{ep.url}/models", timeout=5)
+            response.raise_for_status()
+            data = response.json()['data']
+            ep.models = {m['id'] for m in data}
+            ep.model_info = {m['id']: self._parse_model_limits(m) for m in data}
+            ep.record_success()
+        except Exception as e:
+            logger.warning(f"Model discovery failed for {ep.url}: {e}")
+            ep.record_failure()
+        ep.models_fetched_at = time.time()
+
+    @staticmethod
+    def _parse_model_limits(entry):
+        """Context window as reported by vLLM (max_model_len), llama.cpp (meta.n_ctx*) or others."""
+        meta = entry.get('meta') or {}
+        ctx = entry.get('max_model_len') or entry.get('context_length') or meta.get('n_ctx') or meta.get('n_ctx_train')
+        return {"context_window": int(ctx)} if ctx else {}
+
+    def get_model_info(self, model):
+        """Context window, chars-per-token estimate and max output tokens for `model`.
+        With several endpoints serving it, the smallest reported window wins."""
+        info = dict(DEFAULT_MODEL_INFO)
+        reported = [ep.model_info[model]['context_window'] for ep in list(self.endpoints.values())
+                    if ep.model_info.get(model, {}).get('context_window')]
+        if reported:
+            info['context_window'] = min(reported)
+        info.update(MODEL_INFO_OVERRIDES.get(model, {}))
+        return info
+
+    def estimate_tokens(self, text, model):
+        return int(len(text or "") / self.get_model_info(model)['chars_per_token']) + 1
+
+    def fits(self, text, model):
+        """True if `text` as a prompt leaves at least MIN_OUTPUT_TOKENS of room in the context."""
+        info = self.get_model_info(model)
+        return info['context_window'] - PROMPT_OVERHEAD_TOKENS - self.estimate_tokens(text, model) >= MIN_OUTPUT_TOKENS
+
+    def route_model(self, model, text, long_model=None):
+        """Model to use for `text`: `model` if it fits, else `long_model` if that fits, else `model` (chunked path)."""
+        if self.fits(text, model) or not long_model or long_model == model:
+            return model
+        if self.fits(text, long_model):
+            logger.info(f"Routing {len(text)} chars from {model} to long-context model {long_model}")
+            return long_model
+        return model
+
+    def _max_tokens(self, model, prompt_text):
+        info = self.get_model_info(model)
+        room = info['context_window'] - PROMPT_OVERHEAD_TOKENS - self.estimate_tokens(prompt_text, model)
+        return max(1, min(info['max_output_tokens'], room))
+
+    @staticmethod
+    def _split_for_budget(text, max_chars):
+        """Splits on paragraph boundaries into pieces of at most max_chars (hard-cuts oversize paragraphs)."""
+        chunks, current = [], ""
+        for para in text.split("\n\n"):
+            while len(para) > max_chars:
+                if current:
+                    chunks.append(current)
+                    current = ""
+                chunks.append(para[:max_chars])
+                para = para[max_chars:]
+            if current and len(current) + len(para) + 2 > max_chars:
+                chunks.append(current)
+                current = ""
+            current = f"{current}\n\n{para}" if current else para
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def _content_budget_chars(self, model, prompt_template):
+        """How many characters of document fit next to the prompt, leaving room for the answer."""
+        info = self.get_model_info(model)
+        tokens = info['context_window'] - PROMPT_OVERHEAD_TOKENS - info['max_output_tokens'] - self.estimate_tokens(prompt_template, model)
+        return max(1000, int(tokens * info['chars_per_token']))
+
+    def check_health(self):
+        """Active health check: probes /models on every endpoint, re-admitting ejected ones that answer."""
+        for ep in list(self.endpoints.values()):
+            self._refresh_models(ep, force=True)
+        return self.get_endpoint_stats()
+
+    def get_endpoint_stats(self):
+        return [{
+            "endpoint": ep.url,
+            "healthy": ep.is_healthy(),
+            "outstanding": ep.outstanding,
+            "models": sorted(ep.models) if ep.models else [],
+        } for ep in list(self.endpoints.values())]
+
+    def _pick_endpoint(self, model):
+        """Least-outstanding-requests choice among healthy endpoints serving `model`."""
+        for ep in list(self.endpoints.values()):
+            if ep.is_healthy():
+                self._refresh_models(ep)
+        with self._lock:
+            candidates = [ep for ep in self.endpoints.values() if ep.is_healthy() and ep.serves(model)]
+            if not candidates:
+                # Everything serving this model is ejected: try the one that comes back first
+                candidates = sorted((ep for ep in self.endpoints.values() if ep.serves(model)), key=lambda e: e.ejected_until)[:1]
+            if not candidates:
+                raise RuntimeError(f"No LLM endpoint serves model '{model}'")
+            ep = min(candidates, key=lambda e: e.outstanding)
+            ep.outstanding += 1
+            return ep
+
+    def _get_limiter(self, url, model):
+        key = (url, model)
+        with self._lock:
+            if key not in self.limiters:
+                self.limiters[key] = AdaptiveLimiter()
+            return self.limiters[key]
+
+    def get_limiter_stats(self):
+        """Current limit, in-flight count and queueing delay per (endpoint, model)."""
+        with self._lock:
+            items = list(self.limiters.items())
+        return [{"endpoint": url, "model": model, **lim.stats()} for (url, model), lim in items]
+
+    @staticmethod
+    def _record_call(ep, model, outcome, latency=None, data=None):
+        """Per-model request, error, latency and token metrics (shared by the async client)."""
+        metrics.inc("llm_requests_total", model=model, endpoint=ep.url, outcome=outcome)
+        if latency is None:
+            return
+        metrics.observe("llm_request_seconds", latency, model=model)
+        usage = (data or {}).get('usage') or {}
+        metrics.inc("llm_prompt_tokens_total", usage.get('prompt_tokens') or 0, model=model)
+        metrics.inc("llm_completion_tokens_total", usage.get('completion_tokens') or 0, model=model)
+        tracked = _usage.get()
+        if tracked is not None:
+            tracked["prompt_tokens"] += usage.get('prompt_tokens') or 0
+            tracked["completion_tokens"] += usage.get('completion_tokens') or 0
+        # tokens/sec per model = llm_completion_tokens_total / llm_generation_seconds_total
+        metrics.inc("llm_generation_seconds_total", latency, model=model)
+
+    @staticmethod
+    def _is_overload(status_code):
+        return status_code == 429 or status_code >= 500
+
+    def _settle_call(self, ep, limiter, model, outcome, latency=None, data=None):
+        """Limiter, circuit-breaker and metrics bookkeeping for one finished call (shared by the
+        async client). `outcome` is "ok", "error", "timeout", "unreachable" or an overload status
+        code: overloads and timeouts shrink the limit, and all but 429 count against the endpoint."""
+        if outcome == "ok":
+            limiter.release(latency, (data.get('usage') or {}).get('completion_tokens'))
+            ep.record_success()
+        elif outcome == "error":
+            limiter.release(None)
+        else:
+            limiter.release(None, overloaded=True)
+            if outcome != "429":
+                ep.record_failure()
+        self._record_call(ep, model, outcome, latency, data)
+
+    def _release_endpoint(self, ep):
+        with self._lock:
+            ep.outstanding -= 1
+
+    def _post_chat(self, model, payload, timeout):
+        """POST /chat/completions to the least loaded endpoint, through its adaptive limiter."""
+        ep = self._pick_endpoint(model)
+        limiter = self._get_limiter(ep.url, model)
+        try:
+            limiter.acquire()
+            start = time.monotonic()
+            try:
+                response = requests.post(f"{ep.url}/chat/completions", headers={"Content-Type": "application/json"}, json=payload, timeout=timeout)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                self._settle_call(ep, limiter, model, "timeout" if isinstance(e, requests.exceptions.Timeout) else "unreachable")
+                raise
+            except Exception:
+                self._settle_call(ep, limiter, model, "error")
+                raise
+            if self._is_overload(response.status_code):
+                self._settle_call(ep, limiter, model, str(response.status_code))
+                response.raise_for_status()
+            try:
+                response.raise_for_status()
+                data = response.json()
+            except Exception:
+                self._settle_call(ep, limiter, model, "error")
+                raise
+            self._settle_call(ep, limiter, model, "ok", time.monotonic() - start, data)
+            return data
+        finally:
+            self._release_endpoint(ep)
+
     def _load_history(self):
         if os.path.exists(self.history_file):
             try:
@@ -34,49 +396,87 @@ class LLMClient:
     def get_history(self):
         return self.history
 
-    def generate_content(self, content, model, prompt_template):
-        url = f"{self.base_url}/chat/completions"
-        headers = {"Content-Type": "application/json"}
-        payload = {
+    def _summary_payload(self, content, model, prompt_template):
+        """Chat payload for a summary, or None if the document needs the chunked path."""
+        full_prompt = f"{prompt_template}\n\nContent:\n{content}"
+        if not self.fits(full_prompt, model):
+            return None
+        return {
             "model": model,
-            "messages": [{"role": "user", "content": f"{prompt_template}\n\nContent:\n{content}"}],
+            "messages": [{"role": "user", "content": full_prompt}],
             "temperature": 0.3,
+            "max_tokens": self._max_tokens(model, full_prompt),
         }
-        
-        try:
-            response = requests.post(url, headers=headers, json=payload, timeout=180)
-            response.raise_for_status()
-            data = response.json()
-            return data['choices'][0]['message']['content']
-        except Exception as e:
-            logger.error(f"Error calling LLM ({model}): {e}")
-            return f"Error: {e}"
 
-    def extract_metadata(self, content, model, prompt_template):
-        """Extracts date and keywords as a JSON object"""
-        url = f"{self.base_url}/chat/completions"
-        headers = {"Content-Type": "application/json"}
+    def _chunk_prompts(self, content, model, prompt_template):
+        """(parts, per-part prompt builder, reduce prompt) for documents larger than the context."""
+        parts = self._split_for_budget(content, self._content_budget_chars(model, prompt_template))
+        logger.info(f"Document too large for {model}, summarizing in {len(parts)} parts")
+        part_prompt = lambda i: f"{prompt_template}\n\n(This is part {i + 1} of {len(parts)} of a longer document.)"
+        reduce_prompt = f"{prompt_template}\n\n(The content below is a set of summaries of consecutive parts of one document. Combine them into one summary.)"
+        return parts, part_prompt, reduce_prompt
+
+    def _metadata_payload(self, content, model, prompt_template):
+        # Metadata lives near the top; keep only the head of oversize documents
+        budget = self._content_budget_chars(model, prompt_template)
+        if len(content) > budget:
+            content = content[:budget]
         # Expecting JSON response
         full_prompt = f"{prompt_template}\n\nContent:\n{content}\n\nReturn ONLY a JSON object with 'date' (YYYY-MM-DD or similar), 'keywords' (list of strings), and 'title' (a short, descriptive title as a string. MANDATORY: ALWAYS GENERATE A TITLE)."
-        payload = {
+        return {
             "model": model,
             "messages": [{"role": "user", "content": full_prompt}],
             "temperature": 0.1,
+            "max_tokens": self._max_tokens(model, full_prompt),
             "response_format": {"type": "json_object"}
         }
+
+    def generate_content(self, content, model, prompt_template, raise_errors=False):
+        """Returns the summary text. On failure returns "Error: ..." or, with raise_errors, raises LLMError."""
+        payload = self._summary_payload(content, model, prompt_template)
+        if payload is None:
+            return self._generate_chunked(content, model, prompt_template, raise_errors)
+        
         try:
-            response = requests.post(url, headers=headers, json=payload, timeout=60)
-            response.raise_for_status()
-            data = response.json()
+            data = self._post_chat(model, payload, timeout=180)
+            return data['choices'][0]['message']['content']
+        except Exception as e:
+            logger.error(f"Error calling LLM ({model}): {e}")
+            if raise_errors:
+                raise LLMError.from_exception(model, e) from e
+            return f"Error: {e}"
+
+    def _generate_chunked(self, content, model, prompt_template, raise_errors=False):
+        """Map-reduce for documents larger than the context: summarize each part, then the parts."""
+        parts, part_prompt, reduce_prompt = self._chunk_prompts(content, model, prompt_template)
+        partials = []
+        for i, part in enumerate(parts):
+            out = self.generate_content(part, model, part_prompt(i), raise_errors)
+            if out.startswith("Error:"):
+                return out
+            partials.append(out)
+        return self.generate_content("\n\n".join(partials), model, reduce_prompt, raise_errors)
+
+    def extract_metadata(self, content, model, prompt_template, raise_errors=False):
+        """Extracts date and keywords as a JSON object"""
+        payload = self._metadata_payload(content, model, prompt_template)
+        try:
+            data = self._post_chat(model, payload, timeout=60)
             return json.loads(data['choices'][0]['message']['content'])
         except Exception as e:
             logger.error(f"Metadata extract error: {e}")
+            if raise_errors:
+                raise LLMError.from_exception(model, e) from e
             return {"date": "unknown", "keywords": [], "title": "unknown"}
             
     def get_available_models(self):
-        try:
-            response = requests.get(f"{self.base_url}/models", timeout=5)
-            data = response.json()
-            return [m['id'] for m in data['data']]
-        except:
+        """Union of the models served by all healthy endpoints."""
+        models = set()
+        for ep in list(self.endpoints.values()):
+            if ep.is_healthy():
+                self._refresh_models(ep)
+            if ep.is_healthy() and ep.models:
+                models |= ep.models
+        if not models:
             return ["Qwen3-80b-Instruct", "llama-3-8b"] # Fallback
+        return sorted(models)
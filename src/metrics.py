@@ -0,0 +1,140 @@
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers fast DB queries up to long LLM summaries
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+class Registry:
+    """Minimal thread-safe counters, gauges and fixed-bucket histograms with labels.
+    Exposed in Prometheus text format and as a JSON snapshot for the `worker_metrics` table."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = {"buckets": list(buckets), "counts": [0] * (len(buckets) + 1), "sum": 0.0, "count": 0}
+            h["counts"][bisect.bisect_left(h["buckets"], value)] += 1
+            h["sum"] += value
+            h["count"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in self.counters.items()],
+                "gauges": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in self.gauges.items()],
+                "histograms": [{"name": n, "labels": dict(l), "buckets": list(h["buckets"]), "counts": list(h["counts"]),
+                                "sum": h["sum"], "count": h["count"]} for (n, l), h in self.histograms.items()],
+            }
+
+    def render_prometheus(self):
+        def fmt_labels(labels, extra=None):
+            items = list(labels) + (extra or [])
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{str(v).replace(chr(34), chr(39))}"' for k, v in items) + "}"
+
+        lines = []
+        with self._lock:
+            for kind, store in (("counter", self.counters), ("gauge", self.gauges)):
+                seen = set()
+                for (name, labels), value in sorted(store.items()):
+                    if name not in seen:
+                        lines.append(f"# TYPE {name} {kind}")
+                        seen.add(name)
+                    lines.append(f"{name}{fmt_labels(labels)} {value}")
+            seen = set()
+            for (name, labels), h in sorted(self.histograms.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} histogram")
+                    seen.add(name)
+                cumulative = 0
+                for bound, count in zip(h["buckets"] + ["+Inf"], h["counts"]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{fmt_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{fmt_labels(labels)} {h['sum']}")
+                lines.append(f"{name}_count{fmt_labels(labels)} {h['count']}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+inc = REGISTRY.inc
+set_gauge = REGISTRY.set_gauge
+observe = REGISTRY.observe
+snapshot = REGISTRY.snapshot
+
+def histogram_quantile(q, buckets, counts):
+    """Upper bucket bound below which a fraction q of observations fall (None if empty)."""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    cumulative = 0
+    for bound, count in zip(list(buckets) + [float("inf")], counts):
+        cumulative += count
+        if cumulative >= rank:
+            return bound
+    return float("inf")
+
+def merge_histograms(snapshots, name, group_by):
+    """Merges histogram `name` across worker snapshots, grouped by one label.
+    Returns {label value: {"buckets", "counts", "sum", "count"}}."""
+    merged = {}
+    for snap in snapshots:
+        for h in snap.get("histograms", []):
+            if h["name"] != name:
+                continue
+            key = h["labels"].get(group_by, "")
+            m = merged.setdefault(key, {"buckets": h["buckets"], "counts": [0] * len(h["counts"]), "sum": 0.0, "count": 0})
+            m["counts"] = [a + b for a, b in zip(m["counts"], h["counts"])]
+            m["sum"] += h["sum"]
+            m["count"] += h["count"]
+    return merged
+
+def start_http_server(port, registry=REGISTRY):
+    """Serves GET /metrics in Prometheus text format from a daemon thread."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    except OSError as e:
+        logger.warning(f"Metrics endpoint disabled, cannot bind port {port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Metrics endpoint on :{port}/metrics")
+    return server
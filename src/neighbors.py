@@ -0,0 +1,134 @@
+"""Precomputed "related documents": the NEIGHBORS_K nearest documents of the same level for
+every document, stored in document_neighbors.
+
+    python neighbors.py                  # incremental update
+    python neighbors.py --interval 300   # keep updating every 5 minutes
+    python neighbors.py --full           # recompute every list
+
+An update loads the level's active-model vectors and recomputes, in matrix batches:
+- documents whose vector is new or changed (md5 of the vector vs neighbor_sources),
+- documents that listed one of those (their neighbour moved),
+- documents a new/changed vector now beats the weakest entry of,
+- documents with a short list (a neighbour was deleted).
+Everything else keeps its stored list.
+"""
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+
+from db_manager import DBManager
+
+logger = logging.getLogger(__name__)
+
+NEIGHBORS_K = int(os.environ.get("NEIGHBORS_K", "10"))
+# Query rows per similarity matrix (NEIGHBORS_BATCH x documents floats)
+NEIGHBORS_BATCH = int(os.environ.get("NEIGHBORS_BATCH", "256"))
+LEVELS = ["L0", "L1", "L2", "L3"]
+
+def top_k(sims, k):
+    """Column indices and values of the k largest entries per row, best first."""
+    idx = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    vals = np.take_along_axis(sims, idx, axis=1)
+    order = np.argsort(-vals, axis=1)
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(vals, order, axis=1)
+
+def similar_clusters(pairs):
+    """Connected components (lists of ids, largest first) of (a, b) pairs."""
+    parent = {}
+
+    def find(i):
+        while parent.setdefault(i, i) != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b in pairs:
+        parent[find(str(a))] = find(str(b))
+    groups = {}
+    for i in parent:
+        groups.setdefault(find(i), []).append(i)
+    return sorted(groups.values(), key=len, reverse=True)
+
+class NeighborGraph:
+    def __init__(self, db, k=NEIGHBORS_K, batch_size=NEIGHBORS_BATCH):
+        self.db = db
+        self.k = k
+        self.batch_size = batch_size
+
+    def _load(self, level):
+        ids, vectors, md5s, stale = [], [], [], []
+        for rows in self.db.iter_neighbor_vectors(level):
+            for r in rows:
+                ids.append(str(r['id']))
+                vectors.append(np.asarray(r['embedding'], dtype=np.float32))
+                md5s.append(r['embedding_md5'])
+                stale.append(r['stale'])
+        if not ids:
+            return ids, None, md5s, np.zeros(0, dtype=bool)
+        x = np.vstack(vectors)
+        x /= np.clip(np.linalg.norm(x, axis=1, keepdims=True), 1e-12, None)
+        return ids, x, md5s, np.array(stale, dtype=bool)
+
+    def update_level(self, level, model, full=False):
+        ids, x, md5s, stale = self._load(level)
+        n = len(ids)
+        k = min(self.k, n - 1)
+        if k < 1:
+            return 0
+        row = {doc_id: i for i, doc_id in enumerate(ids)}
+        todo = np.ones(n, dtype=bool) if full else stale.copy()
+
+        if not full:
+            # Weakest stored similarity per list; short lists are recomputed
+            threshold = np.full(n, np.inf, dtype=np.float32)
+            listed = np.zeros(n, dtype=bool)
+            for doc_id, (lowest, length) in self.db.get_neighbor_list_stats(level).items():
+                if doc_id in row:
+                    listed[row[doc_id]] = True
+                    if length < k:
+                        todo[row[doc_id]] = True
+                    else:
+                        threshold[row[doc_id]] = lowest
+            todo |= ~listed
+            changed = np.flatnonzero(stale)
+            for doc_id in self.db.get_docs_listing_neighbors([ids[i] for i in changed]):
+                if doc_id in row:
+                    todo[row[doc_id]] = True
+            for start in range(0, len(changed), self.batch_size):
+                batch = changed[start:start + self.batch_size]
+                sims = x[batch] @ x.T
+                sims[np.arange(len(batch)), batch] = -np.inf
+                todo |= (sims > threshold[None, :]).any(axis=0)
+
+        rows = np.flatnonzero(todo)
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            sims = x[batch] @ x.T
+            sims[np.arange(len(batch)), batch] = -np.inf # never one's own neighbour
+            idx, vals = top_k(sims, k)
+            items = [(ids[i], md5s[i], [(ids[j], v) for j, v in zip(idx[b], vals[b])]) for b, i in enumerate(batch)]
+            if not self.db.save_neighbors(model, items):
+                raise RuntimeError("Could not save neighbour lists")
+        logger.info(f"{level}: {n} documents, {len(rows)} neighbour lists recomputed")
+        return len(rows)
+
+    def update(self, full=False):
+        model = self.db.get_active_embedding_model()
+        return sum(self.update_level(level, model, full) for level in LEVELS)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Compute the related-documents graph.")
+    parser.add_argument("--full", action="store_true", help="recompute every neighbour list")
+    parser.add_argument("--k", type=int, default=NEIGHBORS_K)
+    parser.add_argument("--interval", type=float, help="repeat the incremental update every N seconds")
+    args = parser.parse_args()
+
+    graph = NeighborGraph(DBManager(), args.k)
+    graph.update(full=args.full)
+    while args.interval:
+        time.sleep(args.interval)
+        graph.update()
@@ -0,0 +1,58 @@
+"""Cuts L0 documents into heading-aware passages and stores a vector per passage
+(document_chunks) for passage_search.
+
+    python passage_backfill.py --batch 32 --max-docs-per-sec 20
+
+Workers keep passages current for every document they process; this covers documents
+stored before, and rebuilds all passages after a switch of the embedding model.
+Only documents whose passages are missing or stale are encoded, so it can be re-run.
+"""
+import argparse
+import logging
+import time
+
+from db_manager import DBManager
+from embedder import make_embedder
+from utils.md_processor import MDProcessor
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("passage_backfill.log"),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger("PassageBackfill")
+
+def backfill(db, batch_size=32, max_docs_per_sec=None):
+    model = db.get_active_embedding_model()
+    embedder = make_embedder(model)
+    logger.info(f"Encoding passages with {model}")
+    after_id, total = None, 0
+    while True:
+        docs = db.stale_chunk_batch(model, after_id, batch_size)
+        if not docs:
+            break
+        started = time.monotonic()
+        after_id = docs[-1]['id']
+        # One encode call for the passages of the whole batch
+        passages = [MDProcessor.split_passages(doc['content']) for doc in docs]
+        texts = [MDProcessor.passage_text(p) for doc_passages in passages for p in doc_passages]
+        vectors = iter(embedder.encode(texts).tolist() if texts else [])
+        rows = [(doc['id'], doc['content'], doc_passages, [next(vectors) for _ in doc_passages])
+                for doc, doc_passages in zip(docs, passages)]
+        if not db.save_document_chunks(model, rows):
+            raise RuntimeError("Could not save passages")
+        total += len(docs)
+        logger.info(f"{total} document(s) done, {len(texts)} passage(s) in this batch, up to {after_id}")
+        if max_docs_per_sec:
+            time.sleep(max(0.0, len(docs) / max_docs_per_sec - (time.monotonic() - started)))
+    logger.info(f"Passages are current for {model} ({total} document(s) encoded)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill passage embeddings for long-document search.")
+    parser.add_argument("--batch", type=int, default=32, help="documents per batch")
+    parser.add_argument("--max-docs-per-sec", type=float, default=None)
+    args = parser.parse_args()
+    backfill(DBManager(), args.batch, args.max_docs_per_sec)
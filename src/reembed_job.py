@@ -0,0 +1,118 @@
+"""Backfills vectors for a new embedding model while the current one keeps serving searches.
+
+    python reembed_job.py --model intfloat/multilingual-e5-small --max-docs-per-sec 50
+    python reembed_job.py --job 3          # resume (or run a job created in the Metrics tab)
+
+Documents are encoded in id order into document_embeddings; the checkpoint is saved with
+each batch, so a killed or paused job picks up where it stopped. Documents added or edited
+meanwhile are caught up afterwards, then the model is switched over atomically.
+"""
+import argparse
+import logging
+import time
+
+from db_manager import DBManager, EMBEDDING_DIM
+from embedder import make_embedder
+from utils.md_processor import MDProcessor
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("reembed.log"),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger("ReembedJob")
+
+MAX_ACTIVATE_ATTEMPTS = 5
+
+class ReembedJob:
+    def __init__(self, db, job_id, batch_size=64, max_docs_per_sec=None):
+        self.db = db
+        self.job_id = job_id
+        self.batch_size = batch_size
+        self.max_docs_per_sec = max_docs_per_sec
+        job = db.get_reembed_job(job_id)
+        if not job:
+            raise ValueError(f"Re-embedding job {job_id} not found")
+        self.model = job['model']
+        self.last_doc_id = job['last_doc_id']
+        self.embedder = make_embedder(self.model)
+
+    def _stopped(self):
+        """True when the job was paused or cancelled from the UI."""
+        status = self.db.get_reembed_job(self.job_id)['status']
+        if status in ("paused", "cancelled"):
+            logger.info(f"Job {self.job_id} {status}")
+            return True
+        return False
+
+    def _encode_and_save(self, docs, last_doc_id=None):
+        started = time.monotonic()
+        vectors = self.embedder.encode([d['content'] for d in docs], batch_size=self.batch_size)
+        # Fail on the first batch rather than at the switch-over after a full backfill
+        if len(vectors) and len(vectors[0]) != EMBEDDING_DIM:
+            raise ValueError(f"{self.model} produces {len(vectors[0])}-d vectors; documents.embedding is vector({EMBEDDING_DIM})")
+        rows = [(d['id'], MDProcessor.content_md5(d['content']), vec.tolist())
+                for d, vec in zip(docs, vectors)]
+        if not self.db.save_reembed_batch(self.job_id, self.model, rows, last_doc_id):
+            raise RuntimeError("Could not save re-embedding batch")
+        if self.max_docs_per_sec:
+            # Leave CPU and DB headroom for the workers and the app
+            time.sleep(max(0.0, len(docs) / self.max_docs_per_sec - (time.monotonic() - started)))
+
+    def backfill(self):
+        while True:
+            if self._stopped():
+                return False
+            docs = self.db.next_reembed_batch(self.last_doc_id, self.batch_size)
+            if not docs:
+                return True
+            self.last_doc_id = docs[-1]['id']
+            self._encode_and_save(docs, self.last_doc_id)
+            logger.info(f"Job {self.job_id}: encoded up to {self.last_doc_id}")
+
+    def catch_up(self):
+        while True:
+            if self._stopped():
+                return False
+            docs = self.db.stale_reembed_batch(self.model, self.batch_size)
+            if not docs:
+                return True
+            self._encode_and_save(docs)
+            logger.info(f"Job {self.job_id}: caught up {len(docs)} changed document(s)")
+
+    def run(self):
+        self.db.set_reembed_job_status(self.job_id, "running")
+        logger.info(f"Job {self.job_id}: re-embedding with {self.model}")
+        try:
+            if not self.backfill():
+                return
+            for _ in range(MAX_ACTIVATE_ATTEMPTS):
+                if not self.catch_up():
+                    return
+                missing = self.db.activate_embedding_model(self.model)
+                if not missing:
+                    self.db.set_reembed_job_status(self.job_id, "done")
+                    logger.info(f"Job {self.job_id}: {self.model} is now the active embedding model; "
+                                "run passage_backfill.py to re-encode the passages")
+                    return
+                logger.info(f"Job {self.job_id}: {missing} document(s) changed before the switch, catching up")
+            raise RuntimeError(f"Documents kept changing; gave up after {MAX_ACTIVATE_ATTEMPTS} switch attempts")
+        except Exception as e:
+            logger.error(f"Job {self.job_id} failed: {e}")
+            self.db.set_reembed_job_status(self.job_id, "failed", str(e))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-embed all documents with a new model and switch to it.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--model", help="start a new job for this model")
+    group.add_argument("--job", type=int, help="run or resume an existing job")
+    parser.add_argument("--batch", type=int, default=64)
+    parser.add_argument("--max-docs-per-sec", type=float, default=None)
+    args = parser.parse_args()
+
+    db = DBManager()
+    job_id = args.job or db.create_reembed_job(args.model)
+    ReembedJob(db, job_id, args.batch, args.max_docs_per_sec).run()
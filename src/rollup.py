@@ -0,0 +1,205 @@
+"""Builds L2 rollups of the L1 summaries and L3 rollups of the L2s, per category.
+
+    python rollup.py --model qwen2.5-7b-instruct
+    python rollup.py --model qwen2.5-7b-instruct --category Engineering --dry-run
+
+Summaries of a level are clustered on their embeddings (spherical k-means in NumPy,
+about ROLLUP_CLUSTER_SIZE members per cluster) and each cluster is summarized by the LLM
+into one document of the next level, linked to its members via source_uuids/summary_uuids.
+
+Runs are incremental: clustering starts from the existing rollups' centroids, each cluster
+takes over the rollup it shares most members with, and only clusters whose members (or the
+model or prompt) changed are summarized again. Rollups left without a cluster are deleted.
+"""
+import argparse
+import logging
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from db_manager import DBManager
+from embedder import make_embedder
+from llm_client import LLMClient
+from utils.md_processor import MDProcessor
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("rollup.log"),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger("Rollup")
+
+ROLLUP_LEVELS = [("L1", "L2"), ("L2", "L3")]
+ROLLUP_CLUSTER_SIZE = int(os.environ.get("ROLLUP_CLUSTER_SIZE", "12"))
+ROLLUP_MIN_SOURCES = 2 # a level with fewer documents is not rolled up
+ROLLUP_CONCURRENCY = int(os.environ.get("ROLLUP_CONCURRENCY", "4"))
+ROLLUP_KEYWORDS = 10
+DEFAULT_ROLLUP_PROMPT = ("The following are summaries of related documents. Write one overview of their common "
+                         "themes, key facts and decisions, mentioning notable differences. Be concise.")
+
+def _normalize(x):
+    return x / np.clip(np.linalg.norm(x, axis=1, keepdims=True), 1e-12, None)
+
+def spherical_kmeans(x, k, init=None, max_iter=50, seed=0):
+    """Cluster labels for the unit rows of `x` by cosine similarity. `init` rows seed the first
+    centroids (warm start); the rest are chosen k-means++ style."""
+    rng = np.random.default_rng(seed)
+    n = len(x)
+    k = min(k, n)
+    centroids = list(init[:k]) if init is not None and len(init) else []
+    if not centroids:
+        centroids.append(x[rng.integers(n)])
+    while len(centroids) < k:
+        # Next seed with probability proportional to its cosine distance from the nearest centroid
+        dist = np.clip(1 - (x @ np.array(centroids).T).max(axis=1), 0, None)
+        total = dist.sum()
+        centroids.append(x[rng.choice(n, p=dist / total)] if total > 0 else x[rng.integers(n)])
+    centroids = _normalize(np.array(centroids))
+
+    labels = None
+    for _ in range(max_iter):
+        sims = x @ centroids.T
+        new_labels = sims.argmax(axis=1)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, x)
+        counts = np.bincount(labels, minlength=k)
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            # Re-seed empty clusters with the points worst served by their centroid
+            worst = np.argsort(sims[np.arange(n), labels])[:len(empty)]
+            sums[empty] = x[worst]
+        centroids = _normalize(sums)
+    return labels
+
+def members_fingerprint(members, llm_model, prompt):
+    """Changes whenever a member is added, removed or edited, or the model or prompt changes."""
+    parts = sorted(f"{m['id']}:{MDProcessor.content_hash(m['content'])}" for m in members)
+    return MDProcessor.content_hash("\0".join([llm_model, prompt] + parts))
+
+def match_clusters(clusters, rollups):
+    """Pairs each cluster (list of member ids) with at most one existing rollup, greedily by
+    shared members. Returns {cluster index: rollup}."""
+    pairs = []
+    for i, members in enumerate(clusters):
+        ids = set(members)
+        for r in rollups:
+            overlap = len(ids & {str(s) for s in r['source_uuids'] or []})
+            if overlap:
+                pairs.append((overlap, i, r['id']))
+    by_id = {r['id']: r for r in rollups}
+    matched, taken = {}, set()
+    for _, i, rollup_id in sorted(pairs, key=lambda p: -p[0]):
+        if i not in matched and rollup_id not in taken:
+            matched[i] = by_id[rollup_id]
+            taken.add(rollup_id)
+    return matched
+
+class RollupBuilder:
+    def __init__(self, db, llm, llm_model, prompt=DEFAULT_ROLLUP_PROMPT, cluster_size=ROLLUP_CLUSTER_SIZE, dry_run=False):
+        self.db = db
+        self.llm = llm
+        self.llm_model = llm_model
+        self.prompt = prompt
+        self.cluster_size = cluster_size
+        self.dry_run = dry_run
+        self.embedder = make_embedder(db.get_active_embedding_model())
+        self.stats = Counter()
+
+    def _summarize(self, level, category, members):
+        """Content, title, metadata and vector of a rollup document for `members`."""
+        members = sorted(members, key=lambda m: str(m['id']))
+        text = "\n\n".join(f"## {m['title'] or m['id']}\n{m['content']}" for m in members)
+        content = self.llm.generate_content(text, self.llm_model, self.prompt, raise_errors=True)
+        keywords = Counter(k for m in members for k in (m['metadata'] or {}).get('keywords') or [] if isinstance(k, str))
+        top = [k for k, _ in keywords.most_common(ROLLUP_KEYWORDS)]
+        dates = [d for d in ((m['metadata'] or {}).get('date') for m in members) if isinstance(d, str) and d[:1].isdigit()]
+        meta = {
+            "keywords": top,
+            "date": max(dates) if dates else None,
+            "rollup": {"fingerprint": members_fingerprint(members, self.llm_model, self.prompt), "members": len(members)},
+        }
+        title = f"{level} {category}: {', '.join(top[:3])}" if top else f"{level} {category}"
+        return content, title, meta, self.embedder.encode(content).tolist()
+
+    def _cluster(self, sources, rollups):
+        x = _normalize(np.array([np.asarray(s['embedding'], dtype=np.float32) for s in sources]))
+        index = {str(s['id']): i for i, s in enumerate(sources)}
+        k = max(1, round(len(sources) / self.cluster_size))
+        # Warm start from the current rollups so clusters (and their summaries) stay put
+        init = []
+        for r in sorted(rollups, key=lambda r: -len(r['source_uuids'] or [])):
+            rows = [index[str(s)] for s in r['source_uuids'] or [] if str(s) in index]
+            if rows:
+                init.append(x[rows].mean(axis=0))
+        labels = spherical_kmeans(x, k, _normalize(np.array(init)) if init else None)
+        clusters = {}
+        for s, label in zip(sources, labels):
+            clusters.setdefault(int(label), []).append(s)
+        return list(clusters.values())
+
+    def roll_up(self, category, source_level, level):
+        sources = self.db.get_rollup_sources(category, source_level)
+        rollups = self.db.get_rollups(category, level)
+        if len(sources) < ROLLUP_MIN_SOURCES:
+            return
+        clusters = self._cluster(sources, rollups)
+        matched = match_clusters([[str(m['id']) for m in c] for c in clusters], rollups)
+
+        jobs = []
+        for i, members in enumerate(clusters):
+            rollup = matched.get(i)
+            fp = members_fingerprint(members, self.llm_model, self.prompt)
+            if rollup and ((rollup['metadata'] or {}).get('rollup') or {}).get('fingerprint') == fp:
+                self.stats["unchanged"] += 1
+                continue
+            jobs.append((str(rollup['id']) if rollup else MDProcessor.generate_uuid_v7(), members, rollup is not None))
+        stale = [r for r in rollups if r['id'] not in {m['id'] for m in matched.values()}]
+        logger.info(f"{category} {source_level}->{level}: {len(sources)} documents, {len(clusters)} clusters, "
+                    f"{len(jobs)} to summarize, {len(stale)} to remove")
+        if self.dry_run:
+            return
+
+        def run(job):
+            rollup_id, members, existing = job
+            content, title, meta, vector = self._summarize(level, category, members)
+            self.db.upsert_document(rollup_id, category, level, meta, content, vector, title=title,
+                                    embedding_model=self.embedder.model_name)
+            self.db.set_rollup_sources(rollup_id, [m['id'] for m in members])
+            self.stats["updated" if existing else "created"] += 1
+
+        with ThreadPoolExecutor(max_workers=ROLLUP_CONCURRENCY) as pool:
+            for future in [pool.submit(run, job) for job in jobs]:
+                try:
+                    future.result()
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    logger.error(f"Rollup summary failed ({category} {level}): {e}")
+        for r in stale:
+            self.db.set_rollup_sources(r['id'], [], delete=True)
+            self.stats["deleted"] += 1
+
+    def run(self, categories=None):
+        # L3 clusters the L2s just written, so the levels go strictly in order
+        for source_level, level in ROLLUP_LEVELS:
+            for category in categories or self.db.get_level_categories(source_level):
+                self.roll_up(category, source_level, level)
+        logger.info(f"Rollups done: {dict(self.stats)}")
+        return dict(self.stats)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cluster summaries into L2/L3 rollup documents.")
+    parser.add_argument("--model", required=True, help="LLM used for the rollup summaries")
+    parser.add_argument("--category", action="append", help="limit to a category (repeatable)")
+    parser.add_argument("--prompt", default=DEFAULT_ROLLUP_PROMPT)
+    parser.add_argument("--cluster-size", type=int, default=ROLLUP_CLUSTER_SIZE, help="target members per cluster")
+    parser.add_argument("--dry-run", action="store_true", help="only log the cluster plan")
+    args = parser.parse_args()
+    RollupBuilder(DBManager(), LLMClient(), args.model, args.prompt, args.cluster_size, args.dry_run).run(args.category)
@@ -0,0 +1,110 @@
+"""Process-wide cache of search result pages, shared by every Streamlit session.
+
+Streamlit reruns the search tab on every widget interaction, so most searches repeat the
+previous one exactly. Pages are cached by normalized query, filters and page size, up to
+SEARCH_CACHE_MB (least recently used pages go first; 0 disables the cache).
+
+Invalidation: statement triggers on documents and processing_tasks NOTIFY the
+`documents_changed` channel when a change commits, whichever process made it (app, workers,
+scripts). A listener thread bumps the cache generation and drops every page. While the
+listener is not connected nothing is cached, so a page is never served stale.
+"""
+import logging
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+import psycopg2.extensions
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_MB = float(os.environ.get("SEARCH_CACHE_MB", "64"))
+CHANGE_CHANNEL = "documents_changed"
+ROW_OVERHEAD_BYTES = 200 # dict and object headers per cached row, roughly
+
+def _page_size(rows):
+    return sum(ROW_OVERHEAD_BYTES + sum(len(str(v)) for v in row.values()) for row in rows)
+
+class SearchCache:
+    def __init__(self, conn_params, max_bytes):
+        self.conn_params = conn_params
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._pages = OrderedDict() # key -> (rows, size)
+        self.bytes = 0
+        self.generation = 0
+        self.listening = False
+        threading.Thread(target=self._listen, daemon=True, name="search-cache-listener").start()
+
+    def _invalidate(self, listening=None):
+        with self._lock:
+            self.generation += 1
+            self._pages.clear()
+            self.bytes = 0
+            if listening is not None:
+                self.listening = listening
+
+    def _listen(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.conn_params)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CHANGE_CHANNEL};")
+                # Changes made while not listening were missed
+                self._invalidate(listening=True)
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        self._invalidate()
+            except Exception as e:
+                logger.warning(f"Search cache listener disconnected, caching paused: {e}")
+                self._invalidate(listening=False)
+                time.sleep(5)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def get_or_load(self, key, load):
+        """Cached rows for `key`, else `load()` (stored unless a change arrived meanwhile)."""
+        with self._lock:
+            if self.listening and key in self._pages:
+                self._pages.move_to_end(key)
+                metrics.inc("search_cache_total", outcome="hit")
+                return list(self._pages[key][0])
+            generation = self.generation
+        metrics.inc("search_cache_total", outcome="miss")
+        rows = load()
+        size = _page_size(rows)
+        with self._lock:
+            if self.listening and generation == self.generation and size <= self.max_bytes:
+                if key in self._pages:
+                    self.bytes -= self._pages.pop(key)[1]
+                self._pages[key] = (rows, size)
+                self.bytes += size
+                while self.bytes > self.max_bytes:
+                    _, (_, evicted) = self._pages.popitem(last=False)
+                    self.bytes -= evicted
+        return list(rows)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_search_cache(conn_params):
+    """The process's cache (started on first use), or None when SEARCH_CACHE_MB is 0."""
+    global _cache
+    if SEARCH_CACHE_MB <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = SearchCache(conn_params, int(SEARCH_CACHE_MB * 1024 * 1024))
+        return _cache
@@ -0,0 +1,93 @@
+import argparse
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("supervisor.log"),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger("Supervisor")
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+ENGINES = {"sync": "worker.py", "async": "async_worker.py"}
+MAX_RESTART_DELAY = 60
+STABLE_AFTER = 60 # a child that ran this long gets its restart backoff reset
+
+class Child:
+    def __init__(self, slot, script, num_workers):
+        self.slot = slot
+        self.script = script
+        self.num_workers = num_workers
+        self.proc = None
+        self.started_at = 0
+        self.restart_delay = 1
+        self.restart_at = 0
+
+    def start(self):
+        # Slot: e.g. metrics port offset; process count: sizes each child's embedder pool
+        env = dict(os.environ, WORKER_SLOT=str(self.slot), WORKER_PROCESSES=str(self.num_workers))
+        self.proc = subprocess.Popen([sys.executable, os.path.join(SRC_DIR, self.script)], cwd=SRC_DIR, env=env)
+        self.started_at = time.time()
+        logger.info(f"Started worker {self.slot} ({self.script}) pid={self.proc.pid}")
+
+class Supervisor:
+    """Runs N worker processes, restarts crashed ones with exponential backoff and forwards
+    SIGTERM/SIGINT so each child can checkpoint its in-flight work. Liveness for the UI comes
+    from the children's heartbeats in the `workers` table, not from this process."""
+    def __init__(self, num_workers, engine):
+        self.children = [Child(i, ENGINES[engine], num_workers) for i in range(num_workers)]
+        self.stopping = False
+
+    def _handle_signal(self, signum, frame):
+        if self.stopping:
+            # Second signal: escalate
+            for c in self.children:
+                if c.proc and c.proc.poll() is None:
+                    c.proc.kill()
+            return
+        logger.warning(f"Received signal {signum}. Stopping workers...")
+        self.stopping = True
+        for c in self.children:
+            if c.proc and c.proc.poll() is None:
+                c.proc.send_signal(signal.SIGTERM)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+        for c in self.children:
+            c.start()
+
+        while not self.stopping:
+            now = time.time()
+            for c in self.children:
+                code = c.proc.poll() if c.proc else None
+                if c.proc and code is not None:
+                    if now - c.started_at > STABLE_AFTER:
+                        c.restart_delay = 1
+                    logger.error(f"Worker {c.slot} pid={c.proc.pid} exited with code {code}; restarting in {c.restart_delay}s")
+                    c.restart_at = now + c.restart_delay
+                    c.restart_delay = min(MAX_RESTART_DELAY, c.restart_delay * 2)
+                    c.proc = None
+                if c.proc is None and now >= c.restart_at and not self.stopping:
+                    c.start()
+            time.sleep(1)
+
+        for c in self.children:
+            if c.proc:
+                c.proc.wait()
+        logger.info("All workers stopped.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run and supervise several document workers.")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("NUM_WORKERS", "2")))
+    parser.add_argument("--engine", choices=list(ENGINES), default=os.environ.get("WORKER_ENGINE", "sync"))
+    args = parser.parse_args()
+    Supervisor(args.workers, args.engine).run()
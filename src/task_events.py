@@ -0,0 +1,61 @@
+"""Append-only task history: one task_events row per claim, executed stage (duration, model,
+tokens), completion, failed attempt and deletion, kept after the task itself is gone.
+
+    python task_events.py                       # create upcoming partitions, drop expired ones
+    python task_events.py --retention-days 90   # run daily, e.g. from cron
+
+task_events is range-partitioned by month (task_events_yYYYYmMM, plus a default partition
+for stragglers), so retention drops whole partitions instead of deleting rows. Workers
+buffer events in memory and insert them in batches with their heartbeat.
+"""
+import argparse
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+TASK_EVENTS_RETENTION_DAYS = int(os.environ.get("TASK_EVENTS_RETENTION_DAYS", "180"))
+TASK_EVENTS_MONTHS_AHEAD = 2 # partitions created ahead of the current month
+EVENT_FLUSH_SIZE = 500 # buffered events that trigger a flush before the next heartbeat
+EVENT_DETAIL_CHARS = 500
+
+class TaskEventBuffer:
+    """Thread-safe buffer of task_events rows for one worker, drained by the caller."""
+    def __init__(self, worker_id, flush_size=EVENT_FLUSH_SIZE):
+        self.worker_id = worker_id
+        self.flush_size = flush_size
+        self._lock = threading.Lock()
+        self._rows = []
+
+    def record(self, doc_id, event, stage=None, model=None, duration=None, usage=None, detail=None):
+        """Buffers one event (`duration` in seconds). Returns True once the buffer is due a flush."""
+        usage = usage or {}
+        row = (datetime.now(timezone.utc), str(doc_id), self.worker_id, event, stage, model,
+               round(duration * 1000, 1) if duration is not None else None,
+               usage.get('prompt_tokens'), usage.get('completion_tokens'),
+               str(detail)[:EVENT_DETAIL_CHARS] if detail is not None else None)
+        with self._lock:
+            self._rows.append(row)
+            return len(self._rows) >= self.flush_size
+
+    def drain(self):
+        with self._lock:
+            rows, self._rows = self._rows, []
+        return rows
+
+if __name__ == "__main__":
+    from db_manager import DBManager
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Maintain the task_events partitions.")
+    parser.add_argument("--retention-days", type=int, default=TASK_EVENTS_RETENTION_DAYS,
+                        help="drop partitions whose whole month is older than this")
+    parser.add_argument("--months-ahead", type=int, default=TASK_EVENTS_MONTHS_AHEAD)
+    args = parser.parse_args()
+
+    db = DBManager()
+    db.ensure_task_event_partitions(args.months_ahead)
+    for name in db.drop_task_event_partitions(args.retention_days):
+        logger.info(f"Dropped {name}")
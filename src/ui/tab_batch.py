@@ -1,6 +1,12 @@
 import streamlit as st
 import os
+import sys
 import json
+import subprocess
+from db_manager import TASK_PRIORITIES
+
+# Background jobs run from src/ (as run.sh starts the app), whatever the UI's working directory
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 def render_batch_tab():
     st.header("Batch LLM Processing")
@@ -54,26 +60,34 @@ def render_batch_tab():
             model_l = st.selectbox("Left Model", models, index=idx_l, key="batch_model_l")
             model_r = st.selectbox("Right Model", models, index=idx_r, key="batch_model_r")
             
+            long_options = ["(chunk instead)"] + models
+            idx_long = get_index(long_options, "model_long", 0)
+            model_long = st.selectbox("Long-Context Model", long_options, index=idx_long, key="batch_model_long",
+                                      help="Documents too large for the Left/Right model's context go here. Otherwise they are summarized in chunks.")
+            
             # Save on change (using callback or just checking state vs prefs? Callback is cleaner but Streamlit reruns script on change)
             if model_l != prefs.get("model_l"): save_prefs("model_l", model_l)
             if model_r != prefs.get("model_r"): save_prefs("model_r", model_r)
+            if model_long != prefs.get("model_long"): save_prefs("model_long", model_long)
+            
+            priority_name = st.selectbox("Priority", list(TASK_PRIORITIES.keys()), index=1, key="batch_priority",
+                                         help="Higher priority batches are claimed first. Uploaded tasks start at Low and take this priority; "
+                                              "tasks re-queued from Search with a higher priority keep theirs.")
+            batch_priority = TASK_PRIORITIES[priority_name]
             
             if st.button("Start Batch Execution", type="primary"):
                 st.session_state.llm._save_history(prompt_summary)
                 st.session_state.llm._save_history(prompt_meta)
                 
-                # Update all 'created' tasks to 'queued' with config
-                count = 0
-                for task in tasks_to_config:
-                    new_config = task['config'] or {}
-                    new_config.update({
-                        "model_l": model_l,
-                        "model_r": model_r,
-                        "prompt_summary": prompt_summary,
-                        "prompt_meta": prompt_meta
-                    })
-                    st.session_state.db.update_task(task['doc_id'], status='queued', config=new_config)
-                    count += 1
+                # Update all 'created' tasks to 'queued' with config (one statement)
+                batch_config = {
+                    "model_l": model_l,
+                    "model_r": model_r,
+                    "model_long": None if model_long == "(chunk instead)" else model_long,
+                    "prompt_summary": prompt_summary,
+                    "prompt_meta": prompt_meta
+                }
+                count = st.session_state.db.queue_tasks([t['doc_id'] for t in tasks_to_config], config=batch_config, priority=batch_priority)
                 
                 st.success(f"Queued {count} tasks! The background worker will pick them up.")
                 st.rerun()
@@ -85,13 +99,63 @@ def render_batch_tab():
     if st.button("Refresh Status"):
         st.rerun()
         
-    tasks_active = st.session_state.db.get_tasks_by_status('processing_l') + st.session_state.db.get_tasks_by_status('processing_r') + st.session_state.db.get_tasks_by_status('processing')
-    # Included 'processing' as well since we unified it in worker.py
+    tasks_active = st.session_state.db.get_tasks_by_status('processing')
     
     if tasks_active:
         st.warning(f"Currently Processing: {len(tasks_active)} docs")
         for t in tasks_active:
              fname = t['config'].get('filename', str(t['doc_id']))
-             st.text(f"Processing: {fname} [{t['status']}]")
+             stage = f" / {t['stage']}" if t.get('stage') else ""
+             st.text(f"Processing: {fname} [{t['status']}{stage}]")
     else:
         st.info("Worker is idle or all tasks done.")
+
+    # L2/L3 Rollups
+    st.divider()
+    st.subheader("Rollups (L2 / L3)")
+    st.caption("Clusters the L1 summaries of each category and writes one L2 overview per cluster, then the same "
+               "for L2 -> L3. Only clusters whose members changed are summarized again. Progress: rollup.log")
+    c_model, c_run = st.columns([2, 1])
+    models = st.session_state.llm.get_available_models()
+    rollup_model = c_model.selectbox("Rollup Model", models, key="rollup_model")
+    dry_run = c_run.checkbox("Dry run (plan only)", key="rollup_dry_run")
+    if c_run.button("Run Rollups", disabled=not models):
+        cmd = [sys.executable, os.path.join(SRC_DIR, "rollup.py"), "--model", rollup_model] + (["--dry-run"] if dry_run else [])
+        subprocess.Popen(cmd, cwd=SRC_DIR, start_new_session=True)
+        st.success("Rollup job started in the background.")
+
+    # Retries & Dead Letter Queue
+    st.divider()
+    st.subheader("Retries & Dead Letter Queue")
+    
+    tasks_retry = st.session_state.db.get_tasks_by_status('retry')
+    tasks_dead = st.session_state.db.get_tasks_by_status('dead') + st.session_state.db.get_tasks_by_status('failed')
+    
+    c_retry, c_dead = st.columns(2)
+    c_retry.metric("Waiting for Retry", len(tasks_retry))
+    c_dead.metric("Dead Letter", len(tasks_dead))
+    
+    if tasks_retry:
+        with st.expander("Show Retry Schedule"):
+            for t in tasks_retry:
+                fname = t['config'].get('filename', str(t['doc_id']))
+                st.text(f"{fname}: attempt {t.get('attempts')} failed, next at {t.get('next_attempt_at')} - {t.get('last_error')}")
+    
+    if tasks_dead:
+        def dead_label(t):
+            return f"{t['config'].get('filename', str(t['doc_id']))} ({t.get('attempts') or 0} attempts)"
+        
+        dead_by_id = {t['doc_id']: t for t in tasks_dead}
+        selected_dead = st.multiselect("Dead-lettered Tasks", list(dead_by_id.keys()), format_func=lambda x: dead_label(dead_by_id[x]))
+        for d_id in selected_dead:
+            st.caption(f"{dead_label(dead_by_id[d_id])}: {dead_by_id[d_id].get('last_error')}")
+        
+        c_sel, c_all = st.columns(2)
+        if c_sel.button("Requeue Selected", disabled=not selected_dead):
+            count = st.session_state.db.requeue_dead_tasks(selected_dead)
+            st.success(f"Requeued {count} tasks.")
+            st.rerun()
+        if c_all.button(f"Requeue All {len(tasks_dead)} Dead Tasks"):
+            count = st.session_state.db.requeue_dead_tasks()
+            st.success(f"Requeued {count} tasks.")
+            st.rerun()
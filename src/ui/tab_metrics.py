@@ -0,0 +1,250 @@
+import os
+import subprocess
+import sys
+import uuid
+import streamlit as st
+import pandas as pd
+import metrics
+from metrics import merge_histograms, histogram_quantile
+from db_manager import EMBEDDING_DIM
+from embedder import make_embedder
+
+# reembed_job.py runs from src/ like the workers
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _sum_counters(snapshots, name, *group_by):
+    totals = {}
+    for snap in snapshots:
+        for c in snap.get("counters", []):
+            if c["name"] != name:
+                continue
+            key = tuple(c["labels"].get(g, "") for g in group_by)
+            totals[key] = totals.get(key, 0) + c["value"]
+    return totals
+
+def _fmt_seconds(v):
+    if v is None:
+        return "-"
+    if v == float("inf"):
+        return "> 300s"
+    return f"{v * 1000:.0f} ms" if v < 1 else f"{v:.1f} s"
+
+def render_metrics_tab():
+    st.header("Pipeline Metrics")
+    st.caption("Aggregated from the snapshots workers write every few seconds. "
+               "Each worker also serves Prometheus metrics on :METRICS_PORT+slot/metrics.")
+
+    if st.button("🔄 Refresh", key="metrics_refresh"):
+        st.rerun()
+
+    # Queue
+    st.subheader("Queue")
+    queue = st.session_state.db.get_queue_stats()
+    if queue:
+        df_q = pd.DataFrame(queue)
+        df_q['oldest_age_seconds'] = df_q['oldest_age_seconds'].astype(float).round(0)
+        st.dataframe(df_q.sort_values('status'), hide_index=True, use_container_width=True)
+    else:
+        st.info("Queue is empty.")
+
+    rows = st.session_state.db.get_worker_metrics()
+    snapshots = [r['snapshot'] for r in rows]
+    if not snapshots:
+        st.info("No worker has reported metrics in the last hour.")
+        render_history_section()
+        render_db_section(snapshots)
+        render_embedding_section()
+        return
+    st.caption(f"{len(snapshots)} worker(s) reporting. Counters and histograms are since each worker started.")
+
+    # Stage latency
+    st.subheader("Stage Latency")
+    stage_rows = []
+    for stage, h in sorted(merge_histograms(snapshots, "stage_seconds", "stage").items()):
+        stage_rows.append({
+            "stage": stage,
+            "count": h["count"],
+            "mean": _fmt_seconds(h["sum"] / h["count"] if h["count"] else None),
+            "p50": _fmt_seconds(histogram_quantile(0.5, h["buckets"], h["counts"])),
+            "p95": _fmt_seconds(histogram_quantile(0.95, h["buckets"], h["counts"])),
+        })
+    if stage_rows:
+        st.dataframe(pd.DataFrame(stage_rows), hide_index=True, use_container_width=True)
+
+    # LLM per model
+    st.subheader("LLM Calls")
+    requests_by = _sum_counters(snapshots, "llm_requests_total", "model", "outcome")
+    prompt_tok = _sum_counters(snapshots, "llm_prompt_tokens_total", "model")
+    completion_tok = _sum_counters(snapshots, "llm_completion_tokens_total", "model")
+    gen_seconds = _sum_counters(snapshots, "llm_generation_seconds_total", "model")
+    latency = merge_histograms(snapshots, "llm_request_seconds", "model")
+
+    model_rows = []
+    for model in sorted({m for m, _ in requests_by}):
+        total = sum(v for (m, _), v in requests_by.items() if m == model)
+        errors = sum(v for (m, o), v in requests_by.items() if m == model and o != "ok")
+        h = latency.get(model)
+        secs = gen_seconds.get((model,), 0)
+        model_rows.append({
+            "model": model,
+            "requests": int(total),
+            "error rate": f"{errors / total:.1%}" if total else "-",
+            "prompt tokens": int(prompt_tok.get((model,), 0)),
+            "completion tokens": int(completion_tok.get((model,), 0)),
+            "tokens/sec": round(completion_tok.get((model,), 0) / secs, 1) if secs else None,
+            "p50": _fmt_seconds(histogram_quantile(0.5, h["buckets"], h["counts"])) if h else "-",
+            "p95": _fmt_seconds(histogram_quantile(0.95, h["buckets"], h["counts"])) if h else "-",
+        })
+    if model_rows:
+        st.dataframe(pd.DataFrame(model_rows), hide_index=True, use_container_width=True)
+
+    failures = [{"model": m, "outcome": o, "count": int(v)} for (m, o), v in sorted(requests_by.items()) if o != "ok"]
+    if failures:
+        with st.expander("Errors by outcome"):
+            st.dataframe(pd.DataFrame(failures), hide_index=True, use_container_width=True)
+
+    # Tasks
+    st.subheader("Tasks")
+    outcomes = _sum_counters(snapshots, "tasks_total", "outcome")
+    cols = st.columns(3)
+    cols[0].metric("Done", int(outcomes.get(("done",), 0)))
+    cols[1].metric("Retried", int(outcomes.get(("retry",), 0)))
+    cols[2].metric("Dead", int(outcomes.get(("dead",), 0)))
+
+    render_history_section()
+    render_db_section(snapshots)
+    render_embedding_section()
+
+def render_history_section():
+    st.subheader("Throughput History")
+    st.caption("From the task_events log, which survives worker restarts and task deletion "
+               "(monthly partitions are dropped after TASK_EVENTS_RETENTION_DAYS by task_events.py).")
+    db = st.session_state.db
+    days = st.selectbox("Period (days)", [7, 30, 90, 365], index=1, key="metrics_history_days")
+    daily = db.get_task_throughput(days)
+    if not daily:
+        st.info("No task events in this period.")
+    else:
+        df_d = pd.DataFrame(daily)
+        df_d['day'] = pd.to_datetime(df_d['day']).dt.date
+        st.bar_chart(df_d.set_index('day')[['done', 'retried', 'dead']])
+        st.dataframe(df_d, hide_index=True, use_container_width=True)
+        timings = db.get_stage_timings(days)
+        if timings:
+            df_t = pd.DataFrame(timings)
+            for col in ('p50_ms', 'p95_ms', 'avg_prompt_tokens', 'avg_completion_tokens'):
+                df_t[col] = df_t[col].astype(float).round(0)
+            st.dataframe(df_t, hide_index=True, use_container_width=True)
+
+    doc_id = st.text_input("Task history for document ID", key="metrics_history_doc").strip()
+    if doc_id:
+        try:
+            events = db.get_task_events(str(uuid.UUID(doc_id)))
+        except ValueError:
+            st.warning("Not a valid UUID.")
+            return
+        if events:
+            st.dataframe(pd.DataFrame(events), hide_index=True, use_container_width=True)
+        else:
+            st.info("No events recorded for this document.")
+
+def render_db_section(snapshots):
+    st.subheader("Database")
+    # Workers plus this Streamlit process (search, review and queue pages)
+    source = st.radio("Source", ["All", "Workers", "This app"], horizontal=True, key="metrics_db_source")
+    if source == "Workers":
+        snaps = snapshots
+    elif source == "This app":
+        snaps = [metrics.snapshot()]
+    else:
+        snaps = snapshots + [metrics.snapshot()]
+
+    held = merge_histograms(snaps, "db_seconds", "method")
+    wait = merge_histograms(snaps, "db_pool_wait_seconds", "method")
+    queries = merge_histograms(snaps, "db_query_seconds", "method")
+    method_rows = []
+    for method, h in held.items():
+        w = wait.get(method)
+        q = queries.get(method)
+        method_rows.append({
+            "method": method,
+            "calls": h["count"],
+            "total": round(h["sum"], 2),
+            "p50": _fmt_seconds(histogram_quantile(0.5, h["buckets"], h["counts"])),
+            "p95": _fmt_seconds(histogram_quantile(0.95, h["buckets"], h["counts"])),
+            "pool wait p95": _fmt_seconds(histogram_quantile(0.95, w["buckets"], w["counts"])) if w else "-",
+            "statements": q["count"] if q else 0,
+        })
+    if method_rows:
+        st.dataframe(pd.DataFrame(method_rows).sort_values("total", ascending=False),
+                     hide_index=True, use_container_width=True)
+        st.caption("total = seconds a connection was held by the method; p50/p95 per call.")
+
+    st.markdown("**Slow queries**")
+    slow = st.session_state.db.get_slow_queries()
+    if not slow:
+        st.info("No slow queries recorded (threshold: SLOW_QUERY_MS, plans: SLOW_QUERY_EXPLAIN=1).")
+        return
+    if st.button("Clear slow query log", key="metrics_clear_slow"):
+        st.session_state.db.clear_slow_queries()
+        st.rerun()
+    for q in slow:
+        label = f"{q['duration_ms']:.0f} ms · {q['method']} · {q['captured_at'].strftime('%Y-%m-%d %H:%M:%S')}"
+        with st.expander(label):
+            st.code(q['query'], language="sql")
+            if q['plan'] is not None:
+                st.json(q['plan'], expanded=False)
+
+def _start_reembed_job(job_id):
+    subprocess.Popen([sys.executable, os.path.join(SRC_DIR, "reembed_job.py"), "--job", str(job_id)], cwd=SRC_DIR,
+                     start_new_session=True)
+
+def _embedding_dim(model_name):
+    """Vector size of `model_name`, from encoding one probe sentence (loads the model here)."""
+    return len(make_embedder(model_name).encode("dimension check"))
+
+def render_embedding_section():
+    st.subheader("Embedding Versions")
+    db = st.session_state.db
+    st.caption(f"Active model: `{db.get_active_embedding_model()}`. Searches only match vectors of the active model; "
+               "a re-embedding job backfills a new model alongside it and switches over when every document is covered.")
+    counts = db.get_embedding_model_counts()
+    if counts:
+        st.dataframe(pd.DataFrame(counts), hide_index=True, use_container_width=True)
+
+    with st.form("reembed_form"):
+        new_model = st.text_input("Model", placeholder="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+        st.caption(f"documents.embedding is vector({EMBEDDING_DIM}): only models producing {EMBEDDING_DIM}-d vectors can be activated.")
+        if st.form_submit_button("Start re-embedding job") and new_model.strip():
+            try:
+                with st.spinner(f"Loading {new_model.strip()} to check its dimension..."):
+                    dim = _embedding_dim(new_model.strip())
+            except Exception as e:
+                st.error(f"Could not load {new_model.strip()}: {e}")
+            else:
+                if dim != EMBEDDING_DIM:
+                    st.error(f"{new_model.strip()} produces {dim}-d vectors; documents.embedding is vector({EMBEDDING_DIM}).")
+                else:
+                    _start_reembed_job(db.create_reembed_job(new_model.strip()))
+                    st.rerun()
+
+    for job in db.get_reembed_jobs():
+        cols = st.columns([4, 1])
+        with cols[0]:
+            label = f"#{job['id']} {job['model']} · {job['status']} · {job['done']}/{job['total']}"
+            st.progress(min(1.0, job['done'] / job['total']) if job['total'] else 0.0, text=label)
+            if job['error']:
+                st.caption(f"❌ {job['error']}")
+        with cols[1]:
+            if job['status'] in ("pending", "running"):
+                if st.button("Pause", key=f"reembed_pause_{job['id']}"):
+                    db.set_reembed_job_status(job['id'], "paused")
+                    st.rerun()
+            elif job['status'] in ("paused", "failed"):
+                if st.button("Resume", key=f"reembed_resume_{job['id']}"):
+                    _start_reembed_job(job['id'])
+                    st.rerun()
+            if job['status'] in ("pending", "running", "paused"):
+                if st.button("Cancel", key=f"reembed_cancel_{job['id']}"):
+                    db.set_reembed_job_status(job['id'], "cancelled")
+                    st.rerun()
@@ -1,30 +1,95 @@
 import streamlit as st
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from utils.md_processor import MDProcessor
 
+logger = logging.getLogger(__name__)
+
+# Re-encodes edited summaries after the save returns (one at a time, shared by all sessions).
+# Encodes lost to a restart or error are picked up by the workers' sweep (embed_missing).
+_embed_executor = ThreadPoolExecutor(max_workers=1)
+# Loads the next review item while the reviewer reads the current one
+_prefetch_executor = ThreadPoolExecutor(max_workers=2)
+REVIEW_PAGE_SIZE = 50
+
+def _precomputed_embedding(results, stage, text):
+    """Vector the worker computed for summary `stage`, if `text` is exactly what it encoded."""
+    embed = results.get('embed')
+    if not isinstance(embed, dict) or embed.get('model') != st.session_state.embedder.model_name:
+        return None
+    entry = embed.get('summaries', {}).get(stage)
+    if entry and entry['hash'] == MDProcessor.content_hash(text):
+        return entry['vector']
+    return None
+
+def _embed_in_background(db, embedder, doc_id, text):
+    try:
+        db.set_embedding(doc_id, embedder.encode(text).tolist(), embedding_model=embedder.model_name)
+    except Exception as e:
+        logger.error(f"Error embedding summary {doc_id}: {e}")
+
+def _load_review_item(listing_row):
+    """Task + parent document for a queue row, from the prefetch cache when it is still current."""
+    cache = st.session_state.setdefault("review_cache", {})
+    key = (listing_row['doc_id'], listing_row['updated_at'])
+    entry = cache.get(key)
+    if entry is None:
+        entry = cache[key] = st.session_state.db.get_review_item(listing_row['doc_id'])
+    elif isinstance(entry, Future):
+        entry = cache[key] = entry.result()
+    return entry
+
+def _prefetch_review_items(listing_rows):
+    """Starts loading the given rows in the background and drops cache entries no longer needed."""
+    cache = st.session_state.setdefault("review_cache", {})
+    wanted = {(r['doc_id'], r['updated_at']) for r in listing_rows}
+    for key in list(cache):
+        if key not in wanted:
+            del cache[key]
+    for r in listing_rows:
+        key = (r['doc_id'], r['updated_at'])
+        if key not in cache:
+            cache[key] = _prefetch_executor.submit(st.session_state.db.get_review_item, r['doc_id'])
+
 def render_review_tab():
     st.header("Review & Confirm")
     
-    # Fetch done tasks from DB
-    done_tasks = st.session_state.db.get_tasks_by_status('done')
+    # Only ids and names for the selector; results load for the selected task alone
+    total_done = st.session_state.db.count_tasks_by_status('done')
     
-    if not done_tasks:
+    if not total_done:
         st.info("No documents waiting for review.")
     else:
-        # DEBUG
-        # st.write(f"DEBUG: Found {len(done_tasks)} completed tasks")
+        page = 0
+        if total_done > REVIEW_PAGE_SIZE:
+            pages = (total_done + REVIEW_PAGE_SIZE - 1) // REVIEW_PAGE_SIZE
+            page = st.number_input(f"Page (of {pages}, {total_done} waiting)", min_value=1, max_value=pages, value=1) - 1
+        listing = st.session_state.db.get_review_queue(limit=REVIEW_PAGE_SIZE, offset=page * REVIEW_PAGE_SIZE)
+        if not listing:
+            st.info("No documents waiting for review.")
+            return
+        rows_by_id = {r['doc_id']: r for r in listing}
         
         # Helper to get name
-        def get_name(t):
-           return t['config'].get('filename', str(t['doc_id']))
+        def get_name(doc_id):
+           return rows_by_id[doc_id]['filename'] or str(doc_id)
+        
+        selected_task_id = st.selectbox("Select Pending Document", list(rows_by_id), format_func=get_name)
         
-        selected_task_id = st.selectbox("Select Pending Document", [t['doc_id'] for t in done_tasks], 
-                                     format_func=lambda x: get_name(next(item for item in done_tasks if item["doc_id"] == x)))
+        item = _load_review_item(rows_by_id[selected_task_id])
+        if not item:
+            st.warning("This task is no longer waiting for review.")
+            return
+        # The reviewer usually moves on to the next one: have it ready
+        idx = list(rows_by_id).index(selected_task_id)
+        _prefetch_review_items(listing[idx:idx + 2])
         
-        current_task = next(t for t in done_tasks if t['doc_id'] == selected_task_id)
+        current_task = item['task']
+        existing_doc = item['document']
         res = current_task['results']
         
-        st.info(f"Reviewing: {get_name(current_task)}")
+        st.info(f"Reviewing: {get_name(selected_task_id)}")
         
         # 1. Keywords Cross-Selection
         st.subheader("1. Keywords & Metadata")
@@ -50,10 +115,9 @@ def render_review_tab():
             selected_keywords = st.multiselect("Select Keywords", all_keywords, default=all_keywords)
         with col_k2:
             # Priority: 1. Parent Metadata > 2. LLM Extraction > 3. Today
-            existing_doc_peek = st.session_state.db.get_document(selected_task_id)
             parent_metadata_date = None
-            if existing_doc_peek and existing_doc_peek.get('metadata'):
-                parent_metadata_date = existing_doc_peek['metadata'].get('date')
+            if existing_doc and existing_doc.get('metadata'):
+                parent_metadata_date = existing_doc['metadata'].get('date')
             
             extracted_date = res['meta_l'].get("date") or res['meta_r'].get("date")
             
@@ -89,7 +153,6 @@ def render_review_tab():
         st.subheader("3. Final Edit & Save")
         
         # Suggested L1 Title
-        existing_doc = st.session_state.db.get_document(selected_task_id)
         parent_title = existing_doc.get('title', 'Document') if existing_doc else 'Document'
         
         # Recommendation Logic: Use AI title if available, otherwise L1_ + first 30 chars of summary
@@ -116,8 +179,6 @@ def render_review_tab():
                     doc_id = str(current_task['doc_id']) # Ensure string
                     summary_id = MDProcessor.generate_uuid_v7()
                     
-                    # existing_doc was fetched earlier or below
-                    existing_doc = st.session_state.db.get_document(selected_task_id)
                     original_meta = existing_doc['metadata'] if existing_doc else {}
                     
                     final_meta_l1 = {
@@ -136,9 +197,13 @@ def render_review_tab():
                     
                     st.session_state.db.upsert_document(doc_id, existing_doc['category'], "L0", final_meta_l0, existing_doc['content'], title=existing_doc.get('title'))
                     
-                    summary_emb = st.session_state.embedder.encode(final_summary_text).tolist()
+                    # Unedited summary: reuse the worker's vector. Edited: save now, embed after.
+                    summary_emb = _precomputed_embedding(res, "sum_l" if choice == "Left Model" else "sum_r", final_summary_text)
                     l1_title = l1_title_input.strip() if l1_title_input.strip() else f"L1_{parent_title}"
-                    st.session_state.db.upsert_document(summary_id, existing_doc['category'], "L1", final_meta_l1, final_summary_text, summary_emb, title=l1_title)
+                    st.session_state.db.upsert_document(summary_id, existing_doc['category'], "L1", final_meta_l1, final_summary_text, summary_emb, title=l1_title,
+                                                        embedding_model=st.session_state.embedder.model_name)
+                    if summary_emb is None:
+                        _embed_executor.submit(_embed_in_background, st.session_state.db, st.session_state.embedder, summary_id, final_summary_text)
                     
                     st.session_state.db.link_documents(doc_id, summary_id)
                     st.session_state.db.delete_task(doc_id)
@@ -148,6 +213,8 @@ def render_review_tab():
 
         with col_btn2:
             if st.button("Re-queue (Re-summarize)", use_container_width=True):
+                # Drop cached stage outputs so the worker really re-runs every stage
+                st.session_state.db.clear_stage_outputs(selected_task_id)
                 st.session_state.db.update_task(selected_task_id, status='queued')
                 st.info("Task returned to queue for re-processing!")
                 st.rerun()
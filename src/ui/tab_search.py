@@ -1,12 +1,52 @@
 import streamlit as st
 import pandas as pd
 import json
+import os
+from datetime import datetime
+from db_manager import TASK_PRIORITIES
+from exporter import export_documents, EXPORT_DIR
+from neighbors import similar_clusters
+
+RELATED_LIMIT = 5
+
+SEARCH_RESULT_LIMIT = 100
+
+def render_passage_results(query, category, limit):
+    """Documents ranked by their best-matching passages (db.passage_search), each shown with that passage."""
+    if not query:
+        st.info("Enter a query to search passages.")
+        return
+    query_emb = st.session_state.embedder.encode(query).tolist()
+    results = st.session_state.db.passage_search(query_emb, limit=limit, category=category)
+    if not results:
+        st.info("No matching passages. Passages are cut by the worker when it embeds a document.")
+        return
+    for row in results:
+        display_name = row['title'] if row['title'] else row['id']
+        with st.expander(f"[{row['category']} / {row['level']}] {display_name} — {row['score']:.3f}"):
+            c_info, c_down = st.columns([4, 1])
+            with c_down:
+                st.download_button(
+                    label="Download MD",
+                    data=row['content'],
+                    file_name=f"{display_name}.md",
+                    mime="text/markdown",
+                    key=f"dl_passage_{row['id']}"
+                )
+            with c_info:
+                st.write(f"**Similarity:** {row['cosine_similarity']:.3f} ({row['passage_hits']} matching passages)")
+                if row['passage_heading']:
+                    st.write(f"**Section:** {row['passage_heading']}")
+                st.markdown(row['passage'])
 
 def render_search_tab():
     st.header("Search Knowledge Base")
     col_s1, col_s2, col_s3, col_s4 = st.columns([2, 1, 1, 1])
     with col_s1:
         search_query = st.text_input("Text Search")
+        search_mode = st.radio("Mode", ["Keyword", "Semantic passages"], horizontal=True,
+                               help="Semantic passages ranks documents by their closest sections to the query "
+                                    "(level, UUID and task filters don't apply).")
     with col_s2:
         search_cat = st.selectbox("Category Filter", ["ALL"] + st.session_state.categories)
     with col_s3:
@@ -15,35 +55,40 @@ def render_search_tab():
         search_uuid = st.text_input("UUID Search")
     
     st.divider()
-    col_opt1, col_opt2 = st.columns(2)
+    col_opt1, col_opt2, col_opt3 = st.columns(3)
     with col_opt1:
         filter_no_task = st.checkbox("Show only documents WITHOUT an active task")
     with col_opt2:
         auto_expand_parent = st.checkbox("Automatically show parent content for summaries", value=True)
+    with col_opt3:
+        max_results = st.number_input("Max results", min_value=10, max_value=5000, value=SEARCH_RESULT_LIMIT, step=50)
     
     cat_filter = None if search_cat == "ALL" else search_cat
     lvl_filter = None if search_lvl == "ALL" else search_lvl
     uuid_filter = search_uuid if search_uuid else None
     
-    results = st.session_state.db.search_documents(query_text=search_query, category=cat_filter, level=lvl_filter, doc_id=uuid_filter)
-    
-    if filter_no_task and results:
-        # Filter out results that have an active task
-        new_results = []
-        for r in results:
-            if not st.session_state.db.get_task(r['id']):
-                new_results.append(r)
-        results = new_results
+    if search_mode == "Semantic passages":
+        render_passage_results(search_query, cat_filter, max_results)
+        return
+
+    # Streamed from a server-side cursor: only the first `max_results` rows are ever fetched.
+    # Reruns with the same search are served from the shared cache until a document changes.
+    results = st.session_state.db.search_page(query_text=search_query, category=cat_filter, level=lvl_filter,
+                                              doc_id=uuid_filter, without_task=filter_no_task, limit=max_results + 1)
+    render_export(search_query, cat_filter, lvl_filter, uuid_filter, filter_no_task)
+    render_similar_clusters(lvl_filter)
+
+    truncated = len(results) > max_results
+    results = results[:max_results]
 
     if results:
         df = pd.DataFrame(results)
-        # Drop large columns for display
-        if 'embedding' in df.columns:
-            display_df = df.drop(columns=['embedding'])
-        else:
-            display_df = df
+        if truncated:
+            st.caption(f"Showing the first {max_results} matches. Narrow the search or raise 'Max results' to see more.")
             
-        st.dataframe(display_df, use_container_width=True)
+        st.dataframe(df, use_container_width=True)
+        # Precomputed neighbours (neighbors.py) for the whole page in one query
+        related = st.session_state.db.get_related_many([r['id'] for r in results], limit=RELATED_LIMIT)
         
         for idx, row in df.iterrows():
             # Indentation for summaries
@@ -78,10 +123,13 @@ def render_search_tab():
                         st.info(f"**Task Status:** `{task['status']}`")
                     else:
                         st.warning("No Active Task in Queue")
-                        if st.button(f"Add to Process Queue", key=f"re_q_{row['id']}"):
+                        c_prio, c_btn = st.columns([1, 2])
+                        with c_prio:
+                            q_priority = st.selectbox("Priority", list(TASK_PRIORITIES.keys()), index=2, key=f"re_q_prio_{row['id']}")
+                        if c_btn.button(f"Add to Process Queue", key=f"re_q_{row['id']}"):
                             # Try to get filename from metadata or ID
                             fname = row['metadata'].get('filename') or str(row['id'])
-                            st.session_state.db.enqueue_task(row['id'], config={"filename": fname})
+                            st.session_state.db.enqueue_task(row['id'], config={"filename": fname}, priority=TASK_PRIORITIES[q_priority])
                             st.success(f"Added {row['id']} to processing queue!")
                             st.rerun()
 
@@ -92,7 +140,8 @@ def render_search_tab():
                             if st.button("Save & Reset Summaries", key=f"save_{row['id']}"):
                                 new_emb = st.session_state.embedder.encode(new_content).tolist()
                                 st.session_state.db.upsert_document(
-                                    row['id'], row['category'], row['level'], row['metadata'], new_content, new_emb
+                                    row['id'], row['category'], row['level'], row['metadata'], new_content, new_emb,
+                                    embedding_model=st.session_state.embedder.model_name
                                 )
                                 if row.get('summary_uuids'):
                                     for sum_id in row['summary_uuids']:
@@ -129,6 +178,11 @@ def render_search_tab():
                             s_doc = st.session_state.db.get_document(s_id)
                             if s_doc:
                                 st.write(s_doc['content'])
+
+                    if related.get(str(row['id'])):
+                        st.write("**Related:**")
+                        for r in related[str(row['id'])]:
+                            st.caption(f"{r['similarity']:.2f} · [{r['category']} / {r['level']}] {r['title'] or r['id']} (`{r['id']}`)")
                     
                     st.divider()
                     
@@ -166,3 +220,45 @@ def render_search_tab():
                             st.rerun()
     else:
         st.info("No documents found.")
+
+def render_export(query_text, category, level, doc_id, without_task):
+    with st.expander("📦 Export matching documents"):
+        st.caption("Exports every document matching the filters above (not only the listed ones). "
+                   f"Archives are written to `{EXPORT_DIR}/` on the server; for scheduled backups use `python src/exporter.py`.")
+        fmt = st.radio("Format", ["zip", "parquet"], horizontal=True, key="export_format",
+                       format_func=lambda f: {"zip": "Markdown (zip)", "parquet": "Parquet (with embeddings)"}[f])
+        if st.button("Export", key="export_run"):
+            os.makedirs(EXPORT_DIR, exist_ok=True)
+            path = os.path.join(EXPORT_DIR, f"export-{datetime.now():%Y%m%d-%H%M%S}.{fmt}")
+            with st.spinner("Exporting..."):
+                count = export_documents(st.session_state.db, fmt, path, query_text=query_text, category=category,
+                                         level=level, doc_id=doc_id, without_task=without_task)
+            st.session_state.last_export = path
+            st.success(f"Exported {count} documents to `{path}`.")
+        path = st.session_state.get("last_export")
+        if path and os.path.exists(path):
+            # Streamlit holds download data in server memory, so the file is only read on request
+            size_mb = os.path.getsize(path) / (1024 * 1024)
+            if st.button(f"Prepare download of {os.path.basename(path)} ({size_mb:.1f} MB)", key="export_prepare"):
+                with open(path, "rb") as f:
+                    st.download_button(f"Download {os.path.basename(path)}", data=f, file_name=os.path.basename(path),
+                                       key="export_download")
+
+def render_similar_clusters(level):
+    with st.expander("🧹 Near-duplicate clusters"):
+        st.caption("Groups of documents linked by very similar vectors, from the precomputed related-documents "
+                   "graph (`python src/neighbors.py`). Uses the Level filter above.")
+        min_sim = st.slider("Minimum similarity", 0.80, 1.0, 0.95, 0.01, key="dup_min_similarity")
+        if st.button("Find clusters", key="dup_find"):
+            pairs = st.session_state.db.get_similar_pairs(min_sim, level=level)
+            clusters = similar_clusters((p['a'], p['b']) for p in pairs)
+            if not clusters:
+                st.info("No documents above this similarity.")
+            elif len(clusters) > 50:
+                st.caption(f"Showing the 50 largest of {len(clusters)} clusters.")
+            labels = st.session_state.db.get_document_labels([doc_id for c in clusters[:50] for doc_id in c])
+            for cluster in clusters[:50]:
+                st.write(f"**{len(cluster)} documents**")
+                for d in (labels.get(doc_id) for doc_id in cluster):
+                    if d:
+                        st.caption(f"[{d['category']} / {d['level']}] {d['title'] or d['id']} (`{d['id']}`)")
@@ -1,7 +1,18 @@
 import streamlit as st
 from datetime import datetime
 from utils.md_processor import MDProcessor
+from db_manager import TASK_PRIORITIES
+import os
 import subprocess
+import sys
+from itertools import islice
+
+# Statuses listed under "Manage Active Queue", and how many tasks to render there at most
+QUEUE_LIST_STATUSES = ['created', 'queued', 'processing', 'retry', 'dead', 'done']
+QUEUE_LIST_LIMIT = 200
+
+# src/, where the supervisor is launched from (run.sh starts the app there, Docker does not)
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 def render_upload_tab():
     st.header("Upload or Input")
@@ -49,11 +60,14 @@ def render_upload_tab():
                 manual_meta, 
                 manual_text, 
                 parent_emb,
-                title=m_title
+                title=m_title,
+                embedding_model=st.session_state.embedder.model_name
             )
             
             # Add to Queue
-            st.session_state.db.enqueue_task(m_uuid, config={"filename": m_filename, "title": m_title})
+            # Uploads start at Low; the batch run raises them to its chosen priority
+            st.session_state.db.enqueue_task(m_uuid, config={"filename": m_filename, "title": m_title},
+                                             priority=TASK_PRIORITIES["Low"])
             
             st.success(f"Added manual text ({m_filename}) to DB Queue!")
             # Retain text? Streamlit refreshes on button press usually clearing it unless we use session state for the widget. 
@@ -102,16 +116,17 @@ def render_upload_tab():
         
     if valid_docs:
         if st.button(f"Add {len(valid_docs)} Documents to DB Processing Queue"):
-            count = 0
-            for doc in valid_docs:
-                # Add to DB Processing Queue
-                st.session_state.db.enqueue_task(doc['id'], config={"filename": doc['filename'], "title": doc['filename']}) # Save filename in config for display
-                
-                # Upsert partial L0
-                parent_emb = st.session_state.embedder.encode(doc['content']).tolist()
-                st.session_state.db.upsert_document(doc['id'], upload_cat, "L0", doc['metadata'], doc['content'], parent_emb, title=doc['filename'])
-                
-                count += 1
+            # One batched encode for all uploads
+            parent_embs = st.session_state.embedder.encode([doc['content'] for doc in valid_docs])
+            for doc, parent_emb in zip(valid_docs, parent_embs):
+                # Upsert partial L0 (first, so the task picks up its category)
+                st.session_state.db.upsert_document(doc['id'], upload_cat, "L0", doc['metadata'], doc['content'], parent_emb.tolist(), title=doc['filename'],
+                                                    embedding_model=st.session_state.embedder.model_name)
+            
+            # Add to DB Processing Queue in one transaction (filename in config for display)
+            count = st.session_state.db.enqueue_many(
+                [(doc['id'], {"filename": doc['filename'], "title": doc['filename']}) for doc in valid_docs],
+                priority=TASK_PRIORITIES["Low"])
             st.success(f"Added {count} documents to DB Queue. Go to 'Batch Processing'.")
 
     # Show Queue status from DB
@@ -119,34 +134,35 @@ def render_upload_tab():
     st.subheader("DB Processing Queue Status")
     
     # We can fetch count by status
-    tasks_created = st.session_state.db.get_tasks_by_status('created')
-    tasks_queued = st.session_state.db.get_tasks_by_status('queued')
-    tasks_processing_l = st.session_state.db.get_tasks_by_status('processing_l')
-    tasks_processing_r = st.session_state.db.get_tasks_by_status('processing_r')
-    tasks_done = st.session_state.db.get_tasks_by_status('done')
+    counts = {r['status']: r['depth'] for r in st.session_state.db.get_queue_stats()}
     
-    cols = st.columns(5)
-    cols[0].metric("Created", len(tasks_created))
-    cols[1].metric("Queued", len(tasks_queued))
-    cols[2].metric("Processing L", len(tasks_processing_l))
-    cols[3].metric("Processing R", len(tasks_processing_r))
-    cols[4].metric("Done (Wait Review)", len(tasks_done))
+    cols = st.columns(6)
+    cols[0].metric("Created", counts.get('created', 0))
+    cols[1].metric("Queued", counts.get('queued', 0))
+    cols[2].metric("Processing", counts.get('processing', 0))
+    cols[3].metric("Retry", counts.get('retry', 0))
+    cols[4].metric("Dead", counts.get('dead', 0))
+    cols[5].metric("Done (Wait Review)", counts.get('done', 0))
 
     # Manage Active Queue
     st.divider()
     st.subheader("Manage Active Queue")
     with st.expander("Show Detailed Queue Management"):
-        all_task_list = tasks_created + tasks_queued + tasks_processing_l + tasks_processing_r + tasks_done
-        if not all_task_list:
+        total_listed = sum(counts.get(k, 0) for k in QUEUE_LIST_STATUSES)
+        if not total_listed:
             st.info("No tasks in any status.")
         else:
-            if tasks_done:
+            if counts.get('done'):
                 if st.button("Clear All 'Done' Tasks"):
-                    for t in tasks_done:
-                        st.session_state.db.delete_task(t['doc_id'])
+                    st.session_state.db.delete_tasks(statuses=['done'])
                     st.rerun()
             
             st.divider()
+            if total_listed > QUEUE_LIST_LIMIT:
+                st.caption(f"Showing the oldest {QUEUE_LIST_LIMIT} of {total_listed} tasks.")
+            task_stream = st.session_state.db.iter_tasks_by_status(QUEUE_LIST_STATUSES)
+            all_task_list = list(islice(task_stream, QUEUE_LIST_LIMIT))
+            task_stream.close()
             for t in all_task_list:
                 fname = t.get('config', {}).get('filename', str(t['doc_id']))
                 with st.expander(f"**{fname}** - `{t['status']}`"):
@@ -159,7 +175,8 @@ def render_upload_tab():
                             # Re-embed and update
                             new_emb = st.session_state.embedder.encode(new_content).tolist()
                             st.session_state.db.upsert_document(
-                                doc['id'], doc['category'], doc['level'], doc['metadata'], new_content, new_emb
+                                doc['id'], doc['category'], doc['level'], doc['metadata'], new_content, new_emb,
+                                embedding_model=st.session_state.embedder.model_name
                             )
                             st.success("Changes saved!")
                             st.rerun()
@@ -178,21 +195,16 @@ def render_upload_tab():
                             st.session_state.db.delete_task(t['doc_id'])
                             st.rerun()
 
-    # Worker Status Check
-    def is_worker_running():
-        try:
-            cmd = "ps aux | grep '[w]orker.py'"
-            result = subprocess.check_output(cmd, shell=True).decode()
-            return len(result.strip()) > 0
-        except:
-            return False
-
+    # Worker Status Check (heartbeats from the `workers` table)
     st.sidebar.divider()
-    worker_ok = is_worker_running()
-    if worker_ok:
-        st.sidebar.success("✅ Worker: Running")
+    workers = st.session_state.db.get_workers()
+    alive = [w for w in workers if w['alive']]
+    if alive:
+        st.sidebar.success(f"✅ Workers: {len(alive)} running")
+        for w in alive:
+            st.sidebar.caption(f"{w['worker_id']} ({w['engine']}) - {w['status']}, {w['in_flight']} in flight, {w['tasks_done']} done")
     else:
         st.sidebar.error("❌ Worker: Stopped")
         if st.sidebar.button("Try Start Worker"):
-            subprocess.Popen(["python3", "src/worker.py"], start_new_session=True)
+            subprocess.Popen([sys.executable, os.path.join(SRC_DIR, "supervisor.py")], cwd=SRC_DIR, start_new_session=True)
             st.rerun()
@@ -1,8 +1,15 @@
 import frontmatter
 import uuid_utils as uuid
 import re
+import hashlib
 import os
 
+# Passage size for chunk embeddings: about what the embedding model reads before truncating
+# (EMBED_MAX_SEQ_LENGTH tokens), so no part of a passage is silently dropped
+PASSAGE_MAX_CHARS = 500
+_HEADING = re.compile(r'^(#{1,6})\s+(.*\S)\s*$')
+_SENTENCE_END = re.compile(r'(?<=[.!?。])\s+')
+
 class MDProcessor:
     @staticmethod
     def generate_uuid_v7(timestamp=None):
@@ -51,3 +58,88 @@ class MDProcessor:
         except:
             pass
         return meta
+
+    @staticmethod
+    def content_hash(content):
+        """Stable sha256 of the document body, used to fingerprint pipeline inputs"""
+        return hashlib.sha256((content or "").encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def passage_text(passage):
+        """Text encoded for a passage: the heading path gives it its context in the document"""
+        return f"{passage['heading']}\n{passage['content']}" if passage['heading'] else passage['content']
+
+    @staticmethod
+    def content_md5(content):
+        """md5 hex digest as Postgres md5(text) computes it, to compare with stored text in SQL"""
+        return hashlib.md5((content or "").encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _split_long(text, max_chars):
+        """Pieces of at most max_chars: at sentence ends, else at spaces, else hard cuts."""
+        pieces, current = [], ""
+        for unit in _SENTENCE_END.split(text):
+            words = unit.split(" ") if len(unit) > max_chars else [unit]
+            for word in words:
+                while len(word) > max_chars:
+                    if current:
+                        pieces.append(current)
+                        current = ""
+                    pieces.append(word[:max_chars])
+                    word = word[max_chars:]
+                sep = " " if current else ""
+                if len(current) + len(sep) + len(word) > max_chars:
+                    pieces.append(current)
+                    current, sep = "", ""
+                current += sep + word
+        if current.strip():
+            pieces.append(current)
+        return pieces
+
+    @staticmethod
+    def split_passages(content, max_chars=PASSAGE_MAX_CHARS):
+        """
+        Heading-aware passages for chunk embeddings.
+        The body (frontmatter removed) is cut at markdown headings outside code fences, and each
+        section is packed paragraph by paragraph into passages of at most max_chars.
+        Returns dicts with 'heading' (the heading path, e.g. "Setup > Database") and 'content'.
+        """
+        try:
+            body = frontmatter.loads(content).content
+        except:
+            body = content or ""
+
+        sections, path, lines, in_fence = [], [], [], False
+
+        def flush():
+            text = "\n".join(lines).strip()
+            if text:
+                sections.append((" > ".join(title for _, title in path), text))
+            lines.clear()
+
+        for line in body.splitlines():
+            if line.lstrip().startswith(("```", "~~~")):
+                in_fence = not in_fence
+            match = None if in_fence else _HEADING.match(line)
+            if match:
+                flush()
+                level = len(match.group(1))
+                path = [p for p in path if p[0] < level] + [(level, match.group(2))]
+            else:
+                lines.append(line)
+        flush()
+
+        passages = []
+        for heading, text in sections:
+            current = ""
+            for para in (p.strip() for p in re.split(r'\n\s*\n', text)):
+                if not para:
+                    continue
+                for piece in ([para] if len(para) <= max_chars else MDProcessor._split_long(para, max_chars)):
+                    if current and len(current) + 2 + len(piece) > max_chars:
+                        passages.append({"heading": heading, "content": current})
+                        current = ""
+                    current = f"{current}\n\n{piece}" if current else piece
+            if current:
+                passages.append({"heading": heading, "content": current})
+        return passages
@@ -1,8 +1,17 @@
 import time
 import json
 import logging
+import hashlib
+import signal
+import os
+import threading
+import socket
 from db_manager import DBManager
-from llm_client import LLMClient
+from llm_client import LLMClient, LLMError, track_usage
+from utils.md_processor import MDProcessor
+from cpu_stages import make_cpu_pool, embed_texts, EMBED_MODEL
+from task_events import TaskEventBuffer
+import metrics
 
 # Setup Logging
 logging.basicConfig(
@@ -15,91 +24,356 @@ logging.basicConfig(
 )
 logger = logging.getLogger("Worker")
 
+AGING_INTERVAL = 300 # seconds a queued task waits before its priority is bumped
+# Task loops per worker process. The LLM client's adaptive limiter decides how many
+# calls actually hit the server, so this only needs to be an upper bound.
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", "8"))
+STATS_INTERVAL = 60
+RETRY_CHECK_INTERVAL = 5
+HEARTBEAT_INTERVAL = 5
+EMBED_SWEEP_INTERVAL = 60 # seconds between sweeps for documents left without a vector
+EMBED_SWEEP_BATCH = 32
+# Prometheus endpoint; supervised workers get METRICS_PORT + their slot number
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9108")) + int(os.environ.get("WORKER_SLOT", "0"))
+
+# Pipeline stages in execution order: (result key, model config key, prompt config key, kind)
+# A task's `stage` column always points at the first stage that is not checkpointed yet.
+STAGES = [
+    ("meta_l", "model_l", "prompt_meta", "meta"),
+    ("sum_l", "model_l", "prompt_summary", "summary"),
+    ("meta_r", "model_r", "prompt_meta", "meta"),
+    ("sum_r", "model_r", "prompt_summary", "summary"),
+    ("embed", None, None, "embed"),
+]
+STAGE_ORDER = [s[0] for s in STAGES]
+
+# Statuses whose queue gauges are always published (0 when empty), plus any seen since start
+QUEUE_STATUSES = {"created", "queued", "processing", "retry", "dead", "done"}
+_published_statuses = set(QUEUE_STATUSES)
+
+def publish_gauges(queue_stats, limiter_stats):
+    """Queue depth/age per status and the adaptive limiter state as gauges (shared by both engines).
+    A status that drained reports 0 instead of its last depth."""
+    present = set()
+    for row in queue_stats:
+        metrics.set_gauge("queue_depth", row['depth'], status=row['status'])
+        metrics.set_gauge("queue_oldest_age_seconds", float(row['oldest_age_seconds'] or 0), status=row['status'])
+        present.add(row['status'])
+    _published_statuses.update(present)
+    for status in _published_statuses - present:
+        metrics.set_gauge("queue_depth", 0, status=status)
+        metrics.set_gauge("queue_oldest_age_seconds", 0.0, status=status)
+    for st in limiter_stats:
+        metrics.set_gauge("llm_concurrency_limit", st['limit'], endpoint=st['endpoint'], model=st['model'])
+        metrics.set_gauge("llm_in_flight", st['in_flight'], endpoint=st['endpoint'], model=st['model'])
+        metrics.set_gauge("llm_queue_delay_seconds", st['queue_delay_ms'] / 1000, endpoint=st['endpoint'], model=st['model'])
+
+def stage_fingerprint(content_hash, model, prompt, kind):
+    """Hash of every input that determines a stage's output."""
+    h = hashlib.sha256()
+    for part in (kind, model or "", prompt or "", content_hash):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+# Summaries the embed stage pre-encodes so the review tab can save without running the model
+SUMMARY_STAGES = ("sum_l", "sum_r")
+
+def embed_inputs(doc, results, model, passages=()):
+    """Texts for the embed stage by key: each summary, plus the L0 body ("doc") when it has
+    no vector from `model` yet, plus "passage:<i>" for each passage to (re-)encode."""
+    texts = {k: results[k] for k in SUMMARY_STAGES if isinstance(results.get(k), str) and results[k].strip()}
+    if doc.get('embedding') is None or doc.get('embedding_model') != model:
+        texts['doc'] = doc['content']
+    for i, p in enumerate(passages):
+        texts[f"passage:{i}"] = MDProcessor.passage_text(p)
+    return texts
+
+def passage_vectors(texts, vectors, passages):
+    """Vectors of the "passage:<i>" texts, in passage order."""
+    by_key = dict(zip(texts, vectors))
+    return [by_key[f"passage:{i}"] for i in range(len(passages))]
+
+def embed_input_hash(content_hash, results):
+    """Stands in for the content hash in the embed fingerprint: the summaries are inputs too."""
+    return MDProcessor.content_hash("\0".join([content_hash] + [str(results.get(k) or "") for k in SUMMARY_STAGES]))
+
+def embed_output(texts, vectors, model):
+    """Embed stage result: model plus a vector per summary, keyed by the hash of the exact text encoded."""
+    by_key = dict(zip(texts, vectors))
+    return {
+        "model": model,
+        "summaries": {k: {"hash": MDProcessor.content_hash(texts[k]), "vector": v} for k, v in by_key.items() if k in SUMMARY_STAGES},
+    }
+
+class ShutdownRequested(Exception):
+    pass
+
 class BackgroundWorker:
     def __init__(self):
         self.db = DBManager()
         self.llm = LLMClient()
-        logger.info("Worker Initialized")
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        # Embedding runs in a process pool so it doesn't hold the GIL of the task loops
+        self.cpu_pool = make_cpu_pool(EMBED_MODEL)
+        # Follows the database's active embedding model (re-read with every heartbeat)
+        self.embed_model = self.db.get_active_embedding_model()
+        self.stopping = False
+        self.in_flight = 0
+        self.tasks_done = 0
+        self._counter_lock = threading.Lock()
+        # task_events rows, written with the heartbeat (or as soon as the buffer fills up)
+        self.events = TaskEventBuffer(self.worker_id)
+        logger.info(f"Worker Initialized ({self.worker_id})")
+        self.heartbeat()
         self._recover_stuck_tasks()
 
+    def heartbeat(self, status="running"):
+        self.db.heartbeat(self.worker_id, socket.gethostname(), os.getpid(), "sync", status, self.in_flight, self.tasks_done)
+
+    def publish_metrics(self):
+        publish_gauges(self.db.get_queue_stats(), self.llm.get_limiter_stats())
+        self.db.save_worker_metrics(self.worker_id, metrics.snapshot())
+
+    def embed_missing(self):
+        """Encodes documents that were saved without a vector and have no task to embed them."""
+        docs = self.db.get_unembedded_documents(EMBED_SWEEP_BATCH)
+        if not docs:
+            return
+        model = self.embed_model
+        vectors = self.cpu_pool.submit(embed_texts, [d['content'] for d in docs], model).result()
+        self.db.fill_embeddings(model, [(d['id'], d['content_md5'], vec) for d, vec in zip(docs, vectors)])
+        logger.info(f"Embedded {len(docs)} document(s) saved without a vector.")
+
+    def record_event(self, doc_id, event, **fields):
+        if self.events.record(doc_id, event, **fields):
+            self.flush_events()
+
+    def flush_events(self):
+        rows = self.events.drain()
+        if rows and not self.db.insert_task_events(rows):
+            logger.warning(f"Dropped {len(rows)} task events")
+
+    def install_signal_handlers(self):
+        """First SIGTERM/SIGINT lets the in-flight call finish and checkpoint; a second one aborts."""
+        def _handler(signum, frame):
+            if self.stopping:
+                raise SystemExit(1)
+            logger.warning(f"Received signal {signum}. Finishing in-flight stage before exit...")
+            self.stopping = True
+        signal.signal(signal.SIGTERM, _handler)
+        signal.signal(signal.SIGINT, _handler)
+
     def _recover_stuck_tasks(self):
-        """Reset any tasks stuck in processing state back to queued on startup."""
-        stuck_l = self.db.get_tasks_by_status('processing_l')
-        stuck_r = self.db.get_tasks_by_status('processing_r')
-        count = 0
-        
-        for task in stuck_l + stuck_r:
-            logger.warning(f"Recovering stuck task {task['doc_id']} from {task['status']} to queued")
-            self.db.update_task(task['doc_id'], status='queued')
-            count += 1
-            
-        if count > 0:
-            logger.info(f"Recovered {count} stuck tasks.")
+        """Requeue 'processing' tasks whose worker died (never a live sibling's).
+        Their checkpoints are kept, so they resume at the first incomplete stage."""
+        recovered = self.db.recover_orphaned_tasks()
+        for doc_id in recovered:
+            logger.warning(f"Recovered stuck task {doc_id} to queued")
+        if recovered:
+            logger.info(f"Recovered {len(recovered)} stuck tasks.")
 
-    def run(self):
-        logger.info("Worker Interrupted. Starting loop...")
-        while True:
+    def _run_stage(self, kind, doc, model, prompt, results):
+        if kind == "meta":
+            return self.llm.extract_metadata(doc['content'], model, prompt, raise_errors=True)
+        if kind == "summary":
+            return self.llm.generate_content(doc['content'], model, prompt, raise_errors=True)
+        # embed: both candidate summaries, and the L0 and its passages only when they have
+        # no current vectors (one batch)
+        passages = []
+        if doc['level'] == 'L0' and not self.db.chunks_current(doc['id'], model):
+            passages = MDProcessor.split_passages(doc['content'])
+        texts = embed_inputs(doc, results, model, passages)
+        vectors = self.cpu_pool.submit(embed_texts, list(texts.values()), model).result() if texts else []
+        output = embed_output(texts, vectors, model)
+        if 'doc' in texts:
+            self.db.set_embedding(doc['id'], dict(zip(texts, vectors))['doc'], embedding_model=model)
+        if passages:
+            self.db.save_document_chunks(model, [(doc['id'], doc['content'], passages, passage_vectors(texts, vectors, passages))])
+        return output
+
+    def process_task(self, task, doc):
+        doc_id = task['doc_id']
+        config = task['config']
+        current_results = task['results'] or {}
+        checkpoints = current_results.get('checkpoints', {})
+        content_hash = MDProcessor.content_hash(doc['content'])
+        cached = self.db.get_stage_outputs(doc_id)
+
+        for key, model_key, prompt_key, kind in STAGES:
+            if kind == "embed":
+                model = self.embed_model
+            else:
+                # Oversize documents go to the long-context model if one is configured,
+                # otherwise LLMClient falls back to chunked summarization
+                model = self.llm.route_model(config.get(model_key), doc['content'], config.get('model_long'))
+                if model != config.get(model_key):
+                    current_results.setdefault('stage_models', {})[key] = model
+            prompt = config.get(prompt_key) if prompt_key else None
+            input_hash = embed_input_hash(content_hash, current_results) if kind == "embed" else content_hash
+            fp = stage_fingerprint(input_hash, model, prompt, kind)
+
+            # Checkpointed in this task (e.g. before a crash/restart) -> resume past it
+            if checkpoints.get(key) == fp and key in current_results:
+                continue
+
+            # Inputs unchanged since an earlier run -> reuse the stored output
+            if key in cached and cached[key]['fingerprint'] == fp:
+                logger.info(f"Processing {doc_id} - {key} unchanged, skipping")
+                current_results[key] = cached[key]['output']
+                checkpoints[key] = fp
+                current_results['checkpoints'] = checkpoints
+                continue
+
+            if self.stopping:
+                # Leave the task queued at its first incomplete stage
+                self.db.update_task(doc_id, status='queued', stage=key, results=current_results)
+                raise ShutdownRequested()
+
+            logger.info(f"Processing {doc_id} - {key} ({model})")
+            self.db.update_task(doc_id, stage=key)
+            stage_start = time.monotonic()
+            with track_usage() as usage:
+                output = self._run_stage(kind, doc, model, prompt, current_results)
+            duration = time.monotonic() - stage_start
+            metrics.observe("stage_seconds", duration, stage=key)
+            self.record_event(doc_id, "stage", stage=key, model=model, duration=duration,
+                              usage=usage if kind != "embed" else None)
+            current_results[key] = output
+
+            self.db.save_stage_output(doc_id, key, fp, output)
+            checkpoints[key] = fp
+            current_results['checkpoints'] = checkpoints
+
+            # Checkpoint: output and resume pointer are written together
+            next_idx = STAGE_ORDER.index(key) + 1
+            next_stage = STAGE_ORDER[next_idx] if next_idx < len(STAGE_ORDER) else 'complete'
+            self.db.update_task(doc_id, stage=next_stage, results=current_results)
+
+        # Complete
+        self.db.update_task(doc_id, status='done', stage='complete', results=current_results)
+        logger.info(f"Completed {doc_id}")
+
+    def _handle_task(self, task, loop_id):
+        """Runs one claimed task. Returns False when the loop should stop (shutdown)."""
+        doc_id = task['doc_id']
+        doc = self.db.get_document(doc_id)
+
+        self.record_event(doc_id, "claimed", stage=task.get('stage'))
+
+        if not doc:
+            logger.error(f"Doc {doc_id} not found in documents table.")
+            status = self.db.fail_task(doc_id, "Document not found", transient=False)
+            self.record_event(doc_id, status or "failed", detail="Document not found")
+            return True
+
+        logger.info(f"[loop {loop_id}] Claimed {doc_id} (priority {task.get('priority')}, category {task.get('category')})")
+        claimed_at = time.monotonic()
+        try:
+            self.process_task(task, doc)
+            metrics.inc("tasks_total", outcome="done")
+            self.record_event(doc_id, "done", duration=time.monotonic() - claimed_at)
+            with self._counter_lock:
+                self.tasks_done += 1
+        except ShutdownRequested:
+            logger.info(f"Checkpointed {doc_id} for shutdown.")
+            return False
+        except LLMError as e:
+            status = self.db.fail_task(doc_id, e, transient=e.transient)
+            metrics.inc("tasks_total", outcome=status)
+            self.record_event(doc_id, status or "failed", duration=time.monotonic() - claimed_at, detail=e)
+            logger.error(f"LLM error processing {doc_id} -> {status}: {e}")
+        except Exception as e:
+            status = self.db.fail_task(doc_id, e, transient=True)
+            metrics.inc("tasks_total", outcome=status)
+            self.record_event(doc_id, status or "failed", duration=time.monotonic() - claimed_at, detail=e)
+            logger.error(f"Error processing {doc_id} -> {status}: {e}")
+        return True
+
+    def _task_loop(self, loop_id):
+        last_category = None
+        while not self.stopping:
             try:
-                # 1. Fetch queued tasks
-                tasks = self.db.get_tasks_by_status('queued')
-                
-                if not tasks:
+                # 1. Claim the next task (priority, then round-robin over categories, cheapest first)
+                task = self.db.claim_next_task(after_category=last_category, worker_id=self.worker_id)
+
+                if not task:
                     time.sleep(2) # Wait if no tasks
                     continue
-                
-                logger.info(f"Found {len(tasks)} queued tasks. Starting batch...")
-                
-                # Update status to processing (to avoid double pick-up if we had multiple workers, 
-                # though here we have one. Good practice.)
-                # Also, we want to run Left Model first for ALL, then Right Model for ALL.
-                
-                for task in tasks:
-                    doc_id = task['doc_id']
-                    config = task['config']
-                    doc = self.db.get_document(doc_id)
-                    
-                    if not doc:
-                        logger.error(f"Doc {doc_id} not found in documents table.")
-                        self.db.update_task(doc_id, status='failed', results={"error": "Document not found"})
-                        continue
-
-                    # Update status to processing
-                    self.db.update_task(doc_id, status='processing')
-                    
-                    try:
-                        current_results = task['results'] or {}
-                        
-                        # --- Left Model ---
-                        logger.info(f"Processing {doc_id} - Left Model ({config.get('model_l')})")
-                        meta_l = self.llm.extract_metadata(doc['content'], config['model_l'], config['prompt_meta'])
-                        sum_l = self.llm.generate_content(doc['content'], config['model_l'], config['prompt_summary'])
-                        current_results['meta_l'] = meta_l
-                        current_results['sum_l'] = sum_l
-                        
-                        # Save partial (optional, but good for debugging)
-                        self.db.update_task(doc_id, results=current_results)
-                        
-                        # --- Right Model ---
-                        logger.info(f"Processing {doc_id} - Right Model ({config.get('model_r')})")
-                        meta_r = self.llm.extract_metadata(doc['content'], config['model_r'], config['prompt_meta'])
-                        sum_r = self.llm.generate_content(doc['content'], config['model_r'], config['prompt_summary'])
-                        current_results['meta_r'] = meta_r
-                        current_results['sum_r'] = sum_r
-                        
-                        # Complete
-                        self.db.update_task(doc_id, status='done', results=current_results)
-                        logger.info(f"Completed {doc_id}")
-                        
-                    except Exception as e:
-                        logger.error(f"Error processing {doc_id}: {e}")
-                        self.db.update_task(doc_id, status='failed', results={"error": str(e)})
-                
-                logger.info("Batch complete. Waiting for new tasks...")
-                
+                with self._counter_lock:
+                    self.in_flight += 1
+                try:
+                    if self._handle_task(task, loop_id) is False:
+                        break
+                finally:
+                    with self._counter_lock:
+                        self.in_flight -= 1
+                last_category = task.get('category')
+
             except Exception as main_e:
                 logger.error(f"Worker Loop Error: {main_e}")
                 time.sleep(5)
 
+    def run(self):
+        metrics.start_http_server(METRICS_PORT)
+        logger.info(f"Worker Interrupted. Starting {WORKER_CONCURRENCY} task loops...")
+        loops = [threading.Thread(target=self._task_loop, args=(i,), daemon=True) for i in range(WORKER_CONCURRENCY)]
+        for t in loops:
+            t.start()
+
+        # Main thread: signals, heartbeats, recovery, aging and limiter stats
+        last_aging = 0
+        last_retry_check = 0
+        last_heartbeat = 0
+        last_sweep = 0
+        last_stats = time.time()
+        while not self.stopping:
+            if time.time() - last_heartbeat > HEARTBEAT_INTERVAL:
+                self.heartbeat()
+                self.publish_metrics()
+                self.flush_events()
+                # Tasks of crashed sibling workers go back to the queue
+                self._recover_stuck_tasks()
+                self.embed_model = self.db.get_active_embedding_model()
+                last_heartbeat = time.time()
+            # Aging: periodically lift long-waiting tasks so bulk uploads still drain
+            if time.time() - last_aging > AGING_INTERVAL:
+                aged = self.db.age_queued_tasks(AGING_INTERVAL)
+                if aged:
+                    logger.info(f"Aged {aged} queued tasks.")
+                last_aging = time.time()
+            # Retries whose backoff elapsed go back into the queue
+            if time.time() - last_retry_check > RETRY_CHECK_INTERVAL:
+                promoted = self.db.promote_due_retries()
+                if promoted:
+                    logger.info(f"Re-queued {promoted} tasks for retry.")
+                last_retry_check = time.time()
+            if time.time() - last_sweep > EMBED_SWEEP_INTERVAL:
+                try:
+                    self.embed_missing()
+                except Exception as e:
+                    logger.error(f"Error embedding documents without a vector: {e}")
+                last_sweep = time.time()
+            if time.time() - last_stats > STATS_INTERVAL:
+                for st in self.llm.check_health():
+                    logger.info(f"LLM endpoint {st['endpoint']} healthy={st['healthy']} outstanding={st['outstanding']}")
+                for st in self.llm.get_limiter_stats():
+                    logger.info(f"LLM limiter {st}")
+                last_stats = time.time()
+            time.sleep(1)
+
+        # Keep heartbeating while in-flight tasks drain (up to one LLM timeout), or
+        # siblings would take this worker for dead and requeue its tasks
+        while any(t.is_alive() for t in loops):
+            self.heartbeat("stopping")
+            for t in loops:
+                t.join(timeout=HEARTBEAT_INTERVAL / len(loops))
+        self.flush_events()
+        self.cpu_pool.shutdown()
+        self.heartbeat("stopped")
+        logger.info("Worker stopped.")
+
 if __name__ == "__main__":
     worker = BackgroundWorker()
+    worker.install_signal_handlers()
     worker.run()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The app runs from src/ and imports its modules top-level (db_manager, utils.md_processor, ...)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
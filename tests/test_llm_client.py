@@ -0,0 +1,138 @@
+import pytest
+
+pytest.importorskip("requests")
+import llm_client
+from llm_client import AdaptiveLimiter, Endpoint, LLMClient
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(llm_client.time, "monotonic", clock)
+    return clock
+
+
+def test_limiter_grows_while_latency_stays_near_baseline(clock):
+    lim = AdaptiveLimiter(initial=2)
+    for _ in range(4):
+        lim.acquire()
+        lim.release(1.0, tokens=100)
+    assert lim.limit > 2
+    assert lim.successes == 4 and lim.in_flight == 0
+
+
+def test_limiter_halves_on_overload_down_to_min(clock):
+    lim = AdaptiveLimiter(initial=8, min_limit=1)
+    lim.acquire()
+    lim.release(None, overloaded=True)
+    assert lim.limit == 4
+    for _ in range(5):
+        lim.acquire()
+        lim.release(None, overloaded=True)
+    assert lim.limit == 1
+    assert lim.drops == 6
+
+
+def test_limiter_shrinks_when_latency_rises(clock):
+    lim = AdaptiveLimiter(initial=4, tolerance=1.5)
+    lim.acquire()
+    lim.release(1.0, tokens=10)
+    limit = lim.limit
+    for _ in range(5):
+        lim.acquire()
+        lim.release(10.0, tokens=10)
+    assert lim.limit < limit
+
+
+def test_limiter_has_no_slot_at_limit(clock):
+    lim = AdaptiveLimiter(initial=2)
+    lim.acquire()
+    lim.acquire()
+    assert not lim._has_slot()
+    lim.release(None)
+    assert lim._has_slot()
+
+
+def test_limiter_baseline_is_windowed_minimum(clock):
+    lim = AdaptiveLimiter(baseline_window=60)
+    lim.acquire()
+    lim.release(1.0, tokens=10)     # 0.1 s/token
+    clock.now += 30
+    lim.acquire()
+    lim.release(3.0, tokens=10)     # 0.3 s/token
+    assert lim.baseline == pytest.approx(0.1)
+    # Once the fast sample leaves the window the baseline follows the slower one
+    clock.now += 45
+    lim.acquire()
+    lim.release(5.0, tokens=10)
+    assert lim.baseline == pytest.approx(0.3)
+
+
+def test_endpoint_ejected_after_consecutive_failures_and_half_open():
+    ep = Endpoint("http://llm")
+    for _ in range(Endpoint.FAILURE_THRESHOLD - 1):
+        ep.record_failure()
+    assert ep.is_healthy()
+    ep.record_failure()
+    assert not ep.is_healthy()
+    # Half-open: a single failure after the cooldown ejects again, for longer
+    first_until = ep.ejected_until
+    ep.ejected_until = 0
+    ep.record_failure()
+    assert not ep.is_healthy() and ep.ejected_until > first_until
+    ep.record_success()
+    assert ep.is_healthy() and ep.consecutive_failures == 0
+
+
+@pytest.fixture
+def client():
+    client = LLMClient(base_url="http://llm")
+    client.endpoints["http://llm"].model_info = {"small": {"context_window": 1000},
+                                                 "big": {"context_window": 100000}}
+    return client
+
+
+def test_settle_call_outcomes(client, clock):
+    ep = client.endpoints["http://llm"]
+    lim = AdaptiveLimiter(initial=8)
+
+    lim.acquire()
+    client._settle_call(ep, lim, "small", "429")
+    assert lim.limit == 4 and ep.consecutive_failures == 0
+
+    lim.acquire()
+    client._settle_call(ep, lim, "small", "503")
+    assert lim.limit == 2 and ep.consecutive_failures == 1
+
+    lim.acquire()
+    client._settle_call(ep, lim, "small", "error")
+    assert lim.limit == 2 and lim.drops == 2
+
+    lim.acquire()
+    client._settle_call(ep, lim, "small", "ok", 1.0, {"usage": {"completion_tokens": 10}})
+    assert ep.consecutive_failures == 0 and lim.successes == 1 and lim.in_flight == 0
+
+
+def test_route_model(client):
+    short, long_text, huge = "x" * 1000, "x" * 5000, "x" * 1000000
+    assert client.route_model("small", short, "big") == "small"
+    assert client.route_model("small", long_text, "big") == "big"
+    assert client.route_model("small", long_text) == "small"
+    # Too long for both: stay on the requested model and take the chunked path
+    assert client.route_model("small", huge, "big") == "small"
+
+
+def test_split_for_budget():
+    text = "\n\n".join(["a" * 30, "b" * 30, "c" * 120, "d" * 10])
+    chunks = LLMClient._split_for_budget(text, 70)
+    # The tail of a hard-cut paragraph is packed with the next one
+    assert chunks == ["a" * 30 + "\n\n" + "b" * 30, "c" * 70, "c" * 50 + "\n\n" + "d" * 10]
+    assert all(len(c) <= 70 for c in chunks)
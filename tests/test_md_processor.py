@@ -0,0 +1,48 @@
+import hashlib
+import pytest
+
+pytest.importorskip("frontmatter")
+pytest.importorskip("uuid_utils")
+from utils.md_processor import MDProcessor
+
+
+def test_content_md5_matches_postgres_md5():
+    assert MDProcessor.content_md5("héllo") == hashlib.md5("héllo".encode("utf-8")).hexdigest()
+    assert MDProcessor.content_md5(None) == MDProcessor.content_md5("")
+
+
+def test_split_passages_uses_heading_path_and_drops_frontmatter():
+    doc = "---\ntitle: T\n---\nIntro text.\n\n# Setup\nInstall it.\n\n## Database\nCreate the DB.\n\n# Usage\nRun it."
+    passages = MDProcessor.split_passages(doc)
+    assert passages == [
+        {"heading": "", "content": "Intro text."},
+        {"heading": "Setup", "content": "Install it."},
+        {"heading": "Setup > Database", "content": "Create the DB."},
+        {"heading": "Usage", "content": "Run it."},
+    ]
+
+
+def test_split_passages_ignores_headings_in_code_fences():
+    doc = "# Code\n```\n# not a heading\n```\nafter"
+    passages = MDProcessor.split_passages(doc)
+    assert [p["heading"] for p in passages] == ["Code"]
+    assert "# not a heading" in passages[0]["content"]
+
+
+def test_split_passages_packs_paragraphs_within_max_chars():
+    paras = ["word " * 10, "word " * 10, "word " * 10]
+    passages = MDProcessor.split_passages("\n\n".join(p.strip() for p in paras), max_chars=100)
+    assert len(passages) == 2
+    assert all(len(p["content"]) <= 100 for p in passages)
+
+
+def test_split_passages_cuts_oversize_paragraphs():
+    text = "First sentence here. " * 20 + "x" * 150
+    passages = MDProcessor.split_passages(text, max_chars=60)
+    assert all(len(p["content"]) <= 60 for p in passages)
+    assert "".join(p["content"] for p in passages).replace(" ", "") == text.replace(" ", "")
+
+
+def test_passage_text_prefixes_heading():
+    assert MDProcessor.passage_text({"heading": "A > B", "content": "body"}) == "A > B\nbody"
+    assert MDProcessor.passage_text({"heading": "", "content": "body"}) == "body"
@@ -0,0 +1,54 @@
+import metrics
+from metrics import Registry, histogram_quantile, merge_histograms
+
+
+def test_render_prometheus_counters_gauges_and_histograms():
+    reg = Registry()
+    reg.inc("requests_total", model="a")
+    reg.inc("requests_total", 2, model="a")
+    reg.set_gauge("in_flight", 3)
+    reg.observe("latency_seconds", 0.3, buckets=(0.1, 0.5), model='say "hi"')
+    reg.observe("latency_seconds", 2, buckets=(0.1, 0.5), model='say "hi"')
+    lines = reg.render_prometheus().splitlines()
+
+    assert lines[:4] == [
+        "# TYPE requests_total counter",
+        'requests_total{model="a"} 3',
+        "# TYPE in_flight gauge",
+        "in_flight 3",
+    ]
+    # Buckets are cumulative, +Inf equals the count, and quotes in label values are replaced
+    assert lines[4:] == [
+        "# TYPE latency_seconds histogram",
+        "latency_seconds_bucket{model=\"say 'hi'\",le=\"0.1\"} 0",
+        "latency_seconds_bucket{model=\"say 'hi'\",le=\"0.5\"} 1",
+        "latency_seconds_bucket{model=\"say 'hi'\",le=\"+Inf\"} 2",
+        "latency_seconds_sum{model=\"say 'hi'\"} 2.3",
+        "latency_seconds_count{model=\"say 'hi'\"} 2",
+    ]
+
+
+def test_render_prometheus_type_line_once_per_name():
+    reg = Registry()
+    reg.inc("calls_total", outcome="ok")
+    reg.inc("calls_total", outcome="error")
+    assert reg.render_prometheus().count("# TYPE calls_total counter") == 1
+
+
+def test_histogram_quantile():
+    assert histogram_quantile(0.5, [1, 2], [0, 0, 0]) is None
+    assert histogram_quantile(0.5, [1, 2], [1, 1, 0]) == 1
+    assert histogram_quantile(0.99, [1, 2], [1, 1, 0]) == 2
+    assert histogram_quantile(0.99, [1, 2], [0, 0, 5]) == float("inf")
+
+
+def test_merge_histograms_across_snapshots():
+    a, b = Registry(), Registry()
+    a.observe("db_seconds", 0.002, method="get_task")
+    b.observe("db_seconds", 0.2, method="get_task")
+    b.observe("db_seconds", 0.2, method="heartbeat")
+    merged = merge_histograms([a.snapshot(), b.snapshot()], "db_seconds", "method")
+    assert merged["get_task"]["count"] == 2
+    assert sum(merged["get_task"]["counts"]) == 2
+    assert merged["heartbeat"]["count"] == 1
+    assert merged["get_task"]["buckets"] == list(metrics.LATENCY_BUCKETS)
@@ -0,0 +1,22 @@
+import pytest
+
+for module in ("numpy", "psycopg2", "pgvector", "frontmatter", "uuid_utils"):
+    pytest.importorskip(module)
+from neighbors import similar_clusters
+
+
+def test_similar_clusters_connected_components_largest_first():
+    pairs = [("a", "b"), ("c", "d"), ("b", "e"), ("f", "g"), ("e", "a")]
+    clusters = [sorted(c) for c in similar_clusters(pairs)]
+    assert clusters[0] == ["a", "b", "e"]
+    assert sorted(clusters[1:]) == [["c", "d"], ["f", "g"]]
+
+
+def test_similar_clusters_ids_are_strings():
+    import uuid
+    u = uuid.uuid4()
+    assert similar_clusters([(u, str(u))]) == [[str(u)]]
+
+
+def test_similar_clusters_empty():
+    assert similar_clusters([]) == []
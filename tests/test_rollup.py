@@ -0,0 +1,36 @@
+import pytest
+
+for module in ("numpy", "psycopg2", "pgvector", "requests", "frontmatter", "uuid_utils"):
+    pytest.importorskip(module)
+import numpy as np
+from rollup import spherical_kmeans
+
+
+def _unit(rows):
+    x = np.asarray(rows, dtype=np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def _two_groups(seed=0):
+    rng = np.random.default_rng(seed)
+    a = np.array([1.0, 0.0, 0.0]) + rng.normal(0, 0.05, (10, 3))
+    b = np.array([0.0, 1.0, 0.0]) + rng.normal(0, 0.05, (10, 3))
+    return _unit(np.vstack([a, b]))
+
+
+def test_spherical_kmeans_separates_directions():
+    labels = spherical_kmeans(_two_groups(), 2)
+    assert len(set(labels[:10])) == 1 and len(set(labels[10:])) == 1
+    assert labels[0] != labels[10]
+
+
+def test_spherical_kmeans_warm_start_keeps_label_order():
+    x = _two_groups()
+    labels = spherical_kmeans(x, 2, init=_unit([[0, 1, 0], [1, 0, 0]]))
+    assert set(labels[:10]) == {1} and set(labels[10:]) == {0}
+
+
+def test_spherical_kmeans_caps_k_at_point_count():
+    x = _unit([[1, 0], [0, 1], [-1, 0]])
+    labels = spherical_kmeans(x, 10)
+    assert sorted(labels) == [0, 1, 2]
@@ -0,0 +1,21 @@
+import pytest
+
+for module in ("psycopg2", "pgvector", "requests", "frontmatter", "uuid_utils"):
+    pytest.importorskip(module)
+from worker import stage_fingerprint
+
+
+def test_stage_fingerprint_changes_with_every_input():
+    base = stage_fingerprint("hash", "model", "prompt", "sum_l")
+    assert base == stage_fingerprint("hash", "model", "prompt", "sum_l")
+    assert len({base,
+                stage_fingerprint("other", "model", "prompt", "sum_l"),
+                stage_fingerprint("hash", "other", "prompt", "sum_l"),
+                stage_fingerprint("hash", "model", "other", "sum_l"),
+                stage_fingerprint("hash", "model", "prompt", "sum_r")}) == 5
+
+
+def test_stage_fingerprint_separates_fields():
+    # Concatenation alone would make these equal
+    assert stage_fingerprint("h", "ab", "c", "k") != stage_fingerprint("h", "a", "bc", "k")
+    assert stage_fingerprint("h", None, None, "k") == stage_fingerprint("h", "", "", "k")